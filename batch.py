@@ -0,0 +1,66 @@
+import asyncio
+import argparse
+import os
+import sys
+import logging
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.abspath('.'))
+
+from src.utils.logging_utils import setup_logging
+
+# Настройка логирования (запись в лог выполняется в фоновом потоке)
+setup_logging()
+logger = logging.getLogger(__name__)
+
+from src.config.config import BATCH_CONFIG
+from src.services.batch_processor import BatchProcessor, load_manifest, open_result_sink
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Пакетная обработка текстов, изображений и файлов через Gemini"
+    )
+    parser.add_argument('manifest', help="JSONL-манифест заданий")
+    parser.add_argument('-o', '--output', required=True,
+                        help="Файл результатов (.jsonl или .db/.sqlite)")
+    parser.add_argument('--format', choices=['jsonl', 'sqlite'], default=None,
+                        help="Формат результатов (по умолчанию по расширению файла)")
+    parser.add_argument('-c', '--concurrency', type=int, default=BATCH_CONFIG['concurrency'],
+                        help="Количество одновременных запросов")
+    parser.add_argument('-r', '--rate', type=float, default=BATCH_CONFIG['rate_limit'],
+                        help="Максимум запросов в секунду")
+    parser.add_argument('--retries', type=int, default=BATCH_CONFIG['max_retries'],
+                        help="Повторные попытки для неудачного задания")
+    return parser.parse_args()
+
+
+async def run_batch(args) -> dict:
+    sink = open_result_sink(args.output, args.format)
+    processor = BatchProcessor(
+        sink,
+        concurrency=args.concurrency,
+        rate_limit=args.rate,
+        max_retries=args.retries,
+    )
+    return await processor.run(load_manifest(args.manifest))
+
+
+def print_summary(summary: dict):
+    print(
+        f"Обработано: {summary['processed']} "
+        f"(успешно: {summary['ok']}, ошибок: {summary['failed']}, пропущено: {summary['skipped']})\n"
+        f"Время: {summary['elapsed']} с, пропускная способность: {summary['throughput']} заданий/с\n"
+        f"Задержка p50: {summary['latency_p50']} с, p95: {summary['latency_p95']} с"
+    )
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    try:
+        print_summary(asyncio.run(run_batch(args)))
+    except KeyboardInterrupt:
+        logger.info("Обработка прервана, прогресс сохранен в файле результатов")
+    except Exception as e:
+        logger.error(f"Ошибка пакетной обработки: {str(e)}")
+        sys.exit(1)
@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import logging
+
+# Добавляем текущую директорию в путь
+sys.path.insert(0, os.path.abspath('.'))
+
+# Воспроизведение не должно писать трафик и обращаться к настоящему Telegram
+os.environ['TRAFFIC_RECORD_PATH'] = ''
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:replay')
+
+from src.utils.logging_utils import setup_logging
+
+# Настройка логирования (запись в лог выполняется в фоновом потоке)
+setup_logging()
+logger = logging.getLogger(__name__)
+
+from src.services.traffic_recorder import load_records
+from src.services.traffic_replay import TrafficReplayer, compare_reports
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Воспроизведение записанного трафика и сравнение прогонов"
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="Воспроизвести запись через обработчики бота")
+    run.add_argument('records', nargs='+', help="Файлы записи (.jsonl.gz), например от нескольких воркеров")
+    run.add_argument('-o', '--output', required=True, help="Файл отчета (JSON)")
+    run.add_argument('-s', '--speed', type=float, default=1.0,
+                     help="Ускорение воспроизведения (1 — реальное время, 0 — без пауз)")
+    run.add_argument('--telegram-latency', type=float, default=0.0,
+                     help="Имитируемая задержка ответа Bot API (секунды)")
+
+    compare = commands.add_parser('compare', help="Сравнить отчеты двух прогонов")
+    compare.add_argument('baseline', help="Отчет эталонного прогона")
+    compare.add_argument('candidate', help="Отчет проверяемого прогона")
+    compare.add_argument('-t', '--threshold', type=float, default=0.1,
+                         help="Допустимый относительный рост метрики (0.1 — 10%%)")
+    return parser.parse_args()
+
+
+def print_comparison(result: dict):
+    print(f"{'Метрика':<28}{'Было':>12}{'Стало':>12}{'Изменение':>12}")
+    for row in result['rows']:
+        change = f"{row['change']:+.1%}" if row['change'] != float('inf') else 'новое'
+        mark = '  <- ухудшение' if row['regression'] else ''
+        print(f"{row['metric']:<28}{row['baseline']:>12.3f}{row['candidate']:>12.3f}{change:>12}{mark}")
+    if result['regressions']:
+        print(f"\nУхудшения: {', '.join(result['regressions'])}")
+    else:
+        print("\nУхудшений не обнаружено")
+
+
+async def run_replay(args) -> dict:
+    replayer = TrafficReplayer(load_records(args.records), speed=args.speed,
+                               telegram_latency=args.telegram_latency)
+    return await replayer.run()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    try:
+        if args.command == 'run':
+            report = asyncio.run(run_replay(args))
+            with open(args.output, 'w', encoding='utf-8') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+            print(f"Обновлений: {report['updates']}, время: {report['elapsed']} с, "
+                  f"обработка p95: {report['handling_latency']['p95']} с, "
+                  f"первый ответ p95: {report['first_response_latency']['p95']} с")
+        else:
+            with open(args.baseline, encoding='utf-8') as baseline, open(args.candidate, encoding='utf-8') as candidate:
+                result = compare_reports(json.load(baseline), json.load(candidate), args.threshold)
+            print_comparison(result)
+            sys.exit(1 if result['regressions'] else 0)
+    except KeyboardInterrupt:
+        logger.info("Воспроизведение прервано")
+    except Exception as e:
+        logger.error(f"Ошибка воспроизведения: {str(e)}")
+        sys.exit(1)
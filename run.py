@@ -6,21 +6,26 @@ import logging
 # Добавляем текущую директорию в путь
 sys.path.insert(0, os.path.abspath('.'))
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from src.utils.logging_utils import setup_logging
+
+# Настройка логирования (запись в лог выполняется в фоновом потоке)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# Импортируем основную функцию из src/main.py
-from src.main import main
+from src.config.config import WORKER_CONFIG
 
 if __name__ == '__main__':
     try:
         # Запуск бота
         logger.info("Запуск бота через run.py")
-        asyncio.run(main())
+        if WORKER_CONFIG['workers'] > 1:
+            # Многопроцессный режим: один процесс принимает обновления, воркеры их обрабатывают
+            from src.services.shard_supervisor import ShardSupervisor
+            asyncio.run(ShardSupervisor().run())
+        else:
+            # Импортируем основную функцию из src/main.py
+            from src.main import main
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
     except ImportError as e:
@@ -8,6 +8,16 @@ load_dotenv()
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 
+# Сервер Bot API: по умолчанию api.telegram.org, либо собственный сервер telegram-bot-api
+TELEGRAM_API_CONFIG = {
+    'base_url': os.getenv('TELEGRAM_API_URL') or None,           # Например, http://localhost:8081
+    'is_local': os.getenv('TELEGRAM_API_LOCAL', '0') == '1',     # Сервер запущен с флагом --local
+    'server_files_dir': os.getenv('TELEGRAM_API_SERVER_DIR') or None,  # Каталог файлов с точки зрения сервера
+    'local_files_dir': os.getenv('TELEGRAM_API_FILES_DIR') or None,    # Тот же каталог, смонтированный у бота
+    'connection_limit': int(os.getenv('TELEGRAM_CONNECTION_LIMIT', '100')),  # Размер пула соединений aiohttp
+    'request_timeout': float(os.getenv('TELEGRAM_REQUEST_TIMEOUT', '60')),
+}
+
 # Настройки модели
 MODEL_CONFIG = {
     'temperature': 0.7,
@@ -18,6 +28,321 @@ MODEL_CONFIG = {
 
 # Настройки логирования
 LOGGING_CONFIG = {
-    'level': 'INFO',
-    'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-} 
\ No newline at end of file
+    'level': os.getenv('LOG_LEVEL', 'INFO'),
+    'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    'json': os.getenv('LOG_JSON', '0') == '1',  # Структурированные JSON-записи
+    'queue_size': 10000,  # Записи сверх этого отбрасываются, а не блокируют обработку
+    # Доля сохраняемых записей для частых событий (поле event в extra)
+    'sampling': {
+        'loading_tick': 0.1,
+        'chunk_edit': 0.2,
+    },
+    # Максимум записей события в секунду
+    'rate_limits': {
+        'loading_tick': 2.0,
+        'chunk_edit': 5.0,
+        'message_received': 20.0,
+    },
+}
+
+# Настройки пакетной обработки (batch.py)
+BATCH_CONFIG = {
+    'concurrency': 4,          # Количество одновременных запросов к Gemini
+    'rate_limit': 2.0,         # Максимум запросов в секунду
+    'max_retries': 2,          # Повторные попытки для неудачного задания
+    'retry_delay': 2.0,        # Базовая задержка между попытками (секунды)
+    'progress_interval': 100,  # Как часто писать прогресс в лог (в заданиях)
+}
+
+# Настройки загрузки медиа в Gemini File API
+UPLOAD_CONFIG = {
+    'max_entries': 1000,                 # Размер индекса загруженных файлов
+    'expiry_margin': 600,                # Запас до истечения срока жизни файла (секунды)
+    'default_ttl': 47 * 3600,            # Срок жизни, если сервер его не сообщил
+    'processing_timeout': 60,            # Ожидание обработки файла сервером (секунды)
+    'processing_poll_interval': 1.0,
+}
+
+# Бюджет токенов запросов по типам (text, image, file)
+PROMPT_BUDGET_CONFIG = {
+    'input_tokens': {'text': 2000, 'image': 1000, 'file': 6000, 'audio': 1000, 'inline': 200},
+    'output_tokens': {'text': 1024, 'image': 1024, 'file': 2048, 'audio': 1024, 'inline': 384},
+    'image_tokens': 258,            # Стоимость одного изображения во входных токенах
+    'ascii_chars_per_token': 4.0,   # Начальная плотность для латиницы и кода
+    'other_chars_per_token': 2.5,   # Начальная плотность для кириллицы и прочих символов
+    'max_chars_per_token': 5,       # Верхняя оценка для перевода бюджета токенов в символы
+    'calibration_alpha': 0.1,       # Скорость подстройки по фактическому числу токенов
+    'calibration_min_tokens': 20,   # Короткие запросы не используются для калибровки
+    'usage_history_size': 1000,     # Сколько последних запросов хранить в статистике
+    'condense_thread_chars': 100_000,  # Файлы длиннее сжимаются в отдельном потоке, не блокируя цикл событий
+}
+
+# Пул API-ключей Gemini: GOOGLE_API_KEYS через запятую или один GOOGLE_API_KEY
+KEY_POOL_CONFIG = {
+    'api_keys': [key.strip() for key in os.getenv('GOOGLE_API_KEYS', GOOGLE_API_KEY or '').split(',') if key.strip()],
+    'rpm_limit': int(os.getenv('GEMINI_RPM_PER_KEY', '0')),  # Запросов в минуту на ключ (0 — без ограничения)
+    'quota_cooldown': 60,    # На сколько отключать ключ после ошибки квоты (секунды)
+    'auth_cooldown': 600,    # На сколько отключать ключ после ошибки авторизации (секунды)
+    'max_wait': 10,          # Сколько ждать восстановления, если все ключи отключены
+}
+
+# Многопроцессный режим: BOT_WORKERS > 1 включает супервизор с шардированием по chat_id
+WORKER_CONFIG = {
+    'workers': int(os.getenv('BOT_WORKERS', '1')),
+    'queue_size': 1000,           # Максимум обновлений в очереди одного воркера
+    'polling_timeout': 30,        # Таймаут long polling (секунды)
+    'heartbeat_interval': 5.0,    # Как часто воркер сообщает о своем состоянии
+    'startup_timeout': 30.0,      # Сколько ждать первого heartbeat воркеров перед приемом обновлений
+    'health_log_interval': 60.0,  # Как часто писать сводку по воркерам в лог
+    'restart_delay': 1.0,         # Начальная задержка перезапуска упавшего воркера
+    'max_restart_delay': 30.0,
+    'stable_after': 60.0,         # Время работы, после которого задержка перезапуска сбрасывается
+    'shutdown_timeout': 10.0,
+}
+
+# Индекс почти-дубликатов изображений (перцептивные хэши)
+IMAGE_INDEX_CONFIG = {
+    'enabled': os.getenv('IMAGE_INDEX_ENABLED', '1') == '1',
+    'path': os.getenv('IMAGE_INDEX_PATH', 'data/image_index.json'),
+    'max_distance': 10,        # Максимальное расстояние Хэмминга по pHash
+    'dhash_max_distance': 10,  # Подтверждение кандидата по dHash
+    'max_entries': 20000,
+    'save_every': 20,          # Сохранять на диск после стольких новых записей
+    'bulk_batch_size': 256,
+}
+
+# Семантический кэш ответов на текстовые запросы (нужен NumPy)
+SEMANTIC_CACHE_CONFIG = {
+    'enabled': os.getenv('SEMANTIC_CACHE_ENABLED', '1') == '1',
+    'path': os.getenv('SEMANTIC_CACHE_PATH', 'data/semantic_cache.npz'),
+    # Отказы чатов от кэша общие для всех шардов (записи кэша у каждого шарда свои)
+    'opt_out_path': os.getenv('SEMANTIC_CACHE_OPT_OUT_PATH', 'data/semantic_cache_opt_out.json'),
+    # gemini — Embedding API, local — sentence-transformers, hashing — хэширование n-грамм без модели
+    'embedder': os.getenv('SEMANTIC_CACHE_EMBEDDER', 'gemini'),
+    'gemini_model': 'models/text-embedding-004',
+    'local_model': os.getenv('SEMANTIC_CACHE_LOCAL_MODEL', 'paraphrase-multilingual-MiniLM-L12-v2'),
+    'hashing_dim': 1024,
+    'threshold': float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.92')),  # Минимальное косинусное сходство запросов
+    'min_length': 8,            # Короткие реплики слишком многозначны для кэша
+    'max_length': 500,          # Длинные запросы почти не повторяются
+    'max_entries': 10000,
+    'ttl': 7 * 24 * 3600,       # Время жизни ответа (секунды)
+    'save_every': 20,           # Сохранять на диск после стольких новых записей
+    'batch_window': 0.01,       # Сколько ждать других запросов, чтобы вычислить эмбеддинги одной пачкой
+    'max_batch': 64,
+    'verify_rate': 0.02,        # Доля попаданий, которые перепроверяются запросом к модели
+    'answer_similarity': 0.8,   # Ниже — ответ из кэша считается ложным попаданием
+    'false_positive_samples': 50,
+}
+
+# Извлечение текста из PDF, DOCX, ODT и архивов (пул процессов)
+EXTRACTION_CONFIG = {
+    'max_workers': 2,
+    'max_memory_bytes': 512 * 1024 * 1024,  # Лимит памяти процесса-воркера
+    'time_limit': 20.0,                     # Лимит времени на один документ (секунды)
+    'kill_grace': 5.0,                      # Запас перед принудительной остановкой воркера
+    'max_tasks_per_child': 50,              # Перезапуск воркера после стольких документов
+    'max_entry_bytes': 1024 * 1024,         # Сколько читать из одного файла архива
+}
+
+# Голосовые сообщения и аудиофайлы
+AUDIO_CONFIG = {
+    'max_duration': int(os.getenv('AUDIO_MAX_DURATION', '300')),  # Более длинные записи не обрабатываются (секунды)
+    'inline_limit': 15 * 1024 * 1024,  # Крупнее — через File API (лимит запроса 20 МБ с учетом base64)
+    # Форматы, которые Gemini принимает без перекодирования
+    'supported_mime_types': ['audio/ogg', 'audio/mpeg', 'audio/mp3', 'audio/wav', 'audio/x-wav',
+                             'audio/aac', 'audio/flac', 'audio/x-flac', 'audio/aiff'],
+    'ffmpeg_path': os.getenv('FFMPEG_PATH', 'ffmpeg'),
+    'max_workers': 2,        # Одновременных процессов ffmpeg
+    'transcode_timeout': 60.0,
+    'sample_rate': 16000,    # Модель все равно понижает частоту до 16 кГц моно
+    'bitrate': '24k',
+}
+
+# Локальные ответы на приветствия, благодарности и частые вопросы без обращения к модели
+FAST_PATH_CONFIG = {
+    'enabled': os.getenv('FAST_PATH_ENABLED', '1') == '1',
+    'max_length': 60,         # Длиннее (после нормализации) — всегда отправляем в модель
+    'min_similarity': 0.75,   # Порог сходства по триграммам (коэффициент Дайса)
+    'stats_log_interval': 100,
+    'intents': [
+        {
+            'name': 'greeting',
+            'patterns': ['привет', 'приветик', 'здравствуй', 'здравствуйте', 'добрый день', 'добрый вечер',
+                         'доброе утро', 'хай', 'салют', 'hi', 'hello', 'hey'],
+            'answer': 'Привет! Задайте вопрос, отправьте изображение или файл — я помогу.',
+        },
+        {
+            'name': 'thanks',
+            'patterns': ['спасибо', 'спс', 'благодарю', 'спасибо большое', 'большое спасибо', 'thanks', 'thank you'],
+            'answer': 'Пожалуйста! Обращайтесь, если появятся еще вопросы.',
+        },
+        {
+            'name': 'goodbye',
+            'patterns': ['пока', 'до свидания', 'до встречи', 'bye'],
+            'answer': 'До встречи! Буду рад помочь снова.',
+        },
+        {
+            'name': 'capabilities',
+            'patterns': ['что ты умеешь', 'что ты можешь', 'что умеешь', 'что ты можешь делать',
+                         'чем ты можешь помочь', 'помощь', 'help', 'what can you do'],
+            'answer': ('Я могу:\n'
+                       '• Отвечать на ваши вопросы\n'
+                       '• Анализировать изображения\n'
+                       '• Обрабатывать текстовые файлы и документы\n'
+                       '• Помогать с разными задачами\n\n'
+                       'Используйте кнопки меню или просто напишите мне сообщение!'),
+        },
+        {
+            'name': 'about',
+            'patterns': ['кто ты', 'ты кто', 'ты бот', 'как тебя зовут', 'who are you'],
+            'answer': 'Я бот-ассистент на базе Google Gemini. Отвечаю на вопросы и анализирую изображения и файлы.',
+        },
+    ],
+}
+
+# Хеджирование запросов к Gemini: дублирующий запрос, если первый токен задерживается
+HEDGING_CONFIG = {
+    'enabled': os.getenv('GEMINI_HEDGING', '0') == '1',
+    'delay': float(os.getenv('GEMINI_HEDGE_DELAY', '0')),  # Фиксированная задержка (0 — по перцентилю)
+    'percentile': 0.9,        # Перцентиль времени до первого токена для адаптивной задержки
+    'initial_delay': 3.0,     # Задержка, пока не накоплено достаточно наблюдений
+    'min_delay': 0.5,
+    'max_delay': 10.0,
+    'min_samples': 20,
+    'history_size': 200,
+    'max_extra_load': 0.1,    # Доля дополнительных запросов от числа основных
+    'budget_burst': 5.0,      # Сколько дублирующих запросов можно отправить подряд
+    'model': os.getenv('GEMINI_HEDGE_MODEL') or None,  # Модель для дубля (по умолчанию та же)
+}
+
+# Деградация качества обслуживания при перегрузке
+DEGRADATION_CONFIG = {
+    'enabled': os.getenv('DEGRADATION_ENABLED', '1') == '1',
+    'check_interval': 0.5,     # Период измерения задержки цикла событий (секунды)
+    'lag_smoothing': 0.3,      # Коэффициент экспоненциального сглаживания задержки
+    'flood_window': 60.0,      # За какой период учитываются события флуд-контроля
+    'recover_after': 15.0,     # Сколько нагрузка должна держаться ниже уровня до шага восстановления
+    # Пороги перехода на уровни 1, 2, 3, 4
+    'loop_lag_thresholds': [0.05, 0.2, 0.5, 1.0],   # Задержка цикла событий (секунды)
+    'in_flight_thresholds': [10, 25, 50, 100],      # Одновременные запросы к модели
+    'flood_thresholds': [1, 3, 10, 20],             # События флуд-контроля за окно
+    'levels': [
+        {'name': 'full', 'animation': True, 'pacing': True, 'progressive': True,
+         'output_tokens_factor': 1.0, 'model': None},
+        {'name': 'no_pacing', 'animation': True, 'pacing': False, 'progressive': True,
+         'output_tokens_factor': 1.0, 'model': None},
+        {'name': 'no_animation', 'animation': False, 'pacing': False, 'progressive': True,
+         'output_tokens_factor': 1.0, 'model': None},
+        {'name': 'one_shot', 'animation': False, 'pacing': False, 'progressive': False,
+         'output_tokens_factor': 0.5, 'model': None},
+        {'name': 'survival', 'animation': False, 'pacing': False, 'progressive': False,
+         'output_tokens_factor': 0.25, 'model': os.getenv('GEMINI_FAST_MODEL', 'gemini-2.0-flash-lite')},
+    ],
+}
+
+# Запись реального трафика для последующего воспроизведения (replay.py)
+TRAFFIC_RECORD_CONFIG = {
+    'path': os.getenv('TRAFFIC_RECORD_PATH') or None,  # Например, data/traffic.jsonl.gz (не задан — запись выключена)
+    'salt': os.getenv('TRAFFIC_RECORD_SALT') or None,  # Соль псевдонимов (по умолчанию случайная на процесс)
+    'flush_every': 100,  # Сбрасывать буфер на диск после стольких записей
+    # Тексты, которые сохраняются как есть: кнопки меню (а также фразы быстрых ответов, остальное маскируется)
+    'keep_texts': ['🔍 Задать вопрос', '📷 Анализ изображения', '📁 Отправить файл',
+                   '❓ Помощь', 'ℹ️ О боте', '❌ Отмена'],
+}
+
+# Сторож цикла событий: обнаружение блокирующего кода
+LOOP_WATCHDOG_CONFIG = {
+    'enabled': os.getenv('LOOP_WATCHDOG', '1') == '1',
+    'interval': 0.1,           # Период отметок цикла событий (секунды)
+    'threshold': float(os.getenv('LOOP_STALL_THRESHOLD', '0.25')),  # Задержка, считающаяся блокировкой
+    'report_after': 2.0,       # Длинную блокировку сообщать сразу, не дожидаясь ее окончания
+    'stack_depth': 8,          # Сколько кадров стека выводить в отчете
+}
+
+# Последовательная обработка обновлений одного чата (актор на чат)
+CHAT_ACTOR_CONFIG = {
+    'enabled': os.getenv('CHAT_ACTORS_ENABLED', '1') == '1',
+    'mailbox_size': 10,         # Сколько обновлений чата может ждать очереди, лишние отбрасываются
+    'busy_message': 'Я еще отвечаю на ваши предыдущие сообщения. Пожалуйста, подождите ответа и отправьте это сообщение снова.',
+    'stats_log_interval': 300,  # Как часто писать сводку по акторам (секунды)
+}
+
+# Inline-режим (@бот запрос в любом чате)
+INLINE_CONFIG = {
+    'debounce': float(os.getenv('INLINE_DEBOUNCE', '0.7')),  # Пауза после последнего нажатия перед запросом к модели
+    'min_query_length': 3,       # Более короткие запросы не отправляются в модель
+    'generation_timeout': 8.0,   # Telegram перестает ждать ответ на inline-запрос примерно через 10 секунд
+    'cache_size': 2000,          # Сколько ответов хранить в локальном кэше
+    'cache_ttl': 3600,           # Время жизни ответа в локальном кэше (секунды)
+    'cache_time': 300,           # Сколько Telegram кэширует результаты на своей стороне (секунды)
+    'empty_cache_time': 5,       # То же для пустых и ошибочных результатов
+    'max_results': 5,            # Свежий ответ и продолжения запроса из кэша
+    'description_length': 120,   # Длина превью ответа в списке результатов
+    'stats_log_interval': 100,
+}
+
+# Очередь исходящих запросов к Bot API (лимиты Telegram соблюдаются заранее, до флуд-контроля)
+SEND_QUEUE_CONFIG = {
+    'enabled': os.getenv('SEND_QUEUE_ENABLED', '1') == '1',
+    'global_rate': float(os.getenv('SEND_QUEUE_GLOBAL_RATE', '30')),  # Сообщений в секунду на весь бот
+    'global_burst': 30,
+    'private_rate': 1.0,        # Личный чат: около одного сообщения в секунду
+    'private_burst': 3,
+    'group_rate': 20 / 60,      # Группа: не больше 20 сообщений в минуту
+    'group_burst': 3,
+    'max_in_flight': 32,        # Одновременных запросов к Bot API
+    'max_flood_retries': 2,     # Повторов после TelegramRetryAfter внутри очереди
+    'chat_action_ttl': 4.5,     # Статус «печатает» держится 5 секунд, чаще отправлять незачем
+    'scan_limit': 200,          # Сколько запросов одного приоритета просматривать в поисках готового
+    'bucket_idle_ttl': 120,     # Через сколько секунд простоя удалять лимиты чата
+    'delay_history_size': 1000,
+    'stats_log_interval': 300,
+}
+
+# Маршрутизация запросов к моделям: у каждого маршрута своя модель и параметры генерации.
+# None в профиле — значение по умолчанию (модель сервиса, MODEL_CONFIG, бюджет ответа по типу запроса)
+_LIGHT_MODEL = os.getenv('GEMINI_LIGHT_MODEL', os.getenv('GEMINI_FAST_MODEL', 'gemini-2.0-flash-lite'))
+MODEL_ROUTER_CONFIG = {
+    'enabled': os.getenv('MODEL_ROUTER_ENABLED', '1') == '1',
+    'chat_max_words': 6,          # Болтовней может быть только реплика не длиннее этого
+    'chat_intents': ('greeting', 'thanks', 'goodbye'),  # Намерения FAST_PATH_CONFIG, совпадение с которыми — болтовня
+    'short_max_chars': 200,       # Короткий вопрос
+    'code_min_share': 0.3,        # Доля строк, похожих на код, начиная с которой текст считается кодом
+    'latency_history_size': 500,
+    'stats_log_interval': 200,
+    'routes': {
+        'chat': {'model': _LIGHT_MODEL, 'temperature': 0.9, 'output_tokens': 256},
+        'short': {'model': None, 'temperature': None, 'output_tokens': 768},
+        'text': {'model': None, 'temperature': None, 'output_tokens': None},
+        'code': {'model': None, 'temperature': 0.2, 'output_tokens': 2048},
+        'image': {'model': None, 'temperature': 0.4, 'output_tokens': None},
+        'audio': {'model': None, 'temperature': 0.4, 'output_tokens': None},
+        'code_file': {'model': None, 'temperature': 0.2, 'output_tokens': None},
+        'document': {'model': None, 'temperature': 0.4, 'output_tokens': None},
+        'inline': {'model': _LIGHT_MODEL, 'temperature': None, 'output_tokens': None},
+    },
+}
+
+# Проверка документов до скачивания: по MIME-типу, размеру и имени файла из сообщения
+DOCUMENT_ADMISSION_CONFIG = {
+    'enabled': os.getenv('DOCUMENT_ADMISSION_ENABLED', '1') == '1',
+    'standard_download_limit': 20 * 1024 * 1024,   # getFile стандартного Bot API отдает файлы до 20 МБ
+    'local_download_limit': 2000 * 1024 * 1024,    # Локальный сервер Bot API — до 2000 МБ
+    # Предельный размер по виду обработки: текст все равно обрезается по бюджету токенов
+    'max_size': {
+        'text': 5 * 1024 * 1024,
+        'document': 20 * 1024 * 1024,
+        'image': 10 * 1024 * 1024,
+        'audio': 20 * 1024 * 1024,
+    },
+    'text_extensions': ('.txt', '.py', '.js', '.html', '.css', '.json', '.md'),
+    'image_extensions': ('.jpg', '.jpeg', '.png', '.gif', '.bmp'),
+    # MIME-типы, которые отклоняются сразу, независимо от расширения
+    'rejected_mime_prefixes': ('video/', 'application/x-msdownload', 'application/x-executable',
+                               'application/x-dosexec', 'application/vnd.android.package-archive',
+                               'application/x-iso9660-image'),
+    'probe': os.getenv('DOCUMENT_PROBE', '1') == '1',  # Читать первые байты файла, если метаданных недостаточно
+    'probe_bytes': 4096,
+    'stats_log_interval': 100,
+}
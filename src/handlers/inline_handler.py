@@ -0,0 +1,144 @@
+import time
+import asyncio
+import hashlib
+import logging
+from collections import Counter
+from aiogram import types
+from aiogram.enums import ParseMode
+from src.config.config import INLINE_CONFIG
+from src.services.fast_path import normalize
+from src.services.inline_cache import InlineAnswerCache
+from src.utils.message_utils import render_within_limit
+
+logger = logging.getLogger(__name__)
+
+
+class InlineQueryHandler:
+    """
+    Обработчик inline-запросов (@бот вопрос в любом чате)
+
+    Telegram присылает новый запрос на каждое изменение текста, поэтому модель
+    вызывается только после паузы в наборе: более новый запрос того же пользователя
+    отменяет ожидание и уже начатую генерацию предыдущего. Ответы кэшируются локально
+    (с поиском по префиксу набранного текста) и на стороне Telegram через cache_time.
+    """
+
+    def __init__(self, gemini_service, config: dict = None):
+        self.gemini_service = gemini_service
+        self.config = config or INLINE_CONFIG
+        self.cache = InlineAnswerCache()
+        self._inflight = {}  # user_id -> задача ожидания и генерации последнего запроса
+        self.stats = Counter()
+
+    @staticmethod
+    def _result_id(key: str) -> str:
+        # Идентификатор результата ограничен 64 байтами
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def _article(self, query: str, answer: str) -> types.InlineQueryResultArticle:
+        description = answer.replace('\n', ' ')
+        limit = self.config['description_length']
+        if len(description) > limit:
+            description = description[:limit - 1] + '…'
+        _, message_text = render_within_limit(f"❓ {query}\n\n🤖 AI: {answer}")
+        return types.InlineQueryResultArticle(
+            id=self._result_id(normalize(query)),
+            title=query,
+            description=description,
+            input_message_content=types.InputTextMessageContent(message_text=message_text,
+                                                                parse_mode=ParseMode.MARKDOWN_V2),
+        )
+
+    async def _answer(self, inline_query: types.InlineQuery, answers: list, cache_time: int):
+        try:
+            await inline_query.answer(
+                [self._article(query, answer) for query, answer in answers],
+                cache_time=cache_time,
+                is_personal=False,
+            )
+        except Exception as e:
+            # Запрос мог устареть, пока шла генерация
+            logger.warning(f"Не удалось ответить на inline-запрос: {str(e)}")
+
+    async def _debounced_answer(self, text: str) -> str:
+        """Ждет паузу в наборе и запрашивает ответ модели"""
+        await asyncio.sleep(self.config['debounce'])
+        self.stats['generated'] += 1
+        return await asyncio.wait_for(
+            self.gemini_service.generate_inline_answer(text), self.config['generation_timeout']
+        )
+
+    async def handle_inline_query(self, inline_query: types.InlineQuery):
+        """
+        Обработчик inline-запросов
+
+        Args:
+            inline_query: Inline-запрос пользователя
+        """
+        user_id = inline_query.from_user.id
+        text = inline_query.query.strip()
+        key = normalize(text)
+        limit = self.config['max_results']
+        self.stats['queries'] += 1
+        self._log_stats()
+
+        # Любой новый запрос делает предыдущий запрос пользователя неактуальным
+        previous = self._inflight.pop(user_id, None)
+        if previous is not None and not previous.done():
+            previous.cancel()
+
+        if len(key) < self.config['min_query_length']:
+            await self._answer(inline_query, self.cache.completions(key, limit) if key else [],
+                               self.config['empty_cache_time'])
+            return
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.stats['cache_hits'] += 1
+            others = [item for item in self.cache.completions(key, limit) if normalize(item[0]) != key]
+            await self._answer(inline_query, [cached] + others[:limit - 1], self.config['cache_time'])
+            return
+
+        started = time.monotonic()
+        work = asyncio.create_task(self._debounced_answer(text))
+        self._inflight[user_id] = work
+        try:
+            # wait не пробрасывает отмену задачи, поэтому отличаем вытеснение от остановки обработчика
+            await asyncio.wait({work})
+        except asyncio.CancelledError:
+            work.cancel()
+            raise
+        finally:
+            if self._inflight.get(user_id) is work:
+                del self._inflight[user_id]
+
+        if work.cancelled():
+            # Пользователь продолжил набирать, на устаревший запрос не отвечаем
+            self.stats['superseded'] += 1
+            return
+
+        completions = [item for item in self.cache.completions(key, limit) if normalize(item[0]) != key]
+        error = work.exception()
+        if error is not None:
+            self.stats['errors'] += 1
+            logger.error(f"Ошибка генерации ответа на inline-запрос: {type(error).__name__}: {str(error)}")
+            await self._answer(inline_query, completions, self.config['empty_cache_time'])
+            return
+
+        answer = work.result()
+        self.cache.put(key, text, answer)
+        logger.info(f"Ответ на inline-запрос пользователя {user_id} за {time.monotonic() - started:.2f} с")
+        await self._answer(inline_query, [(text, answer)] + completions[:limit - 1], self.config['cache_time'])
+
+    def _log_stats(self):
+        if self.stats['queries'] % self.config['stats_log_interval'] == 0:
+            logger.info(f"Inline-запросы: {self.summary()}")
+
+    def summary(self) -> dict:
+        """Сколько inline-запросов дошло до модели"""
+        queries = self.stats['queries']
+        return {
+            **self.stats,
+            'cached_entries': len(self.cache),
+            'generation_rate': self.stats['generated'] / queries if queries else 0.0,
+        }
@@ -1,12 +1,22 @@
 import re
+import time
 import logging
 import asyncio
 from aiogram import types
+from aiogram.filters import CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from src.utils.message_utils import send_message_with_retry, update_message_with_retry
+from src.utils.message_utils import (send_message_with_retry, update_message_with_retry,
+                                     schedule_message_update, send_chat_action)
+from src.services.send_queue import Priority
 from src.utils.keyboard_utils import get_main_keyboard, get_cancel_keyboard
+from src.utils.bot_api import download_file_data, iter_file_chunks
+from src.config.config import AUDIO_CONFIG
 from src.services.gemini_service import GeminiService
+from src.services.fast_path import FastPathMatcher
+from src.services.audio_transcoder import AudioTranscoder, OUTPUT_MIME_TYPE
+from src.services.document_admission import DocumentAdmission
+from src.services.degradation import degradation
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +29,9 @@ class MessageHandler:
     def __init__(self):
         """Инициализация обработчика сообщений"""
         self.gemini_service = GeminiService()
+        self.fast_path = FastPathMatcher()  # Локальные ответы на приветствия и частые вопросы
+        self.audio_transcoder = AudioTranscoder()  # Перекодирование аудио, которое модель не принимает
+        self.document_admission = DocumentAdmission()  # Проверка документов до скачивания
         self._loading_tasks = {}  # Словарь для хранения задач анимации загрузки
         self._loading_messages = {}  # Словарь для хранения сообщений с индикаторами загрузки
 
@@ -35,8 +48,8 @@ class MessageHandler:
         try:
             # Отправляем первоначальное сообщение с более заметной анимацией
             initial_text = f"{prefix}{'.' * dots} ⏳"
-            loading_message = await send_message_with_retry(message, initial_text)
-            logger.info(f"Создано сообщение с индикатором загрузки для пользователя {message.from_user.id}: {loading_message.message_id}")
+            loading_message = await send_message_with_retry(message, initial_text, priority=Priority.PROGRESS)
+            logger.info("Создано сообщение с индикатором загрузки для пользователя %s: %s", message.from_user.id, loading_message.message_id)
             
             # Сохраняем сообщение в словаре для возможности получения его позже
             self._loading_messages[message.from_user.id] = loading_message
@@ -56,11 +69,14 @@ class MessageHandler:
                 
                 # Обновляем сообщение
                 try:
+                    # Кадр анимации уступает в очереди ответам и отменяется итоговой правкой
                     success = await update_message_with_retry(
                         loading_message, 
-                        loading_text
+                        loading_text,
+                        priority=Priority.ANIMATION
                     )
-                    logger.info(f"Обновлена анимация загрузки для пользователя {message.from_user.id}, точек: {dots}, успех: {success}")
+                    logger.info("Обновлена анимация загрузки для пользователя %s, точек: %s, успех: %s",
+                                message.from_user.id, dots, success, extra={'event': 'loading_tick'})
                 except Exception as e:
                     logger.error(f"Ошибка при обновлении анимации: {str(e)}")
                 
@@ -154,6 +170,98 @@ class MessageHandler:
         logger.warning(f"Не найдена задача анимации для пользователя {user_id}")
         return self._loading_messages.get(user_id)
 
+    async def _deliver_response(self, message: types.Message, text: str, loading_message: types.Message,
+                                level: dict, chunk_delay: float = 0.2):
+        """
+        Выводит ответ модели пользователю
+
+        На полном уровне обслуживания текст появляется постепенно по предложениям в сообщении
+        с индикатором загрузки, под нагрузкой — одним обновлением без пауз.
+
+        Args:
+            message: Сообщение пользователя
+            text: Ответ модели
+            loading_message: Сообщение с индикатором загрузки (None, если анимации не было)
+            level: Уровень обслуживания, выбранный в начале обработки запроса
+            chunk_delay: Пауза между постепенными обновлениями
+        """
+        user_id = message.from_user.id
+        if not loading_message:
+            # Если нет сообщения с загрузкой, отправляем новое сообщение
+            await send_message_with_retry(message, f"🤖 AI: {text}", reply_markup=get_main_keyboard())
+            return
+
+        current_text = f"🤖 AI: {text}"
+        if level['progressive']:
+            logger.info(f"Начинаем обновление сообщения для пользователя {user_id}")
+            
+            # Разбиваем текст на предложения и постепенно добавляем их
+            chunks = re.split(r'(?<=[.!?])\s+(?=[А-ЯA-Z])', text)
+            current_text = "🤖 AI: "
+            for i, chunk in enumerate(chunks):
+                if not chunk.strip():
+                    continue
+                # Добавляем пробел перед частью, если это не первая часть
+                current_text += chunk if current_text == "🤖 AI: " else " " + chunk
+                
+                # Не ждем отправки: если очередь занята, промежуточные правки сольются в последнюю
+                schedule_message_update(loading_message, current_text)
+                logger.info("Обновлено сообщение часть %s/%s для пользователя %s", i + 1, len(chunks), user_id,
+                            extra={'event': 'chunk_edit'})
+                
+                if level['pacing']:
+                    await asyncio.sleep(chunk_delay)
+        
+        # В конце добавляем клавиатуру (без постепенного вывода это единственное обновление)
+        try:
+            updated = await update_message_with_retry(loading_message, current_text, reply_markup=get_main_keyboard())
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении клавиатуры: {str(e)}")
+            updated = False
+        if not updated:
+            # Если не удалось обновить, отправляем новое сообщение с клавиатурой
+            await send_message_with_retry(message, current_text, reply_markup=get_main_keyboard())
+        else:
+            logger.info(f"Добавлена клавиатура к сообщению для пользователя {user_id}")
+
+    async def handle_cache_command(self, message: types.Message, command: CommandObject = None):
+        """
+        Обработчик команды /cache: включает или отключает кэш ответов для чата
+        
+        Args:
+            message: Сообщение с командой (/cache, /cache on или /cache off)
+            command: Разобранная команда с аргументами
+        """
+        cache = self.gemini_service.semantic_cache
+        if cache is None:
+            await send_message_with_retry(message, "🤖 AI: Кэш ответов отключен в настройках бота.")
+            return
+
+        argument = (command.args or '').strip().lower() if command else ''
+        chat_id = message.chat.id
+        if argument in ('off', 'выкл'):
+            cache.set_opt_out(chat_id, True)
+            logger.info(f"Чат {chat_id} отказался от кэша ответов")
+        elif argument in ('on', 'вкл'):
+            cache.set_opt_out(chat_id, False)
+            logger.info(f"Чат {chat_id} снова использует кэш ответов")
+        elif argument:
+            await send_message_with_retry(message, "🤖 AI: Используйте /cache on или /cache off")
+            return
+        if argument:
+            try:
+                # Отказы общие для всех процессов-воркеров и сохраняются сразу
+                await cache.persist_opt_outs()
+            except Exception as e:
+                logger.error(f"Не удалось сохранить настройку кэша для чата {chat_id}: {str(e)}")
+
+        if cache.is_opted_out(chat_id):
+            status = "не используется: ответы всегда генерируются заново, ваши вопросы не сохраняются"
+        else:
+            status = "используется: на похожие вопросы я могу отвечать сохраненными ответами"
+        await send_message_with_retry(message, f"🤖 AI: Кэш ответов в этом чате {status}.",
+                                      reply_markup=get_main_keyboard())
+
     async def handle_message(self, message: types.Message, state: FSMContext = None):
         """
         Обработчик всех текстовых сообщений
@@ -237,81 +345,50 @@ class MessageHandler:
                 return
             
             # Логируем получение сообщения
-            logger.info(f"Получено сообщение от пользователя {user_id}: {message.text}")
+            # Текст пользователя в лог не пишем, только его длину
+            logger.info("Получено сообщение от пользователя %s (%s символов)", user_id, len(message.text or ""),
+                        extra={'event': 'message_received'})
+
+            # Тривиальные сообщения отвечаем сразу: без модели, задержек и анимации
+            intent = self.fast_path.match(message.text)
+            if intent is not None:
+                logger.info(f"Быстрый ответ ({intent['name']}) пользователю {user_id}")
+                await send_message_with_retry(
+                    message,
+                    f"🤖 AI: {intent['answer']}",
+                    reply_markup=get_main_keyboard()
+                )
+                return
             
+            # Под перегрузкой анимация и искусственные задержки отключаются
+            level = degradation.level
+
             # Отправляем статус "печатает..."
-            await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
+            send_chat_action(message)
             
             # Запускаем анимацию загрузки
-            await self._start_loading_animation(message)
-            logger.info(f"Запущена анимация загрузки для пользователя {user_id}")
-            
-            # Добавим искусственную задержку, чтобы пользователь успел увидеть анимацию
-            await asyncio.sleep(2.0)
+            if level['animation']:
+                await self._start_loading_animation(message)
+                logger.info(f"Запущена анимация загрузки для пользователя {user_id}")
+                
+                # Добавим искусственную задержку, чтобы пользователь успел увидеть анимацию
+                if level['pacing']:
+                    await asyncio.sleep(2.0)
             
             try:
                 # Генерируем ответ с помощью Gemini
-                response_text = await self.gemini_service.generate_response(message.text)
+                response_text = await self.gemini_service.generate_response(message.text, chat_id=message.chat.id)
                 logger.info(f"Получен ответ от Gemini для пользователя {user_id}")
                 
-                # Добавим еще небольшую задержку перед остановкой анимации
-                await asyncio.sleep(1.0)
-                
-                # Останавливаем анимацию загрузки и получаем сообщение
-                loading_message = await self._stop_loading_animation(user_id)
-                
-                if loading_message:
-                    logger.info(f"Начинаем обновление сообщения для пользователя {user_id}")
-                    
-                    # Разбиваем текст на более крупные части для более быстрого отображения
-                    chunks = re.split(r'(?<=[.!?])\s+(?=[А-ЯA-Z])', response_text)
-                    current_text = "🤖 AI: "
-                    
-                    # Постепенно добавляем части текста
-                    for i, chunk in enumerate(chunks):
-                        if chunk.strip():
-                            # Добавляем пробел перед частью, если это не первая часть
-                            if current_text != "🤖 AI: ":
-                                current_text += " " + chunk
-                            else:
-                                current_text += chunk
-                            
-                            # Обновляем сообщение с новым содержимым
-                            try:
-                                await update_message_with_retry(loading_message, current_text)
-                                logger.info(f"Обновлено сообщение часть {i+1}/{len(chunks)} для пользователя {user_id}")
-                                # Увеличиваем задержку между обновлениями
-                                await asyncio.sleep(0.5)  # Увеличиваем задержку с 0.2 до 0.5 секунд
-                            except Exception as e:
-                                logger.error(f"Ошибка при обновлении сообщения: {str(e)}")
-                                # Если не удалось обновить, отправляем новое сообщение
-                                loading_message = await send_message_with_retry(message, current_text)
+                if level['animation']:
+                    # Добавим еще небольшую задержку перед остановкой анимации
+                    if level['pacing']:
+                        await asyncio.sleep(1.0)
                     
-                    # В конце добавляем клавиатуру
-                    try:
-                        await update_message_with_retry(
-                            loading_message, 
-                            current_text, 
-                            reply_markup=get_main_keyboard()
-                        )
-                        logger.info(f"Добавлена клавиатура к сообщению для пользователя {user_id}")
-                    except Exception as e:
-                        logger.error(f"Ошибка при добавлении клавиатуры: {str(e)}")
-                        # Если не удалось обновить, отправляем новое сообщение с клавиатурой
-                        await send_message_with_retry(
-                            message, 
-                            current_text, 
-                            reply_markup=get_main_keyboard()
-                        )
-                else:
-                    logger.error(f"Не удалось получить сообщение с индикатором загрузки для пользователя {user_id}")
-                    # Если не получили сообщение с загрузкой, отправляем новое сообщение
-                    await send_message_with_retry(
-                        message, 
-                        f"🤖 AI: {response_text}", 
-                        reply_markup=get_main_keyboard()
-                    )
+                    # Останавливаем анимацию загрузки и получаем сообщение
+                    loading_message = await self._stop_loading_animation(user_id)
                 
+                await self._deliver_response(message, response_text, loading_message, level, chunk_delay=0.5)
                 logger.info(f"Отправлен ответ пользователю {user_id}")
             except Exception as e:
                 # Останавливаем анимацию при ошибке
@@ -356,20 +433,21 @@ class MessageHandler:
             logger.info(f"Получено изображение от пользователя {user_id}")
             
             # Отправляем статус "печатает..."
-            await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
+            send_chat_action(message)
+            
+            # Под перегрузкой анимация отключается
+            level = degradation.level
             
             # Запускаем анимацию загрузки
-            await self._start_loading_animation(message, "🤖 AI: Анализирую изображение")
-            logger.info(f"Запущена анимация анализа изображения для пользователя {user_id}")
+            if level['animation']:
+                await self._start_loading_animation(message, "🤖 AI: Анализирую изображение")
+                logger.info(f"Запущена анимация анализа изображения для пользователя {user_id}")
             
             try:
                 # Получаем фото в максимальном разрешении
                 photo = message.photo[-1]
-                file = await message.bot.get_file(photo.file_id)
-                file_content = await message.bot.download_file(file.file_path)
-                
-                # Сохраняем фото
-                photo_data = file_content.read()
+                # С локальным сервером Bot API файл читается с диска, иначе скачивается по HTTP
+                photo_data = await download_file_data(message.bot, photo.file_id)
                 logger.info(f"Получены данные изображения размером {len(photo_data)} байт")
                 
                 # Анализируем изображение
@@ -383,59 +461,10 @@ class MessageHandler:
                 logger.info(f"Получен результат анализа изображения для пользователя {user_id}")
                 
                 # Останавливаем анимацию загрузки и получаем сообщение
-                loading_message = await self._stop_loading_animation(user_id)
+                if level['animation']:
+                    loading_message = await self._stop_loading_animation(user_id)
                 
-                if loading_message:
-                    logger.info(f"Начинаем обновление сообщения с результатами анализа для пользователя {user_id}")
-                    
-                    # Постепенно обновляем текст
-                    chunks = re.split(r'(?<=[.!?])\s+(?=[А-ЯA-Z])', result)
-                    current_text = "🤖 AI: "
-                    
-                    for i, chunk in enumerate(chunks):
-                        if chunk.strip():
-                            # Добавляем пробел перед частью, если это не первая часть
-                            if current_text != "🤖 AI: ":
-                                current_text += " " + chunk
-                            else:
-                                current_text += chunk
-                            
-                            # Обновляем сообщение с новым содержимым
-                            try:
-                                await update_message_with_retry(loading_message, current_text)
-                                logger.info(f"Обновлено сообщение с анализом изображения часть {i+1}/{len(chunks)} для пользователя {user_id}")
-                            except Exception as e:
-                                logger.error(f"Ошибка при обновлении сообщения с анализом изображения: {str(e)}")
-                                # Если не удалось обновить, отправляем новое сообщение
-                                loading_message = await send_message_with_retry(message, current_text)
-                            
-                            # Уменьшаем задержку для более быстрого отображения
-                            await asyncio.sleep(0.2)
-                    
-                    # В конце добавляем клавиатуру
-                    try:
-                        await update_message_with_retry(
-                            loading_message, 
-                            current_text, 
-                            reply_markup=get_main_keyboard()
-                        )
-                        logger.info(f"Добавлена клавиатура к сообщению с анализом изображения для пользователя {user_id}")
-                    except Exception as e:
-                        logger.error(f"Ошибка при добавлении клавиатуры к сообщению с анализом изображения: {str(e)}")
-                        # Если не удалось обновить, отправляем новое сообщение с клавиатурой
-                        await send_message_with_retry(
-                            message, 
-                            current_text, 
-                            reply_markup=get_main_keyboard()
-                        )
-                else:
-                    logger.error(f"Не удалось получить сообщение с индикатором загрузки для пользователя {user_id}")
-                    # Если не получили сообщение с загрузкой, отправляем новое сообщение
-                    await send_message_with_retry(
-                        message, 
-                        f"🤖 AI: {result}", 
-                        reply_markup=get_main_keyboard()
-                    )
+                await self._deliver_response(message, result, loading_message, level)
                 
                 logger.info(f"Отправлен результат анализа изображения пользователю {user_id}")
             except Exception as e:
@@ -494,84 +523,51 @@ class MessageHandler:
                     )
             
             # Логируем получение файла
-            file_name = message.document.file_name or "Безымянный файл"
+            document = message.document
+            file_name = document.file_name or "Безымянный файл"
             logger.info(f"Получен файл от пользователя {user_id}: {file_name}")
             
+            # Неподдерживаемые и слишком большие файлы отклоняем по метаданным, не скачивая
+            admission = await self.document_admission.check(message.bot, document)
+            if not admission['accepted']:
+                await send_message_with_retry(message, f"🤖 AI: {admission['message']}", reply_markup=get_main_keyboard())
+                if state:
+                    await state.clear()
+                return
+            if admission['kind'] == 'audio':
+                # Аудио, отправленное файлом, обрабатывается как аудиозапись
+                prompt = (f"Это аудиофайл «{file_name}». Если в нем речь — кратко перескажи ее, "
+                          f"если музыка — опиши ее.")
+                await self._handle_audio_message(message, state, document.file_id, document.mime_type,
+                                                 None, document.file_size, prompt, "аудиофайла")
+                return
+            
             # Отправляем статус "печатает..."
-            await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
+            send_chat_action(message)
+            
+            # Под перегрузкой анимация отключается
+            level = degradation.level
             
             # Запускаем анимацию загрузки
-            await self._start_loading_animation(message, "🤖 AI: Анализирую файл")
-            logger.info(f"Запущена анимация анализа файла для пользователя {user_id}")
+            if level['animation']:
+                await self._start_loading_animation(message, "🤖 AI: Анализирую файл")
+                logger.info(f"Запущена анимация анализа файла для пользователя {user_id}")
             
             try:
                 # Получаем файл
-                file = await message.bot.get_file(message.document.file_id)
-                file_content = await message.bot.download_file(file.file_path)
-                
-                # Сохраняем содержимое файла
-                file_data = file_content.read()
+                file_data = await download_file_data(message.bot, document.file_id)
                 logger.info(f"Получены данные файла размером {len(file_data)} байт")
                 
                 # Анализируем файл
                 logger.info(f"Отправляем файл на анализ")
-                result = await self.gemini_service.analyze_file(file_data, file_name)
+                result = await self.gemini_service.analyze_file(file_data, admission['file_name'], admission['kind'])
                 logger.info(f"Получен результат анализа файла для пользователя {user_id}")
                 
                 # Останавливаем анимацию загрузки и получаем сообщение
-                loading_message = await self._stop_loading_animation(user_id)
+                if level['animation']:
+                    loading_message = await self._stop_loading_animation(user_id)
                 
-                if loading_message:
-                    logger.info(f"Начинаем обновление сообщения с результатами анализа файла для пользователя {user_id}")
-                    
-                    # Постепенно обновляем текст
-                    chunks = re.split(r'(?<=[.!?])\s+(?=[А-ЯA-Z])', result)
-                    current_text = "🤖 AI: "
-                    
-                    for i, chunk in enumerate(chunks):
-                        if chunk.strip():
-                            # Добавляем пробел перед частью, если это не первая часть
-                            if current_text != "🤖 AI: ":
-                                current_text += " " + chunk
-                            else:
-                                current_text += chunk
-                            
-                            # Обновляем сообщение с новым содержимым
-                            try:
-                                await update_message_with_retry(loading_message, current_text)
-                                logger.info(f"Обновлено сообщение с анализом файла часть {i+1}/{len(chunks)} для пользователя {user_id}")
-                            except Exception as e:
-                                logger.error(f"Ошибка при обновлении сообщения с анализом файла: {str(e)}")
-                                # Если не удалось обновить, отправляем новое сообщение
-                                loading_message = await send_message_with_retry(message, current_text)
-                            
-                            # Уменьшаем задержку для более быстрого отображения
-                            await asyncio.sleep(0.2)
-                    
-                    # В конце добавляем клавиатуру
-                    try:
-                        await update_message_with_retry(
-                            loading_message, 
-                            current_text, 
-                            reply_markup=get_main_keyboard()
-                        )
-                        logger.info(f"Добавлена клавиатура к сообщению с анализом файла для пользователя {user_id}")
-                    except Exception as e:
-                        logger.error(f"Ошибка при добавлении клавиатуры к сообщению с анализом файла: {str(e)}")
-                        # Если не удалось обновить, отправляем новое сообщение с клавиатурой
-                        await send_message_with_retry(
-                            message, 
-                            current_text, 
-                            reply_markup=get_main_keyboard()
-                        )
-                else:
-                    logger.error(f"Не удалось получить сообщение с индикатором загрузки для пользователя {user_id}")
-                    # Если не получили сообщение с загрузкой, отправляем новое сообщение
-                    await send_message_with_retry(
-                        message, 
-                        f"🤖 AI: {result}", 
-                        reply_markup=get_main_keyboard()
-                    )
+                await self._deliver_response(message, result, loading_message, level)
                 
                 logger.info(f"Отправлен результат анализа файла пользователю {user_id}")
             except Exception as e:
@@ -605,4 +601,132 @@ class MessageHandler:
             )
             # Очищаем состояние
             if state:
-                await state.clear() 
\ No newline at end of file
+                await state.clear() 
+
+    async def handle_voice(self, message: types.Message, state: FSMContext = None):
+        """
+        Обработчик голосовых сообщений
+        
+        Args:
+            message: Сообщение с голосовой записью
+            state: Состояние FSM (если используется)
+        """
+        prompt = ("Это голосовое сообщение пользователя. Ответь на него так, "
+                  "как ответил бы на такое же текстовое сообщение.")
+        voice = message.voice
+        await self._handle_audio_message(message, state, voice.file_id, voice.mime_type or 'audio/ogg',
+                                         voice.duration, voice.file_size, prompt, "голосового сообщения")
+
+    async def handle_audio(self, message: types.Message, state: FSMContext = None):
+        """
+        Обработчик аудиофайлов
+        
+        Args:
+            message: Сообщение с аудиофайлом
+            state: Состояние FSM (если используется)
+        """
+        audio = message.audio
+        title = audio.title or audio.file_name or "без названия"
+        prompt = (f"Это аудиофайл «{title}». Если в нем речь — кратко перескажи ее, "
+                  f"если музыка — опиши ее.")
+        if message.caption:
+            prompt += f" Пользователь добавил: {message.caption}"
+        await self._handle_audio_message(message, state, audio.file_id, audio.mime_type or 'audio/mpeg',
+                                         audio.duration, audio.file_size, prompt, "аудиофайла")
+
+    async def _handle_audio_message(self, message: types.Message, state: FSMContext, file_id: str,
+                                    mime_type: str, duration: int, file_size: int, prompt: str, kind: str):
+        """
+        Общий путь голосовых сообщений и аудиофайлов: скачивание, перекодирование при необходимости,
+        запрос к модели и постепенный вывод ответа
+        
+        Args:
+            message: Сообщение пользователя
+            state: Состояние FSM (если используется)
+            file_id: Идентификатор аудио в Telegram
+            mime_type: MIME-тип аудио
+            duration: Длительность записи в секундах
+            file_size: Размер файла в байтах (может быть неизвестен)
+            prompt: Текст запроса к записи
+            kind: Название вида записи для сообщений и журнала
+        """
+        user_id = message.from_user.id
+        loading_message = None
+        timings = {}
+        
+        try:
+            logger.info(f"Получена запись ({kind}) от пользователя {user_id}: {duration} с, {mime_type}")
+            
+            # Длинные записи отклоняем до скачивания, чтобы они не занимали воркеры
+            max_duration = AUDIO_CONFIG['max_duration']
+            if duration and duration > max_duration:
+                await send_message_with_retry(
+                    message,
+                    f"🤖 AI: Запись слишком длинная ({duration} с). Я обрабатываю записи до {max_duration} с.",
+                    reply_markup=get_main_keyboard()
+                )
+                return
+            
+            # Отправляем статус "печатает..."
+            send_chat_action(message)
+            
+            # Под перегрузкой анимация отключается
+            level = degradation.level
+            
+            if level['animation']:
+                await self._start_loading_animation(message, "🤖 AI: Слушаю запись")
+            
+            try:
+                started = time.monotonic()
+                if self.audio_transcoder.needs_transcode(mime_type, file_size) and self.audio_transcoder.available:
+                    # Перекодирование идет параллельно со скачиванием, поэтому этапы замеряются вместе
+                    audio_data = await self.audio_transcoder.transcode(
+                        iter_file_chunks(message.bot, file_id), max_duration
+                    )
+                    mime_type = OUTPUT_MIME_TYPE
+                    timings['download+transcode'] = time.monotonic() - started
+                else:
+                    # Голосовые сообщения (Ogg/Opus) модель принимает как есть
+                    audio_data = await download_file_data(message.bot, file_id)
+                    timings['download'] = time.monotonic() - started
+                
+                started = time.monotonic()
+                result = await self.gemini_service.analyze_audio(audio_data, mime_type, prompt)
+                timings['generate'] = time.monotonic() - started
+                
+                # Останавливаем анимацию загрузки и получаем сообщение
+                if level['animation']:
+                    loading_message = await self._stop_loading_animation(user_id)
+                
+                started = time.monotonic()
+                await self._deliver_response(message, result, loading_message, level)
+                timings['deliver'] = time.monotonic() - started
+                
+                stages = ", ".join(f"{stage} {elapsed:.2f} с" for stage, elapsed in timings.items())
+                logger.info(f"Обработка {kind} пользователя {user_id} ({len(audio_data)} байт): {stages}")
+            except Exception as e:
+                # Останавливаем анимацию при ошибке
+                if user_id in self._loading_tasks:
+                    await self._stop_loading_animation(user_id)
+                
+                logger.error(f"Ошибка при обработке {kind}: {str(e)}")
+                await send_message_with_retry(
+                    message,
+                    f"🤖 AI: Извините, не удалось проанализировать запись. Ошибка: {str(e)}",
+                    reply_markup=get_main_keyboard()
+                )
+            
+        except Exception as e:
+            # Останавливаем анимацию при ошибке, если она запущена
+            if user_id in self._loading_tasks:
+                await self._stop_loading_animation(user_id)
+                
+            logger.error(f"Критическая ошибка при обработке {kind}: {str(e)}")
+            await send_message_with_retry(
+                message,
+                f"🤖 AI: Извините, произошла ошибка при обработке вашей записи. Ошибка: {str(e)}",
+                reply_markup=get_main_keyboard()
+            )
+        finally:
+            if state:
+                await state.clear()
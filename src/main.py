@@ -3,32 +3,42 @@ import logging
 import signal
 import os # Добавлено для os.getenv
 from dotenv import load_dotenv # Добавлено для загрузки .env
-from aiogram import Bot, Dispatcher, types # Добавлено types для Message
+from aiogram import Dispatcher, types # Добавлено types для Message
 from aiogram.filters import Command
 from aiogram.fsm.storage.memory import MemoryStorage
-from src.config.config import TELEGRAM_TOKEN, LOGGING_CONFIG
+from src.config.config import LOGGING_CONFIG, PROMPT_BUDGET_CONFIG
 from src.handlers.command_handlers import cmd_start, cmd_help, cmd_about
 from src.handlers.message_handler import MessageHandler, BotState
-from aiogram.client.default import DefaultBotProperties
+from src.handlers.inline_handler import InlineQueryHandler
+from src.utils.logging_utils import setup_logging
+from src.utils.bot_api import create_bot
+from src.utils.loop_watchdog import LoopWatchdog
+from src.services.traffic_recorder import traffic_recorder, TrafficRecorderMiddleware
+from src.services.chat_actors import ChatActorMiddleware
 
 import google.generativeai as genai # Основной импорт для Gemini
 
 # Загрузка переменных окружения .env
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    level=LOGGING_CONFIG['level'],
-    format=LOGGING_CONFIG['format']
-)
+# Настройка логирования (запись в лог выполняется в фоновом потоке)
+setup_logging(LOGGING_CONFIG)
 logger = logging.getLogger(__name__)
 
 # Инициализация бота и диспетчера
-bot = Bot(token=TELEGRAM_TOKEN, default=DefaultBotProperties(parse_mode="MarkdownV2"))
+bot = create_bot()
 # Используем хранилище состояний в памяти
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
+# Запись входящих обновлений для воспроизведения нагрузки (включается TRAFFIC_RECORD_PATH)
+if traffic_recorder.enabled:
+    dp.update.outer_middleware(TrafficRecorderMiddleware(traffic_recorder))
+
+# Обновления одного чата обрабатываются по очереди, разные чаты — параллельно
+chat_actors = ChatActorMiddleware()
+dp.update.outer_middleware(chat_actors)
+
 # Настройка Google Gemini
 GEMINI_API_KEY = os.getenv('GOOGLE_API_KEY')
 if not GEMINI_API_KEY:
@@ -43,10 +53,17 @@ message_handler = MessageHandler()
 
 # Регистрация обработчиков команд
 dp.message.register(cmd_about, Command("about"))
+dp.message.register(message_handler.handle_cache_command, Command("cache"))
 
 # Регистрация обработчиков медиа-контента
 dp.message.register(message_handler.handle_photo, lambda message: message.photo)
 dp.message.register(message_handler.handle_document, lambda message: message.document)
+dp.message.register(message_handler.handle_voice, lambda message: message.voice)
+dp.message.register(message_handler.handle_audio, lambda message: message.audio)
+
+# Inline-режим использует тот же сервис Gemini (пул ключей и статистику)
+inline_handler = InlineQueryHandler(message_handler.gemini_service)
+dp.inline_query.register(inline_handler.handle_inline_query)
 
 # Регистрация обработчика текстовых сообщений (должен быть последним)
 dp.message.register(message_handler.handle_message)
@@ -55,26 +72,9 @@ GENERATION_CONFIG = genai.types.GenerationConfig(
     temperature=0.7,
     top_p=0.8,
     top_k=40,
-    max_output_tokens=1024,  # Уменьшаем максимальную длину ответа
+    max_output_tokens=PROMPT_BUDGET_CONFIG['output_tokens']['text'],  # Бюджет ответа для текстовых запросов
 )
 
-def escape_html(text: str) -> str:
-    """
-    Обрабатывает текст для корректного отображения в HTML.
-    Заменяет специальные символы HTML на их сущности.
-    Args:
-        text: Исходный текст
-    Returns:
-        str: Текст, готовый для отображения в HTML
-    """
-    text = text.replace('&', '&amp;')
-    text = text.replace('<', '&lt;')
-    text = text.replace('>', '&gt;')
-    # Экранируем точку, как того требует ошибка Telegram API в некоторых случаях
-    text = text.replace('.', '&#46;') 
-    # При необходимости можно добавить text = text.replace('"', '&quot;')
-    return text
-
 # Обработчик команды /start
 @dp.message(Command("start"))
 async def local_cmd_start(message: types.Message):
@@ -185,6 +185,10 @@ async def main():
     for sig in (signal.SIGTERM, signal.SIGINT):
         signal.signal(sig, shutdown_handler)
     
+    # Сторож сообщает о блокирующем коде в цикле событий
+    watchdog = LoopWatchdog()
+    watchdog.start()
+    
     try:
         # Запускаем бота
         logger.info("Бот запущен и готов к работе!")
@@ -194,6 +198,9 @@ async def main():
     finally:
         # Завершение работы бота
         logger.info("Завершение работы бота...")
+        watchdog.stop()
+        message_handler.gemini_service.flush()
+        traffic_recorder.close()
         await bot.session.close()
 
 if __name__ == '__main__':
@@ -0,0 +1,123 @@
+import time
+import shutil
+import asyncio
+import logging
+from src.config.config import AUDIO_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Результат перекодирования: Ogg/Opus, моно, пониженная частота
+OUTPUT_MIME_TYPE = 'audio/ogg'
+
+
+class TranscodeError(Exception):
+    """Не удалось перекодировать аудио"""
+
+
+class AudioTranscoder:
+    """
+    Перекодирует аудио в формат, который принимает Gemini, отдельными процессами ffmpeg
+
+    Данные подаются в ffmpeg по мере скачивания, поэтому загрузка и перекодирование
+    идут параллельно. Число одновременных процессов ограничено, чтобы длинные записи
+    не занимали все ядра; запись обрезается до максимальной длительности.
+    """
+
+    def __init__(self, config: dict = None):
+        self.config = config or AUDIO_CONFIG
+        self._semaphore = asyncio.Semaphore(self.config['max_workers'])
+        self._ffmpeg = shutil.which(self.config['ffmpeg_path'])
+        if self._ffmpeg is None:
+            logger.warning("ffmpeg не найден, аудио в неподдерживаемых форматах будет отправляться без перекодирования")
+
+    @property
+    def available(self) -> bool:
+        return self._ffmpeg is not None
+
+    def needs_transcode(self, mime_type: str, size: int) -> bool:
+        """
+        Нужно ли перекодировать аудио перед отправкой в модель
+
+        Args:
+            mime_type: MIME-тип файла
+            size: Размер файла в байтах (0, если неизвестен)
+
+        Returns:
+            bool: True, если формат не поддерживается моделью или файл слишком велик для запроса
+        """
+        mime_type = (mime_type or '').split(';')[0].strip().lower()
+        if mime_type not in self.config['supported_mime_types']:
+            return True
+        return bool(size) and size > self.config['inline_limit']
+
+    def _command(self, max_duration: int) -> list:
+        return [
+            self._ffmpeg, '-hide_banner', '-loglevel', 'error', '-nostdin',
+            '-i', 'pipe:0', '-t', str(max_duration), '-vn',
+            '-ac', '1', '-ar', str(self.config['sample_rate']),
+            '-c:a', 'libopus', '-b:a', self.config['bitrate'],
+            '-f', 'ogg', 'pipe:1',
+        ]
+
+    async def transcode(self, chunks, max_duration: int = None) -> bytes:
+        """
+        Перекодирует поток аудио в Ogg/Opus
+
+        Args:
+            chunks: Асинхронный итератор частей исходного файла
+            max_duration: Сколько секунд записи оставить
+
+        Returns:
+            bytes: Перекодированное аудио (OUTPUT_MIME_TYPE)
+        """
+        if not self.available:
+            raise TranscodeError("ffmpeg не установлен")
+        max_duration = max_duration or self.config['max_duration']
+
+        async with self._semaphore:
+            started = time.monotonic()
+            process = await asyncio.create_subprocess_exec(
+                *self._command(max_duration),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            received = 0
+
+            async def feed():
+                nonlocal received
+                try:
+                    async for chunk in chunks:
+                        received += len(chunk)
+                        process.stdin.write(chunk)
+                        await process.stdin.drain()
+                except (BrokenPipeError, ConnectionResetError):
+                    # ffmpeg перестает читать, когда достигнута максимальная длительность
+                    pass
+                finally:
+                    process.stdin.close()
+
+            feeder = asyncio.create_task(feed())
+            try:
+                output, errors = await asyncio.wait_for(
+                    asyncio.gather(process.stdout.read(), process.stderr.read()),
+                    self.config['transcode_timeout'],
+                )
+                await process.wait()
+                # Ошибка скачивания важнее ошибки ffmpeg, который получил неполный файл
+                await feeder
+            except asyncio.TimeoutError:
+                raise TranscodeError("Перекодирование аудио заняло слишком много времени")
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                if not feeder.done():
+                    feeder.cancel()
+
+            if process.returncode != 0 or not output:
+                message = errors.decode('utf-8', errors='replace').strip().splitlines()
+                raise TranscodeError(f"ffmpeg завершился с ошибкой: {message[-1] if message else process.returncode}")
+
+        logger.info(f"Аудио перекодировано: {received} -> {len(output)} байт за {time.monotonic() - started:.2f} с")
+        return output
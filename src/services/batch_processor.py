@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from src.config.config import BATCH_CONFIG
+from src.services.gemini_service import GeminiService, ErrorReply
+from src.utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Поддерживаемые типы заданий в манифесте
+JOB_TYPES = ('text', 'image', 'file')
+
+
+def load_manifest(manifest_path: str):
+    """
+    Лениво читает JSONL-манифест заданий
+
+    Каждая строка — объект с полями:
+        id: Уникальный идентификатор задания (по умолчанию номер строки)
+        type: text | image | file
+        text: Текст запроса (для type=text)
+        path: Путь к изображению или файлу (для type=image/file)
+        prompt: Дополнительный запрос к изображению (опционально)
+        file_name: Имя файла для анализа (по умолчанию берется из path)
+
+    Yields:
+        dict: Задание
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, encoding='utf-8') as manifest:
+        for line_number, line in enumerate(manifest, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Некорректный JSON в строке {line_number}: {str(e)}")
+
+            job.setdefault('id', str(line_number))
+            job['id'] = str(job['id'])
+            if job.get('type') not in JOB_TYPES:
+                raise ValueError(f"Неизвестный тип задания в строке {line_number}: {job.get('type')}")
+            if job['type'] == 'text' and not job.get('text'):
+                raise ValueError(f"Задание {job['id']} без поля text")
+            if job['type'] in ('image', 'file'):
+                if not job.get('path'):
+                    raise ValueError(f"Задание {job['id']} без поля path")
+                if not os.path.isabs(job['path']):
+                    job['path'] = os.path.join(base_dir, job['path'])
+            yield job
+
+
+class JsonlResultSink:
+    """Записывает результаты построчно в JSONL-файл"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def completed_ids(self) -> set:
+        """Возвращает идентификаторы успешно выполненных заданий (для возобновления)"""
+        completed = set()
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path, encoding='utf-8') as results:
+            for line in results:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Последняя строка могла быть оборвана при аварийном завершении
+                    continue
+                if record.get('status') == 'ok':
+                    completed.add(str(record.get('id')))
+        return completed
+
+    def write(self, record: dict):
+        """Дописывает результат и сразу сбрасывает его на диск"""
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class SqliteResultSink:
+    """Записывает результаты в таблицу SQLite"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "id TEXT PRIMARY KEY, type TEXT, status TEXT, result TEXT, "
+            "error TEXT, latency REAL, attempts INTEGER, finished_at REAL)"
+        )
+        self._connection.commit()
+
+    def completed_ids(self) -> set:
+        """Возвращает идентификаторы успешно выполненных заданий (для возобновления)"""
+        rows = self._connection.execute("SELECT id FROM results WHERE status = 'ok'")
+        return {row[0] for row in rows}
+
+    def write(self, record: dict):
+        """Сохраняет результат, перезаписывая предыдущую неудачную попытку"""
+        self._connection.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                record['id'], record['type'], record['status'], record.get('result'),
+                record.get('error'), record['latency'], record['attempts'], record['finished_at'],
+            )
+        )
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+def open_result_sink(path: str, output_format: str = None):
+    """
+    Создает приемник результатов по формату или расширению файла
+
+    Args:
+        path: Путь к файлу результатов
+        output_format: jsonl или sqlite (по умолчанию определяется по расширению)
+    """
+    if output_format is None:
+        _, ext = os.path.splitext(path)
+        output_format = 'sqlite' if ext.lower() in ('.db', '.sqlite', '.sqlite3') else 'jsonl'
+    if output_format == 'sqlite':
+        return SqliteResultSink(path)
+    if output_format == 'jsonl':
+        return JsonlResultSink(path)
+    raise ValueError(f"Неизвестный формат результатов: {output_format}")
+
+
+class ErrorReplyError(Exception):
+    """Сервис вернул пользователю сообщение об ошибке вместо результата"""
+
+
+class BatchProcessor:
+    """
+    Прогоняет задания из манифеста через GeminiService с ограничением
+    параллелизма и частоты запросов
+    """
+
+    def __init__(self, sink, gemini_service: GeminiService = None, concurrency: int = None,
+                 rate_limit: float = None, max_retries: int = None):
+        self.sink = sink
+        self.gemini_service = gemini_service or GeminiService()
+        self.concurrency = concurrency or BATCH_CONFIG['concurrency']
+        self.max_retries = BATCH_CONFIG['max_retries'] if max_retries is None else max_retries
+        rate_limit = rate_limit or BATCH_CONFIG['rate_limit']
+        self._limiter = TokenBucket(rate_limit, capacity=max(1.0, rate_limit))
+        self.stats = {'ok': 0, 'failed': 0, 'skipped': 0}
+        self._latencies = []
+
+    async def _execute(self, job: dict) -> str:
+        """Выполняет одно задание и проверяет, что сервис вернул результат, а не сообщение об ошибке"""
+        result = await self._call_service(job)
+        if isinstance(result, ErrorReply):
+            raise ErrorReplyError(str(result))
+        return result
+
+    async def _call_service(self, job: dict) -> str:
+        """Вызывает соответствующий заданию метод GeminiService"""
+        if job['type'] == 'text':
+            return await self.gemini_service.generate_response(job['text'])
+
+        # Чтение с диска выносим из цикла событий
+        data = await asyncio.to_thread(_read_file, job['path'])
+        if job['type'] == 'image':
+            return await self.gemini_service.analyze_image(data, prompt=job.get('prompt'))
+        file_name = job.get('file_name') or os.path.basename(job['path'])
+        return await self.gemini_service.analyze_file(data, file_name)
+
+    async def _process(self, job: dict):
+        """Выполняет задание с повторными попытками и записывает результат"""
+        started = time.monotonic()
+        record = {'id': job['id'], 'type': job['type']}
+        for attempt in range(1, self.max_retries + 2):
+            await self._limiter.acquire()
+            try:
+                record['result'] = await self._execute(job)
+                record['status'] = 'ok'
+                record.pop('error', None)
+                break
+            except Exception as e:
+                record['status'] = 'failed'
+                record['error'] = str(e)
+                logger.warning(f"Задание {job['id']} завершилось ошибкой (попытка {attempt}): {str(e)}")
+                if attempt <= self.max_retries:
+                    await asyncio.sleep(BATCH_CONFIG['retry_delay'] * attempt)
+
+        record['attempts'] = attempt
+        record['latency'] = round(time.monotonic() - started, 3)
+        record['finished_at'] = time.time()
+        self.sink.write(record)
+
+        self.stats[record['status']] += 1
+        self._latencies.append(record['latency'])
+        done = self.stats['ok'] + self.stats['failed']
+        if done % BATCH_CONFIG['progress_interval'] == 0:
+            logger.info(f"Обработано заданий: {done} (ошибок: {self.stats['failed']})")
+
+    async def _produce(self, jobs, completed: set, queue: asyncio.Queue, workers: int):
+        """Читает задания в очередь, пропуская выполненные, и завершает воркеров"""
+        for job in jobs:
+            if job['id'] in completed:
+                self.stats['skipped'] += 1
+                continue
+            await queue.put(job)
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            job = await queue.get()
+            try:
+                if job is None:
+                    return
+                await self._process(job)
+            finally:
+                queue.task_done()
+
+    async def run(self, jobs) -> dict:
+        """
+        Обрабатывает задания, пропуская уже выполненные в предыдущих запусках
+
+        Args:
+            jobs: Итерируемый источник заданий (например, load_manifest)
+
+        Returns:
+            dict: Сводка по прогону
+        """
+        completed = self.sink.completed_ids()
+        if completed:
+            logger.info(f"Найдено {len(completed)} выполненных заданий, продолжаем с места остановки")
+
+        # Ограниченная очередь не дает читать манифест сильно впереди обработки
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        started = time.monotonic()
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        producer = asyncio.create_task(self._produce(jobs, completed, queue, len(workers)))
+        tasks = [producer, *workers]
+        try:
+            # Воркер, упавший на записи результата, перестает разбирать очередь: без этого
+            # чтение манифеста навсегда заблокировалось бы на заполненной очереди
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.sink.close()
+            self.gemini_service.flush()
+
+        return self._summary(time.monotonic() - started)
+
+    def _summary(self, elapsed: float) -> dict:
+        """Формирует итоговую статистику пропускной способности"""
+        processed = self.stats['ok'] + self.stats['failed']
+        latencies = sorted(self._latencies)
+
+        def percentile(share: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(share * len(latencies)))]
+
+        return {
+            **self.stats,
+            'processed': processed,
+            'elapsed': round(elapsed, 2),
+            'throughput': round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+            'latency_p50': percentile(0.5),
+            'latency_p95': percentile(0.95),
+        }
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, 'rb') as source:
+        return source.read()
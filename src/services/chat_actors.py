@@ -0,0 +1,136 @@
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from src.config.config import CHAT_ACTOR_CONFIG
+from src.services.send_queue import send_queue, Priority
+
+logger = logging.getLogger(__name__)
+
+
+class ChatActor:
+    """Почтовый ящик одного чата: обновления выполняются строго по очереди"""
+
+    def __init__(self, chat_id, mailbox_size: int):
+        self.chat_id = chat_id
+        self.mailbox = asyncio.Queue(maxsize=mailbox_size)
+        self.task = None
+        self.dropped = 0  # Сколько обновлений отброшено из-за переполненного ящика
+
+
+class ChatActorMiddleware(BaseMiddleware):
+    """
+    Внешний middleware обновлений, выдающий каждому чату своего актора
+
+    Обновления одного чата (и переходы его FSM) обрабатываются последовательно
+    в порядке поступления, разные чаты — параллельно. Актор создается при первом
+    обновлении и удаляется, как только его ящик опустел. Переполненный ящик
+    (пользователь шлет сообщения быстрее, чем бот отвечает) отбрасывает новые обновления,
+    а пользователь один раз получает просьбу подождать.
+    Обновления без чата (например, inline-запросы) проходят без очереди.
+    """
+
+    def __init__(self, config: dict = None):
+        self.config = config or CHAT_ACTOR_CONFIG
+        self.actors = {}
+        self.stats = {
+            'enqueued': 0, 'processed': 0, 'dropped': 0, 'dropped_chats': 0, 'created': 0,
+            'peak_actors': 0, 'max_depth': 0, 'queue_wait_total': 0.0, 'queue_wait_max': 0.0,
+        }
+        self._last_log = time.monotonic()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get('event_chat')
+        if not self.config['enabled'] or chat is None:
+            return await handler(event, data)
+
+        actor = self.actors.get(chat.id)
+        if actor is None:
+            actor = ChatActor(chat.id, self.config['mailbox_size'])
+            self.actors[chat.id] = actor
+            self.stats['created'] += 1
+            self.stats['peak_actors'] = max(self.stats['peak_actors'], len(self.actors))
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            # Без await до постановки в ящик: порядок задач обновлений сохраняется
+            actor.mailbox.put_nowait((handler, event, data, future, time.monotonic()))
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+            actor.dropped += 1
+            logger.warning(f"Очередь чата {chat.id} переполнена, обновление отброшено")
+            if actor.dropped == 1:
+                self._notify_busy(data.get('bot'), chat.id)
+            return None
+
+        self.stats['enqueued'] += 1
+        self.stats['max_depth'] = max(self.stats['max_depth'], actor.mailbox.qsize())
+        if actor.task is None:
+            actor.task = asyncio.create_task(self._run(actor))
+        return await future
+
+    def _notify_busy(self, bot, chat_id: int):
+        """Просит пользователя подождать (один раз за время жизни актора, чтобы не отвечать на каждое сообщение)"""
+        if bot is None:
+            return
+        self.stats['dropped_chats'] += 1
+        text = self.config['busy_message']
+        send_queue.submit_nowait(chat_id, lambda: bot.send_message(chat_id, text, parse_mode=None), Priority.FINAL)
+
+    async def _run(self, actor: ChatActor):
+        """Обрабатывает ящик актора до опустошения, затем удаляет актора"""
+        try:
+            while not actor.mailbox.empty():
+                handler, event, data, future, enqueued_at = actor.mailbox.get_nowait()
+                wait = time.monotonic() - enqueued_at
+                self.stats['queue_wait_total'] += wait
+                self.stats['queue_wait_max'] = max(self.stats['queue_wait_max'], wait)
+                if future.cancelled():
+                    continue
+                try:
+                    result = await handler(event, data)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    self.stats['processed'] += 1
+        finally:
+            # Между проверкой пустоты ящика и удалением нет await, новое обновление не потеряется
+            if self.actors.get(actor.chat_id) is actor:
+                del self.actors[actor.chat_id]
+            if actor.dropped:
+                logger.warning(f"Чат {actor.chat_id}: отброшено обновлений из-за переполненной очереди: {actor.dropped}")
+            # Если актор остановлен отменой, ожидающие обновления не должны зависнуть
+            while not actor.mailbox.empty():
+                *_, future, _ = actor.mailbox.get_nowait()
+                future.cancel()
+            self._maybe_log()
+
+    def _maybe_log(self):
+        now = time.monotonic()
+        if now - self._last_log >= self.config['stats_log_interval']:
+            self._last_log = now
+            logger.info(f"Акторы чатов: {self.summary()}")
+
+    def summary(self) -> dict:
+        processed = self.stats['processed']
+        return {
+            'actors': len(self.actors),
+            'mailbox_depth': sum(actor.mailbox.qsize() for actor in self.actors.values()),
+            **{key: value for key, value in self.stats.items() if key != 'queue_wait_total'},
+            'queue_wait_avg': round(self.stats['queue_wait_total'] / processed, 3) if processed else 0.0,
+            'queue_wait_max': round(self.stats['queue_wait_max'], 3),
+        }
@@ -0,0 +1,308 @@
+import os
+import re
+import ast
+import json
+import logging
+from html.parser import HTMLParser
+from src.services.prompt_budget import PromptBudget
+
+logger = logging.getLogger(__name__)
+
+# Сколько элементов показывать в структурных сводках
+_MAX_JSON_KEYS = 40
+_MAX_JSON_DEPTH = 4
+_MAX_LIST_ITEMS = 200
+
+_JS_DECLARATION = re.compile(
+    r'^\s*(?:export\s+(?:default\s+)?)?(?:'
+    r'(?:async\s+)?function\s*\*?\s*[\w$]*\s*\([^)]*\)'
+    r'|class\s+[\w$]+(?:\s+extends\s+[\w$.]+)?'
+    r'|(?:const|let|var)\s+[\w$]+\s*=\s*(?:async\s+)?(?:function\b[^{]*|\([^)]*\)\s*=>|[\w$]+\s*=>)'
+    r'|(?:static\s+)?(?:async\s+)?(?:get\s+|set\s+)?(?!if\b|for\b|while\b|switch\b|catch\b|return\b)[\w$]+\s*\([^)]*\)\s*(?=\{)'
+    r')',
+    re.MULTILINE,
+)
+_JS_IMPORT = re.compile(r'^\s*(?:import\s.+?from\s+[\'"][^\'"]+[\'"]|(?:const|let|var)\s+.+?=\s*require\([^)]*\))', re.MULTILINE)
+_JS_EXPORT = re.compile(r'^\s*(?:module\.exports|exports\.[\w$]+)\s*=.*$', re.MULTILINE)
+_CSS_RULE = re.compile(r'([^{}]+)\{')
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+
+
+def _unique(lines) -> list:
+    """Убирает повторяющиеся строки, сохраняя порядок"""
+    return list(dict.fromkeys(lines))
+
+
+def _first_line(docstring: str) -> str:
+    return docstring.strip().splitlines()[0] if docstring and docstring.strip() else ''
+
+
+class _PythonOutline:
+    """Строит сжатое представление Python-модуля по его AST"""
+
+    def __init__(self, source: str):
+        self.tree = ast.parse(source)
+        # ast.get_source_segment заново разбивает исходник на строки при каждом вызове
+        self.lines = source.splitlines()
+        self.functions = []  # (узел, отступ) для последующего добавления тел
+
+    def _signature(self, node) -> str:
+        prefix = 'async def' if isinstance(node, ast.AsyncFunctionDef) else 'def'
+        returns = f" -> {ast.unparse(node.returns)}" if node.returns else ''
+        return f"{prefix} {node.name}({ast.unparse(node.args)}){returns}:"
+
+    def _describe(self, node, indent: str, lines: list):
+        for decorator in getattr(node, 'decorator_list', []):
+            lines.append(f"{indent}@{ast.unparse(decorator)}")
+        if isinstance(node, ast.ClassDef):
+            bases = ', '.join(ast.unparse(base) for base in node.bases)
+            lines.append(f"{indent}class {node.name}({bases}):" if bases else f"{indent}class {node.name}:")
+            docstring = _first_line(ast.get_docstring(node))
+            if docstring:
+                lines.append(f'{indent}    """{docstring}"""')
+            for child in node.body:
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                    self._describe(child, indent + '    ', lines)
+                elif isinstance(child, (ast.Assign, ast.AnnAssign)):
+                    lines.append(f"{indent}    {self._short(ast.unparse(child))}")
+        else:
+            lines.append(f"{indent}{self._signature(node)}")
+            docstring = _first_line(ast.get_docstring(node))
+            if docstring:
+                lines.append(f'{indent}    """{docstring}"""')
+            lines.append(f"{indent}    ...")
+            self.functions.append((node, indent))
+
+    @staticmethod
+    def _short(text: str, limit: int = 100) -> str:
+        text = ' '.join(text.split())
+        return text if len(text) <= limit else text[:limit] + ' ...'
+
+    def outline(self) -> str:
+        lines = []
+        docstring = ast.get_docstring(self.tree)
+        if docstring:
+            lines.append(f'"""{docstring.strip()[:500]}"""')
+
+        imports = []
+        for node in self.tree.body:
+            if isinstance(node, ast.Import):
+                imports.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                imports.append(f"{node.module or '.'}.{{{', '.join(alias.name for alias in node.names)}}}")
+        if imports:
+            lines.append(f"# Импорты: {', '.join(imports)}")
+
+        for node in self.tree.body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                self._describe(node, '', lines)
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+                lines.append(self._short(ast.unparse(node)))
+            elif isinstance(node, ast.If) and '__main__' in ast.unparse(node.test):
+                lines.append("if __name__ == '__main__': ...")
+        return '\n'.join(lines)
+
+    def bodies(self):
+        """
+        Исходный код функций в порядке представительности:
+        сначала публичные и компактные, затем служебные и большие
+        """
+        def rank(item):
+            node, _ = item
+            size = (node.end_lineno or node.lineno) - node.lineno
+            return node.name.startswith('_'), size
+
+        for node, _ in sorted(self.functions, key=rank):
+            first = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+            yield '\n'.join(self.lines[first - 1:node.end_lineno])
+
+
+def _describe_json(value, depth: int = 0) -> str:
+    """Структурное описание JSON-значения: ключи, типы и размеры"""
+    indent = '  ' * depth
+    if isinstance(value, dict):
+        if depth >= _MAX_JSON_DEPTH:
+            return f"{{... {len(value)} ключей}}"
+        lines = [f"{{  # {len(value)} ключей"]
+        for index, (key, item) in enumerate(value.items()):
+            if index >= _MAX_JSON_KEYS:
+                lines.append(f"{indent}  ... еще {len(value) - index} ключей")
+                break
+            lines.append(f"{indent}  {json.dumps(key, ensure_ascii=False)}: {_describe_json(item, depth + 1)}")
+        lines.append(f"{indent}}}")
+        return '\n'.join(lines)
+    if isinstance(value, list):
+        if not value:
+            return "[]"
+        sample = value[:_MAX_LIST_ITEMS]
+        if all(isinstance(item, dict) for item in sample):
+            # Для списка объектов объединяем ключи, чтобы показать схему элементов
+            merged = {}
+            for item in sample:
+                for key, item_value in item.items():
+                    merged.setdefault(key, item_value)
+            return f"[  # {len(value)} объектов, схема элемента:\n{indent}  {_describe_json(merged, depth + 1)}\n{indent}]"
+        return f"[  # {len(value)} элементов, первый: {_describe_json(value[0], depth + 1)}]"
+    if isinstance(value, str):
+        shown = value if len(value) <= 60 else value[:60] + '...'
+        return json.dumps(shown, ensure_ascii=False)
+    return json.dumps(value)
+
+
+class _HtmlOutline(HTMLParser):
+    """Собирает структуру HTML: заголовки, формы, подключаемые ресурсы и образец текста"""
+
+    _HEADINGS = ('h1', 'h2', 'h3')
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.tag_counts = {}
+        self.text_sample = []
+        self._capture = None
+        self._skip_text = 0
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        self.tag_counts[tag] = self.tag_counts.get(tag, 0) + 1
+        if tag in ('script', 'style'):
+            self._skip_text += 1
+            if attrs.get('src'):
+                self.lines.append(f"<script src={attrs['src']}>")
+        elif tag == 'link' and attrs.get('href'):
+            self.lines.append(f"<link rel={attrs.get('rel')} href={attrs['href']}>")
+        elif tag in ('form', 'input', 'button', 'select', 'textarea'):
+            described = ' '.join(f"{key}={value}" for key, value in attrs.items()
+                                 if key in ('id', 'name', 'type', 'action', 'method'))
+            self.lines.append(f"<{tag} {described}>".replace(' >', '>'))
+        elif attrs.get('id'):
+            self.lines.append(f"<{tag} id={attrs['id']}>")
+        if tag == 'title' or tag in self._HEADINGS:
+            self._capture = [tag, []]
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style') and self._skip_text:
+            self._skip_text -= 1
+        if self._capture and tag == self._capture[0]:
+            text = ' '.join(''.join(self._capture[1]).split())
+            self.lines.append(f"<{tag}> {text}")
+            self._capture = None
+
+    def handle_data(self, data):
+        if self._capture:
+            self._capture[1].append(data)
+        elif not self._skip_text and data.strip() and sum(map(len, self.text_sample)) < 1500:
+            self.text_sample.append(' '.join(data.split()))
+
+    def outline(self) -> str:
+        counts = ', '.join(f"{tag}: {count}" for tag, count in
+                           sorted(self.tag_counts.items(), key=lambda item: -item[1])[:15])
+        parts = [f"# Теги: {counts}", *_unique(self.lines)]
+        if self.text_sample:
+            parts.append(f"# Текст страницы: {' '.join(self.text_sample)}")
+        return '\n'.join(parts)
+
+
+class CodeCondenser:
+    """
+    Сжимает большие исходные файлы до структурного представления перед отправкой в модель
+
+    Вместо первых N символов (обычно лицензия и импорты) модель получает сигнатуры,
+    докстринги, ключи верхнего уровня и наиболее представительные тела функций.
+    Файлы, которые и так помещаются в бюджет, не изменяются.
+    """
+
+    SUPPORTED_EXTENSIONS = ('.py', '.js', '.html', '.css', '.json')
+
+    def __init__(self, prompt_budget: PromptBudget):
+        self.prompt_budget = prompt_budget
+
+    def condense(self, file_name: str, text: str, max_tokens: int) -> tuple:
+        """
+        Возвращает содержимое файла, вписанное в бюджет токенов
+
+        Args:
+            file_name: Имя файла (по расширению выбирается способ разбора)
+            text: Исходный текст
+            max_tokens: Бюджет токенов на содержимое
+
+        Returns:
+            tuple: (текст, было ли применено сжатие)
+        """
+        estimator = self.prompt_budget.estimator
+        if estimator.estimate(text) <= max_tokens:
+            return text, False
+
+        _, ext = os.path.splitext(file_name.lower())
+        try:
+            if ext == '.py':
+                condensed = self._condense_python(text, max_tokens)
+            elif ext == '.json':
+                condensed = f"# JSON-структура\n{_describe_json(json.loads(text))}"
+            elif ext == '.js':
+                condensed = self._condense_js(text)
+            elif ext == '.html':
+                parser = _HtmlOutline()
+                parser.feed(text)
+                condensed = parser.outline()
+            elif ext == '.css':
+                condensed = self._condense_css(text)
+            else:
+                return text, False
+        except (SyntaxError, ValueError, RecursionError) as e:
+            # Файл не разбирается (например, фрагмент или другая версия языка) — отправим как есть
+            logger.info(f"Не удалось построить структуру {file_name}: {str(e)}")
+            return text, False
+
+        condensed, _ = self.prompt_budget.fit(condensed, max_tokens)
+        logger.info(f"Файл {file_name} сжат: {len(text)} -> {len(condensed)} символов")
+        return condensed, True
+
+    def _condense_python(self, text: str, max_tokens: int) -> str:
+        outline = _PythonOutline(text)
+        lines = [f"# Python-модуль: {len(text.splitlines())} строк, структура:", outline.outline()]
+        used = self.prompt_budget.estimator.estimate('\n'.join(lines))
+
+        # Оставшийся бюджет заполняем телами функций, начиная с самых представительных
+        bodies_header = "\n# Избранные реализации:"
+        remaining = max_tokens - used - self.prompt_budget.estimator.estimate(bodies_header)
+        bodies = []
+        for body in outline.bodies():
+            cost = self.prompt_budget.estimator.estimate(body)
+            if cost > remaining:
+                continue
+            bodies.append(body)
+            remaining -= cost
+        if bodies:
+            lines.append(bodies_header)
+            lines.extend(bodies)
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _condense_js(text: str) -> str:
+        lines = [f"# JavaScript: {len(text.splitlines())} строк, структура:"]
+        imports = _unique(' '.join(match.group(0).split()) for match in _JS_IMPORT.finditer(text))
+        if imports:
+            lines.append('# Импорты:')
+            lines.extend(imports)
+        lines.append('# Объявления:')
+        # Совпадения идут по порядку, поэтому строки считаем от предыдущего совпадения, а не от начала
+        line_number, counted = 1, 0
+        for match in _JS_DECLARATION.finditer(text):
+            line_number += text.count('\n', counted, match.start())
+            counted = match.start()
+            lines.append(f"{line_number}: {' '.join(match.group(0).split())}")
+        lines.extend(_unique(' '.join(match.group(0).split()) for match in _JS_EXPORT.finditer(text)))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _condense_css(text: str) -> str:
+        text = _CSS_COMMENT.sub('', text)
+        selectors = []
+        seen = set()
+        for match in _CSS_RULE.finditer(text):
+            selector = ' '.join(match.group(1).split())
+            if selector and selector not in seen:
+                seen.add(selector)
+                selectors.append(selector)
+        return f"# CSS: {len(selectors)} уникальных селекторов\n" + '\n'.join(selectors)
@@ -0,0 +1,127 @@
+import time
+import asyncio
+import logging
+import contextlib
+from collections import deque
+from src.config.config import DEGRADATION_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class DegradationController:
+    """
+    Переключает уровни обслуживания в зависимости от нагрузки
+
+    Следит за задержкой цикла событий, числом одновременных запросов к модели
+    и событиями флуд-контроля Telegram. Под нагрузкой уровень повышается сразу,
+    а восстанавливается по одному шагу, когда нагрузка держится ниже порога.
+    """
+
+    def __init__(self, config: dict = None):
+        self.config = config or DEGRADATION_CONFIG
+        self.current = 0
+        self.loop_lag = 0.0
+        self.in_flight = 0
+        self._flood_events = deque()
+        self._below_since = None
+        self._monitor_task = None
+        self.stats = {'transitions': 0, 'flood_events': 0, 'max_level': 0, 'max_loop_lag': 0.0}
+
+    @property
+    def level(self) -> dict:
+        """Настройки текущего уровня обслуживания"""
+        self._ensure_started()
+        if not self.config['enabled']:
+            return self.config['levels'][0]
+        return self.config['levels'][self.current]
+
+    def _ensure_started(self):
+        """Запускает измерение задержки цикла событий при первом обращении из работающего цикла"""
+        if self._monitor_task is not None or not self.config['enabled']:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._monitor_task = loop.create_task(self._monitor())
+
+    async def _monitor(self):
+        interval = self.config['check_interval']
+        alpha = self.config['lag_smoothing']
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            # Насколько позже запланированного проснулась задача — столько цикл был занят
+            lag = max(0.0, time.monotonic() - started - interval)
+            self.loop_lag = alpha * lag + (1 - alpha) * self.loop_lag
+            self.stats['max_loop_lag'] = max(self.stats['max_loop_lag'], round(lag, 3))
+            self.update()
+
+    @contextlib.contextmanager
+    def generation(self):
+        """Учитывает запрос к модели как выполняющийся"""
+        self._ensure_started()
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    def record_flood(self, retry_after: float = None):
+        """Регистрирует ответ флуд-контроля Telegram (TelegramRetryAfter)"""
+        self._flood_events.append(time.monotonic())
+        self.stats['flood_events'] += 1
+        self.update()
+
+    @staticmethod
+    def _threshold_level(value: float, thresholds: list) -> int:
+        return sum(1 for threshold in thresholds if value >= threshold)
+
+    def target_level(self) -> int:
+        """Уровень, соответствующий текущей нагрузке"""
+        now = time.monotonic()
+        while self._flood_events and now - self._flood_events[0] > self.config['flood_window']:
+            self._flood_events.popleft()
+        target = max(
+            self._threshold_level(self.loop_lag, self.config['loop_lag_thresholds']),
+            self._threshold_level(self.in_flight, self.config['in_flight_thresholds']),
+            self._threshold_level(len(self._flood_events), self.config['flood_thresholds']),
+        )
+        return min(target, len(self.config['levels']) - 1)
+
+    def update(self):
+        """Пересчитывает уровень: повышение — сразу, понижение — по шагу после периода спокойствия"""
+        now = time.monotonic()
+        target = self.target_level()
+        if target > self.current:
+            self._set_level(target)
+            self._below_since = None
+        elif target < self.current:
+            if self._below_since is None:
+                self._below_since = now
+            elif now - self._below_since >= self.config['recover_after']:
+                self._set_level(self.current - 1)
+                self._below_since = now
+        else:
+            self._below_since = None
+
+    def _set_level(self, level: int):
+        previous, self.current = self.current, level
+        self.stats['transitions'] += 1
+        self.stats['max_level'] = max(self.stats['max_level'], level)
+        log = logger.warning if level > previous else logger.info
+        log(f"Уровень обслуживания: {self.config['levels'][previous]['name']} -> "
+            f"{self.config['levels'][level]['name']} (задержка цикла {self.loop_lag:.3f} с, "
+            f"запросов к модели {self.in_flight}, флуд-контроль {len(self._flood_events)})")
+
+    def summary(self) -> dict:
+        return {
+            **self.stats,
+            'level': self.config['levels'][self.current]['name'],
+            'loop_lag': round(self.loop_lag, 3),
+            'in_flight': self.in_flight,
+        }
+
+
+# Общий контроллер процесса: нагрузку видят и обработчики, и сервис Gemini, и отправка сообщений
+degradation = DegradationController()
@@ -0,0 +1,206 @@
+import os
+import logging
+from collections import Counter
+from aiogram import Bot, types
+from src.config.config import DOCUMENT_ADMISSION_CONFIG
+from src.services.document_extractor import document_kind
+from src.utils.bot_api import download_file_head
+from src.utils.file_utils import sniff_mime_type, looks_binary
+
+logger = logging.getLogger(__name__)
+
+# Расширение, которое добавляется к имени файла, если формат определен по MIME-типу или сигнатуре
+_MIME_EXTENSIONS = {
+    'application/pdf': '.pdf',
+    'application/zip': '.zip',
+    'text/plain': '.txt',
+    'text/markdown': '.md',
+    'application/json': '.json',
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/bmp': '.bmp',
+}
+
+# MIME-типы текстовых форматов вне text/*
+_TEXT_MIME_TYPES = ('application/json', 'application/javascript', 'application/x-javascript',
+                    'application/x-python-code', 'application/x-sh')
+
+
+def file_kind(file_name: str, config: dict = None) -> str:
+    """
+    Определяет вид обработки файла по расширению
+
+    Returns:
+        str: text, document, image или None, если расширение не поддерживается
+    """
+    config = config or DOCUMENT_ADMISSION_CONFIG
+    _, ext = os.path.splitext((file_name or '').lower())
+    if ext in config['text_extensions']:
+        return 'text'
+    if document_kind(file_name) is not None:
+        return 'document'
+    if ext in config['image_extensions']:
+        return 'image'
+    return None
+
+
+def _mime_kind(mime_type: str, config: dict) -> str:
+    """Вид обработки по MIME-типу (когда расширение не помогло)"""
+    if not mime_type:
+        return None
+    if mime_type.startswith('audio/'):
+        return 'audio'
+    extension = _MIME_EXTENSIONS.get(mime_type)
+    if extension is not None:
+        return file_kind('file' + extension, config)
+    if mime_type.startswith('text/') or mime_type in _TEXT_MIME_TYPES:
+        return 'text'
+    return None
+
+
+def _format_size(size: int) -> str:
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} МБ"
+    return f"{max(1, size // 1024)} КБ"
+
+
+class DocumentAdmission:
+    """
+    Решает, обрабатывать ли документ, до его скачивания
+
+    Используются метаданные из сообщения (MIME-тип, размер, имя файла): исполняемые файлы,
+    видео и файлы сверх лимита отклоняются сразу, без загрузки. Если метаданных недостаточно
+    (нет расширения или MIME-тип противоречит ему), читаются только первые байты файла.
+    Принятый файл направляется к подходящему обработчику: тексту, извлечению из документов,
+    анализу изображений или аудио.
+    """
+
+    def __init__(self, config: dict = None):
+        self.config = config or DOCUMENT_ADMISSION_CONFIG
+        self.stats = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.config['enabled']
+
+    def download_limit(self, bot: Bot) -> int:
+        """Сколько байт бот может скачать: у локального сервера Bot API лимит выше"""
+        if bot.session.api.is_local:
+            return self.config['local_download_limit']
+        return self.config['standard_download_limit']
+
+    def _decision(self, accepted: bool, kind: str, file_name: str, reason: str = None, message: str = None) -> dict:
+        return {'accepted': accepted, 'kind': kind, 'file_name': file_name, 'reason': reason, 'message': message}
+
+    def _reject(self, document: types.Document, reason: str, message: str, fetched: int = 0) -> dict:
+        self.stats['rejected'] += 1
+        self.stats[f'rejected_{reason}'] += 1
+        # Столько байт не пришлось скачивать (за вычетом пробного чтения)
+        self.stats['bytes_avoided'] += max(0, (document.file_size or 0) - fetched)
+        logger.info(f"Файл {document.file_name} отклонен до скачивания: {reason}, {document.mime_type}, "
+                    f"{document.file_size} байт")
+        return self._decision(False, None, document.file_name, reason, message)
+
+    def _needs_probe(self, kind: str, mime_type: str) -> bool:
+        if not self.config['probe']:
+            return False
+        if kind is None:
+            return True
+        # Расширение текстовое, а клиент прислал двоичный MIME-тип
+        return kind == 'text' and mime_type is not None and _mime_kind(mime_type, self.config) is None
+
+    async def _probe(self, bot: Bot, document: types.Document) -> bytes:
+        try:
+            head = await download_file_head(bot, document.file_id, self.config['probe_bytes'])
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать начало файла {document.file_name}: {str(e)}")
+            return None
+        self.stats['probes'] += 1
+        self.stats['probe_bytes'] += len(head)
+        return head
+
+    async def check(self, bot: Bot, document: types.Document) -> dict:
+        """
+        Проверяет документ по метаданным (и при необходимости по первым байтам)
+
+        Args:
+            bot: Экземпляр бота (для пробного чтения и лимита скачивания)
+            document: Документ из сообщения
+
+        Returns:
+            dict: accepted, kind (text, document, image, audio), file_name (с расширением,
+                  если формат определен по содержимому), reason и message для отказа
+        """
+        file_name = document.file_name or "unknown_file"
+        if not self.enabled:
+            return self._decision(True, file_kind(file_name, self.config), file_name)
+
+        self.stats['checked'] += 1
+        self._log_stats()
+        mime_type = (document.mime_type or '').lower() or None
+        size = document.file_size
+        _, ext = os.path.splitext(file_name.lower())
+
+        if mime_type and mime_type.startswith(self.config['rejected_mime_prefixes']):
+            return self._reject(document, 'type', f"Я не обрабатываю файлы этого типа ({mime_type}). "
+                                                  "Пожалуйста, отправьте текстовый файл, документ или изображение.")
+        if size == 0:
+            return self._reject(document, 'empty', "Файл пуст или не может быть прочитан.")
+        limit = self.download_limit(bot)
+        if size and size > limit:
+            return self._reject(document, 'download_limit', f"Файл слишком большой ({_format_size(size)}). "
+                                                            f"Я могу получить файлы до {_format_size(limit)}.")
+
+        kind = file_kind(file_name, self.config)
+        rerouted = False
+        if kind is None:
+            kind = _mime_kind(mime_type, self.config)
+            rerouted = kind is not None
+
+        if self._needs_probe(kind, mime_type):
+            head = await self._probe(bot, document)
+            if head is not None:
+                sniffed = sniff_mime_type(head)
+                if sniffed and sniffed.startswith(self.config['rejected_mime_prefixes']):
+                    return self._reject(document, 'type', "Я не обрабатываю исполняемые файлы. "
+                                                          "Пожалуйста, отправьте текстовый файл, документ или изображение.",
+                                        len(head))
+                probed = _mime_kind(sniffed, self.config)
+                if probed is None and head and not looks_binary(head):
+                    probed = 'text'
+                if probed is None:
+                    return self._reject(document, 'binary', "Содержимое файла не похоже ни на текст, "
+                                                            "ни на поддерживаемый документ или изображение.",
+                                        len(head))
+                if probed != kind:
+                    kind, rerouted = probed, True
+                    mime_type = sniffed or mime_type
+
+        if kind is None:
+            return self._reject(document, 'unsupported', f"Извините, я не могу обработать файлы с расширением "
+                                                         f"{ext or 'без расширения'}. Пожалуйста, отправьте "
+                                                         "текстовый файл, документ или изображение.")
+
+        max_size = self.config['max_size'][kind]
+        if size and size > max_size:
+            return self._reject(document, 'too_large', f"Файл слишком большой для анализа ({_format_size(size)}). "
+                                                       f"Для таких файлов ограничение — {_format_size(max_size)}.")
+
+        if rerouted:
+            self.stats['rerouted'] += 1
+            # Извлечение текста и анализ выбирают формат по расширению
+            extension = _MIME_EXTENSIONS.get(mime_type)
+            if extension is not None and file_kind(file_name, self.config) != kind:
+                file_name += extension
+        self.stats['admitted'] += 1
+        self.stats[f'kind_{kind}'] += 1
+        return self._decision(True, kind, file_name)
+
+    def _log_stats(self):
+        if self.stats['checked'] % self.config['stats_log_interval'] == 0:
+            logger.info(f"Проверка документов до скачивания: {self.summary()}")
+
+    def summary(self) -> dict:
+        """Сколько документов отклонено до скачивания и сколько байт это сэкономило"""
+        return dict(self.stats)
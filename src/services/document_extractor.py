@@ -0,0 +1,285 @@
+import io
+import os
+import time
+import asyncio
+import logging
+import tarfile
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.etree import ElementTree
+from src.config.config import EXTRACTION_CONFIG
+from src.utils.file_utils import decode_text, looks_binary
+
+logger = logging.getLogger(__name__)
+
+# Пространства имен XML в DOCX и ODT
+_WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_ODF_TEXT_NS = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+
+_TAR_SUFFIXES = ('.tar', '.tgz', '.tar.gz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+class ExtractionError(Exception):
+    """Не удалось извлечь текст из документа"""
+
+
+def document_kind(file_name: str) -> str:
+    """
+    Определяет тип документа по имени файла
+
+    Returns:
+        str: pdf, docx, odt, zip, tar или None, если формат не поддерживается
+    """
+    name = (file_name or '').lower()
+    if name.endswith(_TAR_SUFFIXES):
+        return 'tar'
+    _, ext = os.path.splitext(name)
+    return {'.pdf': 'pdf', '.docx': 'docx', '.odt': 'odt', '.zip': 'zip'}.get(ext)
+
+
+# ---------------------------------------------------------------------------
+# Функции ниже выполняются в процессах пула
+# ---------------------------------------------------------------------------
+
+def _limit_memory(max_bytes: int):
+    """Ограничивает адресное пространство процесса-воркера (только Unix)"""
+    try:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def _iter_pdf(data: bytes):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ExtractionError("Для чтения PDF нужен пакет pypdf")
+    reader = PdfReader(io.BytesIO(data))
+    for number, page in enumerate(reader.pages, start=1):
+        text = page.extract_text() or ''
+        if text.strip():
+            yield f"--- Страница {number} ---\n{text}\n"
+
+
+def _iter_xml_paragraphs(data: bytes, member: str, paragraph_tags: tuple, text_tag: str = None):
+    """Потоково читает абзацы из XML внутри ZIP-контейнера (DOCX/ODT)"""
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        with archive.open(member) as xml_file:
+            for _, element in ElementTree.iterparse(xml_file, events=('end',)):
+                if element.tag not in paragraph_tags:
+                    continue
+                if text_tag:
+                    text = ''.join(node.text or '' for node in element.iter(text_tag))
+                else:
+                    text = ''.join(element.itertext())
+                # Освобождаем память под уже обработанные элементы
+                element.clear()
+                if text.strip():
+                    yield text + '\n'
+
+
+def _iter_docx(data: bytes):
+    yield from _iter_xml_paragraphs(data, 'word/document.xml', (f'{_WORD_NS}p',), f'{_WORD_NS}t')
+
+
+def _iter_odt(data: bytes):
+    yield from _iter_xml_paragraphs(data, 'content.xml', (f'{_ODF_TEXT_NS}p', f'{_ODF_TEXT_NS}h'))
+
+
+def _entry_text(name: str, content: bytes) -> str:
+    if looks_binary(content):
+        return None
+    text, _ = decode_text(content)
+    return f"--- {name} ---\n{text}\n"
+
+
+def _iter_zip(data: bytes):
+    max_entry = EXTRACTION_CONFIG['max_entry_bytes']
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            with archive.open(info) as entry:
+                # Читаем не больше лимита, даже если архив заявляет меньший размер
+                text = _entry_text(info.filename, entry.read(max_entry))
+            if text:
+                yield text
+
+
+def _iter_tar(data: bytes):
+    max_entry = EXTRACTION_CONFIG['max_entry_bytes']
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            entry = archive.extractfile(member)
+            if entry is None:
+                continue
+            text = _entry_text(member.name, entry.read(max_entry))
+            if text:
+                yield text
+
+
+_EXTRACTORS = {
+    'pdf': _iter_pdf,
+    'docx': _iter_docx,
+    'odt': _iter_odt,
+    'zip': _iter_zip,
+    'tar': _iter_tar,
+}
+
+
+def extract_document(data: bytes, file_name: str, char_budget: int, time_limit: float) -> dict:
+    """
+    Извлекает текст документа, пока не заполнен бюджет или не истекло время
+
+    Выполняется в процессе пула. Страницы и записи архива читаются лениво,
+    поэтому большой документ не разбирается целиком, если бюджет уже заполнен.
+
+    Returns:
+        dict: text, truncated, parts, kind
+    """
+    kind = document_kind(file_name)
+    if kind is None:
+        raise ExtractionError(f"Неподдерживаемый формат документа: {file_name}")
+
+    deadline = time.monotonic() + time_limit
+    pieces = []
+    collected = 0
+    truncated = False
+    try:
+        for piece in _EXTRACTORS[kind](data):
+            if collected + len(piece) > char_budget:
+                pieces.append(piece[:char_budget - collected])
+                truncated = True
+                break
+            pieces.append(piece)
+            collected += len(piece)
+            if time.monotonic() > deadline:
+                truncated = True
+                break
+    except ExtractionError:
+        raise
+    except MemoryError:
+        raise ExtractionError("Документ превышает лимит памяти")
+    except Exception as e:
+        raise ExtractionError(f"Документ поврежден или не может быть прочитан: {str(e)}")
+
+    return {'text': ''.join(pieces), 'truncated': truncated, 'parts': len(pieces), 'kind': kind}
+
+
+# ---------------------------------------------------------------------------
+# Сторона цикла событий
+# ---------------------------------------------------------------------------
+
+class DocumentExtractor:
+    """
+    Извлекает текст из PDF, DOCX, ODT и архивов в пуле процессов
+
+    Разбор выполняется вне цикла событий с ограничением памяти и времени на задание.
+    Зависшее задание приводит к пересозданию пула, остальные чаты не блокируются.
+    Задания, чей пул сломался из-за другого документа, повторяются в отдельном процессе.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._semaphore = asyncio.Semaphore(EXTRACTION_CONFIG['max_workers'])
+
+    @staticmethod
+    def supports(file_name: str) -> bool:
+        return document_kind(file_name) is not None
+
+    @staticmethod
+    def _create_pool(max_workers: int) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_limit_memory,
+            initargs=(EXTRACTION_CONFIG['max_memory_bytes'],),
+            max_tasks_per_child=EXTRACTION_CONFIG['max_tasks_per_child'],
+        )
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = self._create_pool(EXTRACTION_CONFIG['max_workers'])
+        return self._pool
+
+    @staticmethod
+    def _kill_pool(pool: ProcessPoolExecutor):
+        """Останавливает пул, принудительно завершая зависшие процессы"""
+        processes = list((getattr(pool, '_processes', None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.kill()
+
+    def _reset_pool(self, pool: ProcessPoolExecutor):
+        """Останавливает пул; следующее задание создаст новый"""
+        if self._pool is pool:
+            self._pool = None
+        self._kill_pool(pool)
+
+    @staticmethod
+    async def _run(pool: ProcessPoolExecutor, data: bytes, file_name: str, char_budget: int) -> dict:
+        time_limit = EXTRACTION_CONFIG['time_limit']
+        future = asyncio.get_running_loop().run_in_executor(
+            pool, extract_document, data, file_name, char_budget, time_limit
+        )
+        # Воркер сам останавливается по времени между страницами, запас нужен на одну страницу
+        return await asyncio.wait_for(future, time_limit + EXTRACTION_CONFIG['kill_grace'])
+
+    async def _run_isolated(self, data: bytes, file_name: str, char_budget: int) -> dict:
+        """Повторяет задание в отдельном процессе, чтобы чужой документ не мог его сорвать"""
+        pool = self._create_pool(1)
+        try:
+            return await self._run(pool, data, file_name, char_budget)
+        except asyncio.TimeoutError:
+            logger.error(f"Извлечение текста из {file_name} превысило лимит времени")
+            raise ExtractionError("Документ обрабатывается слишком долго")
+        except BrokenProcessPool:
+            logger.error(f"Процесс извлечения текста из {file_name} аварийно завершился")
+            raise ExtractionError("Документ превышает лимит памяти или поврежден")
+        finally:
+            self._kill_pool(pool)
+
+    async def extract(self, data: bytes, file_name: str, char_budget: int) -> dict:
+        """
+        Извлекает текст документа в пуле процессов
+
+        Args:
+            data: Содержимое файла
+            file_name: Имя файла (по нему определяется формат)
+            char_budget: Сколько символов текста достаточно для запроса
+
+        Returns:
+            dict: text, truncated, parts, kind
+        """
+        # Семафор не дает заданиям копиться в очереди пула и съедать таймаут ожиданием
+        async with self._semaphore:
+            started = time.monotonic()
+            pool = self._get_pool()
+            try:
+                result = await self._run(pool, data, file_name, char_budget)
+            except asyncio.TimeoutError:
+                logger.error(f"Извлечение текста из {file_name} превысило лимит времени, пул перезапущен")
+                self._reset_pool(pool)
+                raise ExtractionError("Документ обрабатывается слишком долго")
+            except BrokenProcessPool:
+                # Пул ломается целиком: виновником может быть соседнее задание (зависание или нехватка
+                # памяти), поэтому задание повторяется в отдельном процессе
+                logger.warning(f"Пул извлечения текста сломан во время обработки {file_name}, повтор в отдельном процессе")
+                self._reset_pool(pool)
+                result = await self._run_isolated(data, file_name, char_budget)
+
+        logger.info(f"Извлечен текст из {file_name} ({result['kind']}): {len(result['text'])} символов, "
+                    f"частей {result['parts']}, обрезан: {result['truncated']}, "
+                    f"{time.monotonic() - started:.2f} с")
+        return result
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
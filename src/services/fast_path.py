@@ -0,0 +1,119 @@
+import re
+import logging
+from collections import Counter
+from src.config.config import FAST_PATH_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION = re.compile(r'[^\w\s]+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize(text: str) -> str:
+    """Приводит сообщение к канонической форме: регистр, ё, пунктуация, эмодзи, пробелы"""
+    text = (text or '').lower().replace('ё', 'е')
+    text = _PUNCTUATION.sub(' ', text)
+    return _SPACES.sub(' ', text).strip()
+
+
+def trigrams(text: str) -> set:
+    """Множество символьных триграмм с границами слов"""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FastPathMatcher:
+    """
+    Отвечает на тривиальные сообщения локально, без обращения к модели
+
+    Таблица намерений компилируется при запуске: точные формулировки попадают в словарь,
+    а для опечаток и вариаций строится инвертированный индекс по триграммам,
+    поэтому поиск не зависит от числа шаблонов линейно.
+    """
+
+    def __init__(self, config: dict = None):
+        self.config = config or FAST_PATH_CONFIG
+        self._exact = {}
+        self._patterns = []  # (нормализованный шаблон, число триграмм, намерение)
+        self._index = {}     # триграмма -> номера шаблонов
+        self.stats = {'checked': 0, 'hits': 0, 'exact': 0, 'fuzzy': 0}
+        self.intent_hits = Counter()
+
+        for intent in self.config['intents']:
+            for pattern in intent['patterns']:
+                normalized = normalize(pattern)
+                if not normalized:
+                    continue
+                self._exact[normalized] = intent
+                grams = trigrams(normalized)
+                pattern_id = len(self._patterns)
+                self._patterns.append((normalized, len(grams), intent))
+                for gram in grams:
+                    self._index.setdefault(gram, []).append(pattern_id)
+
+    def _fuzzy_lookup(self, text: str):
+        """Ищет шаблон с максимальным коэффициентом Дайса по триграммам"""
+        grams = trigrams(text)
+        shared = Counter()
+        for gram in grams:
+            for pattern_id in self._index.get(gram, ()):
+                shared[pattern_id] += 1
+        best_intent, best_score = None, 0.0
+        for pattern_id, common in shared.items():
+            _, size, intent = self._patterns[pattern_id]
+            score = 2.0 * common / (len(grams) + size)
+            if score > best_score:
+                best_intent, best_score = intent, score
+        if best_score >= self.config['min_similarity']:
+            return best_intent
+        return None
+
+    def lookup(self, text: str) -> tuple:
+        """
+        Ищет намерение без учета в статистике
+
+        Returns:
+            tuple: (намерение или None, способ совпадения: exact, fuzzy или None)
+        """
+        normalized = normalize(text)
+        if not normalized or len(normalized) > self.config['max_length']:
+            return None, None
+        intent = self._exact.get(normalized)
+        if intent is not None:
+            return intent, 'exact'
+        intent = self._fuzzy_lookup(normalized)
+        return intent, ('fuzzy' if intent is not None else None)
+
+    def match(self, text: str):
+        """
+        Подбирает готовый ответ на сообщение
+
+        Args:
+            text: Текст сообщения пользователя
+
+        Returns:
+            dict: Намерение (name, answer) или None, если сообщение нужно отправить в модель
+        """
+        if not self.config['enabled']:
+            return None
+        self.stats['checked'] += 1
+        intent, kind = self.lookup(text)
+
+        if intent is not None:
+            self.stats['hits'] += 1
+            self.stats[kind] += 1
+            self.intent_hits[intent['name']] += 1
+        if self.stats['checked'] % self.config['stats_log_interval'] == 0:
+            summary = self.summary()
+            logger.info(f"Быстрые ответы: {summary['hits']} из {summary['checked']} сообщений "
+                        f"({summary['hit_rate']:.1%}), по намерениям: {summary['intents']}")
+        return intent
+
+    def summary(self) -> dict:
+        """Доля сообщений, обработанных без модели"""
+        checked = self.stats['checked']
+        return {
+            **self.stats,
+            'hit_rate': self.stats['hits'] / checked if checked else 0.0,
+            'intents': dict(self.intent_hits),
+        }
@@ -1,37 +1,331 @@
 import os
-import tempfile
+import time
+import asyncio
 import google.generativeai as genai
-from src.config.config import GOOGLE_API_KEY, MODEL_CONFIG
+from src.config.config import (GOOGLE_API_KEY, PROMPT_BUDGET_CONFIG, IMAGE_INDEX_CONFIG, HEDGING_CONFIG,
+                               AUDIO_CONFIG, SEMANTIC_CACHE_CONFIG)
+from src.services import image_index, semantic_cache
+from src.services.code_condenser import CodeCondenser
+from src.services.hedging import HedgePolicy
+from src.services.degradation import degradation
+from src.services.traffic_recorder import traffic_recorder
+from src.services.document_extractor import DocumentExtractor, ExtractionError
+from src.services.document_admission import file_kind
+from src.services.key_pool import KeyPool, ApiKeySlot
+from src.services.model_router import ModelRouter
+from src.services.prompt_budget import PromptBudget, TokenUsageTracker
+from src.services.upload_manager import UploadManager
+from src.utils.file_utils import decode_text
 import logging
 
+
+class ErrorReply(str):
+    """
+    Ответ сервиса, сообщающий пользователю об ошибке, а не результат модели
+
+    Ведет себя как обычная строка (обработчики отправляют ее пользователю как есть),
+    но пакетная обработка по типу отличает ее от успешного результата.
+    """
+
+
 class GeminiService:
     def __init__(self):
         """Инициализация сервиса Gemini"""
         genai.configure(api_key=GOOGLE_API_KEY)
+        # Пул API-ключей: у каждого ключа свои клиенты и своя квота
+        self.key_pool = KeyPool()
         # Модель для текста
-        self.text_model = genai.GenerativeModel('gemini-2.5-flash-preview-04-17')
+        self.text_model_name = 'gemini-2.5-flash-preview-04-17'
         # Модель для мультимодального контента (с поддержкой изображений)
-        self.vision_model = genai.GenerativeModel('gemini-2.5-flash-preview-04-17')
+        self.vision_model_name = 'gemini-2.5-flash-preview-04-17'
+        # Загрузка медиа в File API с переиспользованием уже загруженных файлов
+        self.upload_manager = UploadManager()
+        # Бюджет токенов запросов и учет фактического расхода
+        self.prompt_budget = PromptBudget()
+        self.token_usage = TokenUsageTracker()
+        # Индекс почти-дубликатов изображений (нужны NumPy и PIL)
+        self.image_index = None
+        if IMAGE_INDEX_CONFIG['enabled'] and image_index.is_available():
+            self.image_index = image_index.ImageIndex()
+            try:
+                self.image_index.load()
+            except Exception as e:
+                logging.error(f"Не удалось загрузить индекс изображений: {str(e)}")
+        # Семантический кэш ответов на перефразированные текстовые запросы (нужен NumPy)
+        self.semantic_cache = None
+        if SEMANTIC_CACHE_CONFIG['enabled'] and semantic_cache.is_available():
+            self.semantic_cache = semantic_cache.SemanticCache(semantic_cache.create_embedder(self.key_pool))
+            try:
+                self.semantic_cache.load()
+            except Exception as e:
+                logging.error(f"Не удалось загрузить семантический кэш: {str(e)}")
+        self._background_tasks = set()
+        # Извлечение текста из документов и архивов в пуле процессов
+        self.document_extractor = DocumentExtractor()
+        # Структурное сжатие больших исходных файлов перед отправкой в модель
+        self.code_condenser = CodeCondenser(self.prompt_budget)
+        # Дублирующие запросы при задержке первого токена
+        self.hedge_policy = HedgePolicy()
+        # Выбор модели и параметров генерации по виду запроса
+        self.model_router = ModelRouter()
+
+    async def _generate(self, model_name: str, contents, request_type: str = 'text', slot: ApiKeySlot = None,
+                        route: str = None):
+        """
+        Выполняет запрос к модели, не блокируя цикл событий
+
+        Args:
+            model_name: Имя модели Gemini (если маршрут не задает другую)
+            contents: Содержимое запроса (текст или список частей)
+            request_type: Тип запроса (text, image, file) для выбора max_output_tokens
+            slot: API-ключ, уже выданный пулом (по умолчанию выбирается наименее загруженный)
+            route: Маршрут запроса (по умолчанию определяется по типу и тексту запроса)
+
+        Returns:
+            GenerateContentResponse: Ответ модели
+        """
+        prompt_text = contents if isinstance(contents, str) else None
+        estimated_tokens = self.prompt_budget.estimator.estimate(prompt_text) if prompt_text else None
+        # Модель и параметры генерации задает профиль маршрута
+        route = route or self.model_router.classify(request_type, prompt_text)
+        profile = self.model_router.profile(route, model_name, self.prompt_budget.output_tokens(request_type))
+        # Под перегрузкой ответы короче, а модель может быть заменена на более быструю
+        level = degradation.level
+        model_name = level['model'] or profile['model']
+        max_output_tokens = max(1, int(profile['max_output_tokens'] * level['output_tokens_factor']))
+        generation_config = genai.types.GenerationConfig(
+            temperature=profile['temperature'],
+            top_p=profile['top_p'],
+            top_k=profile['top_k'],
+            max_output_tokens=max_output_tokens,
+        )
+
+        started = time.monotonic()
+        try:
+            response = await self._request(model_name, contents, generation_config, slot)
+        except Exception:
+            self.model_router.record(route, model_name, started, failed=True)
+            raise
+        self.model_router.record(route, model_name, started)
+
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None:
+            self.token_usage.record(
+                request_type, usage,
+                estimated_prompt_tokens=estimated_tokens,
+                max_output_tokens=max_output_tokens,
+                latency=round(time.monotonic() - started, 3),
+            )
+            # Текстовые запросы уточняют локальную оценку токенов
+            if prompt_text:
+                self.prompt_budget.estimator.calibrate(prompt_text, usage.prompt_token_count)
+        if traffic_recorder.enabled:
+            self._record_generation(request_type, time.monotonic() - started, response, usage)
+        return response
+
+    async def _request(self, model_name: str, contents, generation_config, slot: ApiKeySlot = None):
+        """Отправляет запрос на закрепленный ключ, с хеджированием или на наименее загруженный ключ"""
+        with degradation.generation():
+            if slot is not None:
+                # Ключ закреплен (например, за ним загружен файл) — дублировать на другой ключ нельзя
+                return await slot.model(model_name).generate_content_async(
+                    contents, generation_config=generation_config
+                )
+            if self.hedge_policy.enabled:
+                return await self._hedged_request(model_name, contents, generation_config)
+            async with self.key_pool.lease() as slot:
+                return await slot.model(model_name).generate_content_async(
+                    contents, generation_config=generation_config
+                )
+
+    @staticmethod
+    def _record_generation(request_type: str, latency: float, response, usage):
+        """Сохраняет задержку и размер ответа для воспроизведения нагрузки"""
+        try:
+            response_chars = len(response.text or '')
+        except ValueError:
+            # Ответ без текста (например, заблокирован фильтрами)
+            response_chars = 0
+        traffic_recorder.record_generation(
+            request_type, latency, response_chars,
+            prompt_tokens=getattr(usage, 'prompt_token_count', None),
+            output_tokens=getattr(usage, 'candidates_token_count', None),
+        )
     
-    async def generate_response(self, text: str) -> str:
+    async def _hedged_request(self, model_name: str, contents, generation_config):
+        """
+        Выполняет запрос с хеджированием по времени до первого токена
+
+        Если основной запрос не выдал первый фрагмент ответа за отведенное время,
+        отправляется дубль на другой ключ (или другую модель). Побеждает тот, кто
+        первым начал отвечать, проигравший отменяется.
+
+        Returns:
+            GenerateContentResponse: Полностью полученный ответ победившего запроса
+        """
+        policy = self.hedge_policy
+        policy.start_request()
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        first_token = loop.create_future()
+        primary_slots = []
+
+        async def attempt(name: str, label: str, exclude=()):
+            async with self.key_pool.lease(exclude=exclude) as slot:
+                if label == 'primary':
+                    primary_slots.append(slot)
+                # В потоковом режиме вызов возвращается после первого фрагмента ответа
+                response = await slot.model(name).generate_content_async(
+                    contents, generation_config=generation_config, stream=True
+                )
+                if first_token.done():
+                    return None
+                first_token.set_result((label, time.monotonic()))
+                await response.resolve()
+                return response
+
+        primary = asyncio.create_task(attempt(model_name, 'primary'))
+        attempts = {'primary': primary}
+        try:
+            await asyncio.wait({primary, first_token}, timeout=policy.delay(), return_when=asyncio.FIRST_COMPLETED)
+            if first_token.done() or primary.done() or not policy.try_hedge():
+                response = await primary
+                if first_token.done():
+                    policy.record_first_token(first_token.result()[1] - started)
+                return response
+
+            # Дубль отправляем на другой ключ, если он есть, иначе на тот же ключ (или другую модель)
+            exclude = primary_slots if len(self.key_pool.slots) > 1 else ()
+            hedge_model = HEDGING_CONFIG['model'] or model_name
+            logging.info(f"Первый токен не получен за {policy.delay():.2f} с, отправляем дублирующий запрос ({hedge_model})")
+            attempts['hedge'] = asyncio.create_task(attempt(hedge_model, 'hedge', exclude))
+
+            pending = set(attempts.values())
+            while not first_token.done():
+                _, pending = await asyncio.wait(pending | {first_token}, return_when=asyncio.FIRST_COMPLETED)
+                pending.discard(first_token)
+                if not first_token.done() and not pending:
+                    # Оба запроса завершились ошибкой до первого токена — пробрасываем ошибку основного
+                    return await primary
+
+            winner, first_token_at = first_token.result()
+            policy.record_first_token(first_token_at - started, hedge_won=(winner == 'hedge'))
+            logging.info(f"Хеджированный запрос: первым ответил {'дубль' if winner == 'hedge' else 'основной запрос'}")
+            return await attempts[winner]
+        finally:
+            # Проигравший (или все запросы при отмене вызывающего) отменяется,
+            # ошибки завершившихся запросов забираем, чтобы они не всплывали в логе asyncio
+            for task in attempts.values():
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+    async def _image_hashes(self, image_data: bytes):
+        """Вычисляет перцептивные хэши изображения вне цикла событий"""
+        if self.image_index is None:
+            return None
+        try:
+            return (await asyncio.to_thread(image_index.compute_hashes, [image_data]))[0]
+        except Exception as e:
+            logging.warning(f"Не удалось вычислить хэш изображения: {str(e)}")
+            return None
+
+    def _remember_image(self, image_hashes, query_text: str, result: str):
+        """Сохраняет результат анализа в индексе и периодически сбрасывает индекс на диск"""
+        if image_hashes is None:
+            return
+        self.image_index.add(image_hashes, query_text, result)
+        if self.image_index.needs_save:
+            # Снимок берется в цикле событий, запись на диск — в отдельном потоке
+            task = asyncio.create_task(asyncio.to_thread(self.image_index.write, self.image_index.snapshot()))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    def _spawn(self, coroutine):
+        """Запускает фоновую задачу, сохраняя ссылку на нее до завершения"""
+        task = asyncio.create_task(coroutine)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def _remember_answer(self, text: str, vector, answer: str):
+        """Сохраняет ответ в семантическом кэше и периодически сбрасывает кэш на диск"""
+        self.semantic_cache.store(text, vector, answer)
+        if self.semantic_cache.needs_save:
+            self._spawn(asyncio.to_thread(self.semantic_cache.write, self.semantic_cache.snapshot()))
+
+    async def _verify_cached_answer(self, text: str, hit: dict):
+        """Запрашивает у модели свежий ответ, чтобы оценить долю ложных попаданий кэша"""
+        try:
+            response = await self._generate(self.text_model_name, text)
+            await self.semantic_cache.record_verification(text, hit, response.text)
+        except Exception as e:
+            logging.warning(f"Не удалось проверить ответ из семантического кэша: {str(e)}")
+
+    def flush(self):
+        """Сохраняет накопленное состояние (индексы и кэш ответов) и освобождает пул процессов перед завершением работы"""
+        if self.image_index is not None and self.image_index.unsaved:
+            self.image_index.save()
+        if self.semantic_cache is not None and self.semantic_cache.unsaved:
+            self.semantic_cache.save()
+        self.document_extractor.shutdown()
+
+    def get_stats(self) -> dict:
+        """
+        Возвращает статистику сервиса: использование API-ключей и расход токенов
+        """
+        return {
+            'keys': self.key_pool.stats(),
+            'tokens': self.token_usage.summary(),
+            'uploads': dict(self.upload_manager.stats),
+            'image_index': dict(self.image_index.stats) if self.image_index is not None else None,
+            'semantic_cache': self.semantic_cache.summary() if self.semantic_cache is not None else None,
+            'hedging': self.hedge_policy.summary(),
+            'routes': self.model_router.summary(),
+            'degradation': degradation.summary(),
+        }
+
+    async def generate_response(self, text: str, chat_id: int = None) -> str:
         """
         Генерирует ответ с помощью Gemini
         
         Args:
             text: Входной текст
+            chat_id: ID чата (для чатов, отказавшихся от кэша, ответ всегда генерируется заново)
             
         Returns:
             str: Сгенерированный ответ
         """
-        response = self.text_model.generate_content(
-            text,
-            generation_config=genai.types.GenerationConfig(
-                temperature=MODEL_CONFIG['temperature'],
-                top_p=MODEL_CONFIG['top_p'],
-                top_k=MODEL_CONFIG['top_k'],
-                max_output_tokens=MODEL_CONFIG['max_output_tokens'],
-            )
-        )
+        # Слишком длинный ввод обрезаем по бюджету входных токенов
+        text, _ = self.prompt_budget.fit(text, self.prompt_budget.input_tokens('text'))
+
+        # Перефразированный запрос мог уже задаваться
+        vector = None
+        if self.semantic_cache is not None and self.semantic_cache.eligible(text, chat_id):
+            hit, vector = await self.semantic_cache.lookup(text)
+            if hit is not None:
+                if self.semantic_cache.should_verify():
+                    self._spawn(self._verify_cached_answer(text, hit))
+                return hit['answer']
+
+        response = await self._generate(self.text_model_name, text)
+        if vector is not None and response.text:
+            self._remember_answer(text, vector, response.text)
+        return response.text
+
+    async def generate_inline_answer(self, text: str) -> str:
+        """
+        Генерирует короткий ответ для inline-режима
+        
+        Args:
+            text: Запрос пользователя
+            
+        Returns:
+            str: Ответ в несколько предложений
+        """
+        text, _ = self.prompt_budget.fit(text, self.prompt_budget.input_tokens('inline'))
+        prompt = f"Ответь кратко, в нескольких предложениях: {text}"
+        response = await self._generate(self.text_model_name, prompt, 'inline')
         return response.text
     
     async def analyze_image(self, image_data: bytes, prompt: str = None) -> str:
@@ -53,7 +347,16 @@ class GeminiService:
             # Формируем текст запроса
             query_text = "Опиши, что изображено на этом изображении."
             if prompt:
-                query_text = prompt
+                # Подпись пользователя ограничиваем бюджетом, оставляя место под само изображение
+                caption_budget = self.prompt_budget.input_tokens('image') - PROMPT_BUDGET_CONFIG['image_tokens']
+                query_text, _ = self.prompt_budget.fit(prompt, caption_budget)
+
+            # Пережатое или слегка измененное изображение с тем же запросом уже могло анализироваться
+            image_hashes = await self._image_hashes(image_data)
+            if image_hashes is not None:
+                cached_result = self.image_index.lookup(image_hashes, query_text)
+                if cached_result:
+                    return cached_result
             
             # Прямой способ через PIL
             try:
@@ -68,78 +371,96 @@ class GeminiService:
                 
                 # Отправляем запрос на анализ изображения с использованием PIL
                 logging.info("Отправляем запрос на анализ изображения через PIL")
-                response = self.vision_model.generate_content(
-                    [query_text, image],
-                    generation_config=genai.types.GenerationConfig(
-                        temperature=MODEL_CONFIG['temperature'],
-                        top_p=MODEL_CONFIG['top_p'],
-                        top_k=MODEL_CONFIG['top_k'],
-                        max_output_tokens=MODEL_CONFIG['max_output_tokens'],
-                    )
-                )
+                response = await self._generate(self.vision_model_name, [query_text, image], 'image')
                 
                 # Проверяем, что ответ есть
                 if not response or not hasattr(response, 'text') or not response.text:
                     logging.error("Получен пустой ответ от API")
-                    return "Не удалось распознать изображение. Получен пустой ответ от API."
+                    return ErrorReply("Не удалось распознать изображение. Получен пустой ответ от API.")
                 
                 logging.info("Получен ответ через PIL")
+                self._remember_image(image_hashes, query_text, response.text)
                 return response.text
                 
             except ImportError:
-                logging.warning("PIL не установлен, используем временный файл")
-                # Если PIL не установлен, используем временный файл
-                temp_path = None
-                
-                try:
-                    # Создаем временный файл
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-                        temp_file.write(image_data)
-                        temp_path = temp_file.name
-                    
-                    logging.info(f"Изображение сохранено во временный файл: {temp_path}")
-                    
-                    # Создаем объект для передачи в API
-                    image_parts = genai.upload_file(temp_path)
-                    
+                logging.warning("PIL не установлен, загружаем изображение через File API")
+                # Файл доступен только ключу, которым он загружен, поэтому запрос идет через тот же ключ
+                async with self.key_pool.lease() as slot:
+                    # Загружаем из памяти; повторные изображения используют уже загруженный файл
+                    image_parts = await self.upload_manager.get_or_upload(image_data, slot=slot)
+
                     # Отправляем запрос на анализ изображения через файл
                     logging.info("Отправляем запрос на анализ изображения через файл")
-                    response = self.vision_model.generate_content(
-                        [query_text, image_parts],
-                        generation_config=genai.types.GenerationConfig(
-                            temperature=MODEL_CONFIG['temperature'],
-                            top_p=MODEL_CONFIG['top_p'],
-                            top_k=MODEL_CONFIG['top_k'],
-                            max_output_tokens=MODEL_CONFIG['max_output_tokens'],
-                        )
-                    )
-                    
-                    # Проверяем, что ответ есть
-                    if not response or not hasattr(response, 'text') or not response.text:
-                        logging.error("Получен пустой ответ от API")
-                        return "Не удалось распознать изображение. Получен пустой ответ от API."
-                    
-                    logging.info("Получен ответ через временный файл")
-                    return response.text
-                    
-                finally:
-                    # Удаляем временный файл
-                    if temp_path and os.path.exists(temp_path):
-                        os.remove(temp_path)
-                        logging.info(f"Временный файл удален: {temp_path}")
+                    try:
+                        response = await self._generate(self.vision_model_name, [query_text, image_parts], 'image', slot)
+                    except Exception:
+                        # Файл мог быть удален на сервере раньше срока, в следующий раз загрузим заново
+                        self.upload_manager.invalidate(image_data, slot)
+                        raise
+
+                # Проверяем, что ответ есть
+                if not response or not hasattr(response, 'text') or not response.text:
+                    logging.error("Получен пустой ответ от API")
+                    return ErrorReply("Не удалось распознать изображение. Получен пустой ответ от API.")
+
+                logging.info("Получен ответ через File API")
+                return response.text
                     
         except Exception as e:
             # Логируем ошибку и пробрасываем выше для обработки
             logging.error(f"Ошибка при анализе изображения: {str(e)}")
             raise e
     
-    async def analyze_file(self, file_data: bytes, file_name: str) -> str:
+    async def analyze_audio(self, audio_data: bytes, mime_type: str, prompt: str) -> str:
+        """
+        Отправляет аудио в Gemini как мультимодальный ввод
+        
+        Args:
+            audio_data: Байты аудио в поддерживаемом моделью формате
+            mime_type: MIME-тип аудио
+            prompt: Текст запроса к записи
+            
+        Returns:
+            str: Ответ модели
+        """
+        if not audio_data:
+            raise ValueError("Аудиозапись пустая")
+
+        query_text, _ = self.prompt_budget.fit(prompt, self.prompt_budget.input_tokens('audio'))
+
+        try:
+            if len(audio_data) <= AUDIO_CONFIG['inline_limit']:
+                # Короткие записи передаются прямо в запросе, без отдельной загрузки
+                audio_part = {'mime_type': mime_type, 'data': audio_data}
+                response = await self._generate(self.vision_model_name, [query_text, audio_part], 'audio')
+            else:
+                # Крупные записи не помещаются в запрос и загружаются через File API тем же ключом
+                async with self.key_pool.lease() as slot:
+                    audio_file = await self.upload_manager.get_or_upload(audio_data, mime_type=mime_type, slot=slot)
+                    try:
+                        response = await self._generate(self.vision_model_name, [query_text, audio_file], 'audio', slot)
+                    except Exception:
+                        self.upload_manager.invalidate(audio_data, slot)
+                        raise
+
+            if not response or not hasattr(response, 'text') or not response.text:
+                logging.error("Получен пустой ответ от API")
+                return ErrorReply("Не удалось распознать аудиозапись. Получен пустой ответ от API.")
+            return response.text
+
+        except Exception as e:
+            logging.error(f"Ошибка при анализе аудио: {str(e)}")
+            raise e
+
+    async def analyze_file(self, file_data: bytes, file_name: str, kind: str = None) -> str:
         """
         Анализирует содержимое файла с помощью Gemini
         
         Args:
             file_data: Байты файла
             file_name: Имя файла с расширением
+            kind: Вид обработки (text, document, image), определенный до скачивания;
+                  по умолчанию выбирается по расширению
             
         Returns:
             str: Результат анализа файла
@@ -147,7 +468,7 @@ class GeminiService:
         # Проверка входных данных
         if not file_data:
             logging.error("Получены пустые данные файла")
-            return "Файл пуст или не может быть прочитан."
+            return ErrorReply("Файл пуст или не может быть прочитан.")
             
         if not file_name:
             file_name = "unknown_file"
@@ -160,61 +481,29 @@ class GeminiService:
         logging.info(f"Обрабатываем файл: {file_name}, расширение: {ext}, размер: {len(file_data)} байт")
         
         # Обрабатываем различные типы файлов
-        if ext in ['.txt', '.py', '.js', '.html', '.css', '.json', '.md']:
-            # Для текстовых файлов пытаемся декодировать содержимое как текст
+        kind = kind or file_kind(file_name)
+        if kind == 'text':
+            # Для текстовых файлов декодируем содержимое как текст (большие файлы — вне цикла событий)
+            file_content, encoding = await asyncio.to_thread(decode_text, file_data)
+            logging.info(f"Файл успешно декодирован с кодировкой {encoding}")
+            return await self._analyze_text_content(file_name, file_content)
+
+        elif kind == 'document':
+            # PDF, DOCX, ODT и архивы разбираются в пуле процессов до заполнения бюджета
+            content_budget = self.prompt_budget.remaining('file', self._file_instructions(file_name))
             try:
-                encoding = 'utf-8'
-                try:
-                    file_content = file_data.decode(encoding)
-                except UnicodeDecodeError:
-                    # Пробуем другие кодировки
-                    for enc in ['cp1251', 'latin-1', 'iso-8859-1']:
-                        try:
-                            file_content = file_data.decode(enc)
-                            encoding = enc
-                            break
-                        except UnicodeDecodeError:
-                            continue
-                    else:
-                        raise UnicodeDecodeError("Не удалось определить кодировку файла")
-                
-                logging.info(f"Файл успешно декодирован с кодировкой {encoding}")
-                
-                # Ограничиваем размер содержимого
-                content_limit = 4000
-                truncated = len(file_content) > content_limit
-                trimmed_content = file_content[:content_limit]
-                
-                # Формируем запрос
-                prompt = f"Это содержимое файла {file_name}. Проанализируй его и ответь на вопросы:\n1. Что это за файл?\n2. Какую информацию он содержит?\n3. Есть ли в нем что-то интересное?\n\nСодержание файла:\n```\n{trimmed_content}```"
-                
-                if truncated:
-                    prompt += "\n\n(Файл слишком большой, показана только часть содержимого)"
-                
-                logging.info("Отправляем запрос на анализ текстового файла")
-                response = self.text_model.generate_content(
-                    prompt,
-                    generation_config=genai.types.GenerationConfig(
-                        temperature=MODEL_CONFIG['temperature'],
-                        top_p=MODEL_CONFIG['top_p'],
-                        top_k=MODEL_CONFIG['top_k'],
-                        max_output_tokens=MODEL_CONFIG['max_output_tokens'],
-                    )
+                extracted = await self.document_extractor.extract(
+                    file_data, file_name, content_budget * PROMPT_BUDGET_CONFIG['max_chars_per_token']
                 )
+            except ExtractionError as e:
+                logging.warning(f"Не удалось извлечь текст из {file_name}: {str(e)}")
+                return ErrorReply(f"Не удалось прочитать содержимое документа: {str(e)}")
+
+            if not extracted['text'].strip():
+                return ErrorReply("В документе не найден текст для анализа.")
+            return await self._analyze_text_content(file_name, extracted['text'], extracted['truncated'])
                 
-                # Проверяем ответ
-                if not response or not hasattr(response, 'text') or not response.text:
-                    logging.error("Получен пустой ответ от API при анализе текстового файла")
-                    return "Не удалось проанализировать файл. Получен пустой ответ от API."
-                
-                logging.info("Получен ответ на анализ текстового файла")
-                return response.text
-                
-            except UnicodeDecodeError as e:
-                logging.warning(f"Не удалось декодировать файл как текст: {str(e)}")
-                return "Не удалось прочитать содержимое этого файла. Возможно, это бинарный файл."
-                
-        elif ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp']:
+        elif kind == 'image':
             # Для изображений используем анализ изображений
             logging.info("Перенаправляем файл изображения на анализ изображений")
             return await self.analyze_image(file_data, f"Это изображение из файла {file_name}. Опиши подробно, что на нем изображено.")
@@ -222,4 +511,57 @@ class GeminiService:
         else:
             # Для неподдерживаемых типов файлов
             logging.warning(f"Неподдерживаемое расширение файла: {ext}")
-            return f"Извините, я не могу обработать файлы с расширением {ext}. Пожалуйста, отправьте текстовый файл или изображение." 
\ No newline at end of file
+            return ErrorReply(f"Извините, я не могу обработать файлы с расширением {ext}. Пожалуйста, отправьте текстовый файл, документ или изображение.")
+
+    @staticmethod
+    def _file_instructions(file_name: str) -> str:
+        return f"Это содержимое файла {file_name}. Проанализируй его и ответь на вопросы:\n1. Что это за файл?\n2. Какую информацию он содержит?\n3. Есть ли в нем что-то интересное?\n\nСодержание файла:\n```\n"
+
+    async def _analyze_text_content(self, file_name: str, file_content: str, truncated: bool = False) -> str:
+        """
+        Анализирует текстовое содержимое файла, вписывая его в бюджет токенов
+
+        Args:
+            file_name: Имя файла
+            file_content: Текст файла
+            truncated: Был ли текст уже обрезан при извлечении
+
+        Returns:
+            str: Результат анализа файла
+        """
+        # Формируем запрос, вписывая содержимое в бюджет токенов
+        instructions = self._file_instructions(file_name)
+        truncation_note = "\n\n(Файл слишком большой, показана только часть содержимого)"
+        condensed_note = ("\n\n(Файл слишком большой, показано его структурное представление: "
+                          "сигнатуры, докстринги, ключи и избранные фрагменты кода)")
+        content_budget = self.prompt_budget.remaining('file', instructions, condensed_note)
+
+        # Исходный код вместо обрезки по началу сжимается до структуры
+        condensed = False
+        if not truncated and file_name.lower().endswith(CodeCondenser.SUPPORTED_EXTENSIONS):
+            if len(file_content) > PROMPT_BUDGET_CONFIG['condense_thread_chars']:
+                # Разбор большого файла занимает заметное время
+                file_content, condensed = await asyncio.to_thread(
+                    self.code_condenser.condense, file_name, file_content, content_budget)
+            else:
+                file_content, condensed = self.code_condenser.condense(file_name, file_content, content_budget)
+        trimmed_content, fitted = self.prompt_budget.fit(file_content, content_budget)
+
+        prompt = f"{instructions}{trimmed_content}```"
+
+        if condensed:
+            prompt += condensed_note
+        elif truncated or fitted:
+            prompt += truncation_note
+
+        logging.info("Отправляем запрос на анализ текстового файла")
+        route = self.model_router.classify('file', file_content, file_name)
+        response = await self._generate(self.text_model_name, prompt, 'file', route=route)
+
+        # Проверяем ответ
+        if not response or not hasattr(response, 'text') or not response.text:
+            logging.error("Получен пустой ответ от API при анализе текстового файла")
+            return ErrorReply("Не удалось проанализировать файл. Получен пустой ответ от API.")
+
+        logging.info("Получен ответ на анализ текстового файла")
+        return response.text
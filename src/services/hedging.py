@@ -0,0 +1,63 @@
+import logging
+from collections import deque
+from src.config.config import HEDGING_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class HedgePolicy:
+    """
+    Решает, когда и сколько дублирующих запросов можно отправить
+
+    Задержка перед дублем — заданная в конфигурации или перцентиль наблюдаемого
+    времени до первого токена. Бюджет пополняется долей от каждого основного запроса,
+    поэтому дубли не могут увеличить нагрузку больше чем на max_extra_load.
+    """
+
+    def __init__(self, config: dict = None):
+        self.config = config or HEDGING_CONFIG
+        self._first_token_latencies = deque(maxlen=self.config['history_size'])
+        self._credits = self.config['budget_burst']
+        self.stats = {'requests': 0, 'hedged': 0, 'hedge_wins': 0, 'budget_exhausted': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.config['enabled']
+
+    def delay(self) -> float:
+        """Сколько ждать первого токена перед отправкой дубля"""
+        if self.config['delay'] > 0:
+            return self.config['delay']
+        samples = sorted(self._first_token_latencies)
+        if len(samples) < self.config['min_samples']:
+            return self.config['initial_delay']
+        value = samples[min(len(samples) - 1, int(self.config['percentile'] * len(samples)))]
+        return min(self.config['max_delay'], max(self.config['min_delay'], value))
+
+    def start_request(self):
+        """Учитывает основной запрос и пополняет бюджет дублей"""
+        self.stats['requests'] += 1
+        self._credits = min(self.config['budget_burst'], self._credits + self.config['max_extra_load'])
+
+    def try_hedge(self) -> bool:
+        """Списывает дубль из бюджета, если он не исчерпан"""
+        if self._credits < 1.0:
+            self.stats['budget_exhausted'] += 1
+            return False
+        self._credits -= 1.0
+        self.stats['hedged'] += 1
+        return True
+
+    def record_first_token(self, latency: float, hedge_won: bool = False):
+        self._first_token_latencies.append(latency)
+        if hedge_won:
+            self.stats['hedge_wins'] += 1
+
+    def summary(self) -> dict:
+        requests = self.stats['requests']
+        return {
+            **self.stats,
+            'enabled': self.enabled,
+            'delay': round(self.delay(), 3),
+            'extra_load': round(self.stats['hedged'] / requests, 3) if requests else 0.0,
+        }
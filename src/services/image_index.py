@@ -0,0 +1,287 @@
+import io
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+from src.config.config import IMAGE_INDEX_CONFIG
+from src.utils.file_utils import write_file_atomic, shard_path
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = None
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Размер уменьшенного изображения для pHash и число сохраняемых низких частот
+_PHASH_SIZE = 32
+_PHASH_LOW = 8
+
+
+def is_available() -> bool:
+    """Доступны ли NumPy и PIL, необходимые для перцептивного хэширования"""
+    return np is not None
+
+
+@lru_cache(maxsize=None)
+def _dct_matrix(size: int):
+    """Матрица DCT-II размера size x size (ортонормированная)"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0, :] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+def _pack_bits(bits) -> list:
+    """Упаковывает массив (N, 64) из bool в список 64-битных целых"""
+    packed = np.packbits(bits.reshape(len(bits), 64), axis=1)
+    return [int(value) for value in packed.view('>u8').ravel()]
+
+
+def phash_batch(pixels) -> list:
+    """
+    Вычисляет pHash для пачки изображений одной векторной операцией
+
+    Args:
+        pixels: Массив (N, 32, 32) яркостей
+
+    Returns:
+        list: 64-битные хэши
+    """
+    dct = _dct_matrix(_PHASH_SIZE)
+    # D @ X @ D^T для всех изображений сразу
+    coefficients = dct @ pixels.astype(np.float32) @ dct.T
+    low = coefficients[:, :_PHASH_LOW, :_PHASH_LOW].reshape(len(pixels), -1)
+    # Постоянную составляющую не учитываем при вычислении медианы
+    medians = np.median(low[:, 1:], axis=1, keepdims=True)
+    return _pack_bits(low > medians)
+
+
+def dhash_batch(pixels) -> list:
+    """
+    Вычисляет dHash (разность соседних пикселей по горизонтали)
+
+    Args:
+        pixels: Массив (N, 8, 9) яркостей
+
+    Returns:
+        list: 64-битные хэши
+    """
+    return _pack_bits(pixels[:, :, 1:] > pixels[:, :, :-1])
+
+
+def _decode(image_data: bytes) -> tuple:
+    """Декодирует изображение в два уменьшенных массива яркостей для pHash и dHash"""
+    image = Image.open(io.BytesIO(image_data))
+    # Для JPEG draft декодирует сразу в уменьшенном масштабе, что в разы быстрее
+    image.draft('L', (_PHASH_SIZE * 2, _PHASH_SIZE * 2))
+    image = image.convert('L')
+    phash_pixels = np.asarray(image.resize((_PHASH_SIZE, _PHASH_SIZE), Image.BILINEAR))
+    dhash_pixels = np.asarray(image.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    return phash_pixels, dhash_pixels
+
+
+def compute_hashes(images: list) -> list:
+    """
+    Вычисляет пары (pHash, dHash) для списка изображений
+
+    Args:
+        images: Байты изображений
+
+    Returns:
+        list: Кортежи (phash, dhash)
+    """
+    decoded = [_decode(image_data) for image_data in images]
+    phashes = phash_batch(np.stack([item[0] for item in decoded]))
+    dhashes = dhash_batch(np.stack([item[1] for item in decoded]))
+    return list(zip(phashes, dhashes))
+
+
+def prompt_key(prompt: str) -> str:
+    """Ключ запроса: результат переиспользуется только для того же запроса"""
+    normalized = ' '.join((prompt or '').lower().split())
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+
+
+class _BKTree:
+    """BK-дерево по расстоянию Хэмминга между 64-битными хэшами"""
+
+    def __init__(self):
+        self._root = None  # [hash, [индексы записей], {расстояние: узел}]
+
+    def add(self, value: int, item: int):
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = (node[0] ^ value).bit_count()
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value: int, max_distance: int) -> list:
+        """Возвращает пары (расстояние, индекс записи) в пределах max_distance"""
+        if self._root is None:
+            return []
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = (node[0] ^ value).bit_count()
+            if distance <= max_distance:
+                found.extend((distance, item) for item in node[1])
+            # Неравенство треугольника отсекает поддеревья, где совпадений быть не может
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return found
+
+
+class ImageIndex:
+    """
+    Индекс ранее проанализированных изображений для поиска почти-дубликатов
+
+    Пережатое Telegram, уменьшенное или слегка обрезанное изображение дает близкий
+    pHash, поэтому результат анализа можно переиспользовать без запроса к модели.
+    Кандидаты ищутся в BK-дереве по pHash и подтверждаются по dHash.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path if path is not None else shard_path(IMAGE_INDEX_CONFIG['path'])
+        self._entries = []
+        self._tree = _BKTree()
+        self._unsaved = 0
+        self._version = 0          # Номер последнего снимка
+        self._written_version = 0  # Номер снимка, уже записанного на диск
+        self._write_lock = threading.Lock()
+        self.stats = {'lookups': 0, 'hits': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, hashes: tuple, prompt: str) -> str:
+        """
+        Ищет результат анализа похожего изображения с тем же запросом
+
+        Args:
+            hashes: Пара (phash, dhash) из compute_hashes
+            prompt: Текст запроса к изображению
+
+        Returns:
+            str: Сохраненный результат или None
+        """
+        self.stats['lookups'] += 1
+        phash, dhash = hashes
+        key = prompt_key(prompt)
+        best = None
+        for distance, item in self._tree.search(phash, IMAGE_INDEX_CONFIG['max_distance']):
+            entry = self._entries[item]
+            if entry['prompt_key'] != key:
+                continue
+            if (entry['dhash'] ^ dhash).bit_count() > IMAGE_INDEX_CONFIG['dhash_max_distance']:
+                continue
+            if best is None or distance < best[0]:
+                best = (distance, entry)
+        if best is None:
+            return None
+        self.stats['hits'] += 1
+        logger.info(f"Найден почти-дубликат изображения (расстояние {best[0]})")
+        return best[1]['result']
+
+    def add(self, hashes: tuple, prompt: str, result: str):
+        """Добавляет результат анализа изображения в индекс"""
+        self._append({
+            'phash': hashes[0],
+            'dhash': hashes[1],
+            'prompt_key': prompt_key(prompt),
+            'result': result,
+            'time': time.time(),
+        })
+        if len(self._entries) > IMAGE_INDEX_CONFIG['max_entries']:
+            self._evict()
+
+    def bulk_load(self, items: list):
+        """
+        Массово добавляет изображения с известными результатами анализа
+
+        Args:
+            items: Кортежи (байты изображения, запрос, результат)
+        """
+        batch_size = IMAGE_INDEX_CONFIG['bulk_batch_size']
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            hashes = compute_hashes([image_data for image_data, _, _ in batch])
+            for (_, prompt, result), pair in zip(batch, hashes):
+                self.add(pair, prompt, result)
+        logger.info(f"В индекс изображений загружено {len(items)} записей")
+
+    def _append(self, entry: dict):
+        self._entries.append(entry)
+        self._tree.add(entry['phash'], len(self._entries) - 1)
+        self._unsaved += 1
+
+    def _evict(self):
+        """Удаляет самые старые записи и перестраивает дерево"""
+        keep = int(IMAGE_INDEX_CONFIG['max_entries'] * 0.9)
+        entries = self._entries[-keep:]
+        self._entries = []
+        self._tree = _BKTree()
+        for entry in entries:
+            self._append(entry)
+
+    @property
+    def unsaved(self) -> int:
+        """Количество записей, добавленных после последнего сохранения"""
+        return self._unsaved
+
+    @property
+    def needs_save(self) -> bool:
+        return self._unsaved >= IMAGE_INDEX_CONFIG['save_every']
+
+    def snapshot(self) -> dict:
+        """Копия записей для сохранения; вызывается в цикле событий"""
+        self._unsaved = 0
+        self._version += 1
+        return {'version': self._version, 'entries': list(self._entries)}
+
+    def write(self, snapshot: dict):
+        """Записывает снимок на диск атомарно (можно вызывать из отдельного потока)"""
+        if not self.path:
+            return
+        with self._write_lock:
+            # Более новый снимок мог быть записан раньше этого
+            if snapshot['version'] <= self._written_version:
+                return
+            data = json.dumps(snapshot['entries'], ensure_ascii=False).encode('utf-8')
+            write_file_atomic(self.path, data)
+            self._written_version = snapshot['version']
+        logger.info(f"Индекс изображений сохранен: {len(snapshot['entries'])} записей")
+
+    def save(self):
+        """Сохраняет индекс на диск"""
+        self.write(self.snapshot())
+
+    def load(self):
+        """Загружает индекс с диска, если файл существует"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as index_file:
+            entries = json.load(index_file)
+        self._entries = []
+        self._tree = _BKTree()
+        for entry in entries:
+            self._append(entry)
+        self._unsaved = 0
+        logger.info(f"Индекс изображений загружен: {len(self._entries)} записей")
@@ -0,0 +1,92 @@
+import time
+import bisect
+from collections import OrderedDict
+from src.config.config import INLINE_CONFIG
+
+
+class InlineAnswerCache:
+    """
+    Кэш ответов на inline-запросы с поиском по префиксу
+
+    Ключи — нормализованные запросы. Кроме точного совпадения кэш находит ранее
+    заданные вопросы, которые начинаются с набранного текста: пока пользователь
+    печатает или стирает запрос, ему можно сразу предложить готовые ответы.
+    Вытеснение — LRU с ограничением по времени жизни, для поиска по префиксу
+    ключи дополнительно хранятся отсортированными.
+    """
+
+    def __init__(self, max_size: int = None, ttl: float = None):
+        self.max_size = max_size or INLINE_CONFIG['cache_size']
+        self.ttl = ttl or INLINE_CONFIG['cache_ttl']
+        self._entries = OrderedDict()  # ключ -> (время добавления, запрос, ответ)
+        self._keys = []                # те же ключи в отсортированном порядке
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expired(self, entry: tuple) -> bool:
+        return time.monotonic() - entry[0] > self.ttl
+
+    def _remove(self, key: str):
+        del self._entries[key]
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            del self._keys[index]
+
+    def get(self, key: str):
+        """
+        Ищет ответ на точно такой же запрос
+
+        Returns:
+            tuple: (запрос, ответ) или None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1], entry[2]
+
+    def completions(self, prefix: str, limit: int) -> list:
+        """
+        Ищет сохраненные запросы, которые продолжают набранный текст
+
+        Args:
+            prefix: Нормализованный набранный текст
+            limit: Максимальное число результатов
+
+        Returns:
+            list: (запрос, ответ), сначала самые короткие продолжения
+        """
+        found = []
+        index = bisect.bisect_right(self._keys, prefix)
+        while index < len(self._keys) and len(found) < limit * 4:
+            key = self._keys[index]
+            if not key.startswith(prefix):
+                break
+            found.append(key)
+            index += 1
+
+        results = []
+        for key in sorted(found, key=len):
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry):
+                continue
+            results.append((entry[1], entry[2]))
+            if len(results) >= limit:
+                break
+        return results
+
+    def put(self, key: str, query: str, answer: str):
+        """Сохраняет ответ, вытесняя давно не использованные записи"""
+        if key in self._entries:
+            self._entries[key] = (time.monotonic(), query, answer)
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = (time.monotonic(), query, answer)
+        bisect.insort(self._keys, key)
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
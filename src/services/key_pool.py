@@ -0,0 +1,179 @@
+import time
+import asyncio
+import logging
+import contextlib
+from collections import deque
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+from google.generativeai.types import file_types
+from google.api_core import exceptions as api_exceptions
+from src.config.config import KEY_POOL_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class ApiKeySlot:
+    """
+    Отдельный API-ключ Gemini со своими клиентами, учетом квоты и состоянием здоровья
+    """
+
+    def __init__(self, index: int, api_key: str):
+        # В логах и статистике показываем только хвост ключа
+        self.key_id = f"key{index}:...{api_key[-4:]}" if api_key else f"key{index}"
+        self._clients = genai_client._ClientManager()
+        self._clients.configure(api_key=api_key)
+        self._models = {}
+        self._window = deque()  # Моменты отправки запросов за последнюю минуту
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.quota_errors = 0
+        self.auth_errors = 0
+        self.disabled_until = 0.0
+        self.last_error = None
+
+    def model(self, model_name: str) -> genai.GenerativeModel:
+        """Возвращает модель, привязанную к клиентам этого ключа"""
+        model = self._models.get(model_name)
+        if model is None:
+            model = genai.GenerativeModel(model_name)
+            model._client = self._clients.get_default_client('generative')
+            model._async_client = self._clients.get_default_client('generative_async')
+            self._models[model_name] = model
+        return model
+
+    async def embed_content(self, model_name: str, texts: list, task_type: str) -> list:
+        """Вычисляет эмбеддинги пачки текстов одним запросом от имени этого ключа"""
+        result = await genai.embed_content_async(
+            model=model_name,
+            content=texts,
+            task_type=task_type,
+            client=self._clients.get_default_client('generative_async'),
+        )
+        return result['embedding']
+
+    def upload_file(self, buffer, mime_type: str) -> file_types.File:
+        """Загружает файл в File API от имени этого ключа (блокирующий вызов)"""
+        file_client = self._clients.get_default_client('file')
+        return file_types.File(file_client.create_file(path=buffer, mime_type=mime_type))
+
+    def get_file(self, name: str) -> file_types.File:
+        """Получает состояние загруженного файла (блокирующий вызов)"""
+        file_client = self._clients.get_default_client('file')
+        return file_types.File(file_client.get_file(name=name))
+
+    def recent_requests(self, now: float) -> int:
+        """Количество запросов за последнюю минуту"""
+        while self._window and now - self._window[0] > 60:
+            self._window.popleft()
+        return len(self._window)
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.disabled_until
+
+    def has_quota(self, now: float) -> bool:
+        limit = KEY_POOL_CONFIG['rpm_limit']
+        return not limit or self.recent_requests(now) < limit
+
+    def load(self, now: float) -> tuple:
+        """Ключ сортировки: меньше запросов в работе, затем меньше запросов за минуту"""
+        return self.in_flight, self.recent_requests(now)
+
+    def disable(self, seconds: float, reason: str):
+        self.disabled_until = max(self.disabled_until, time.monotonic() + seconds)
+        logger.warning(f"API-ключ {self.key_id} временно отключен на {seconds} с: {reason}")
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            'key': self.key_id,
+            'healthy': self.is_healthy(now),
+            'disabled_for': round(max(0.0, self.disabled_until - now), 1),
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'requests_last_minute': self.recent_requests(now),
+            'errors': self.errors,
+            'quota_errors': self.quota_errors,
+            'auth_errors': self.auth_errors,
+            'last_error': self.last_error,
+        }
+
+
+class KeyPool:
+    """
+    Пул API-ключей Gemini с балансировкой нагрузки
+
+    Запрос получает наименее загруженный здоровый ключ. Ключи, вернувшие ошибку
+    квоты или авторизации, временно исключаются из ротации.
+    """
+
+    def __init__(self, api_keys: list = None):
+        api_keys = api_keys if api_keys is not None else KEY_POOL_CONFIG['api_keys']
+        if not api_keys:
+            logger.error("Не задан ни один API-ключ Gemini (GOOGLE_API_KEYS или GOOGLE_API_KEY)")
+            api_keys = [None]
+        self.slots = [ApiKeySlot(index, key) for index, key in enumerate(api_keys, start=1)]
+
+    def _pick(self, exclude) -> ApiKeySlot:
+        now = time.monotonic()
+        candidates = [slot for slot in self.slots if slot not in exclude and slot.is_healthy(now)]
+        if not candidates:
+            return None
+        # Ключи с исчерпанной минутной квотой используем только если других нет
+        with_quota = [slot for slot in candidates if slot.has_quota(now)]
+        return min(with_quota or candidates, key=lambda slot: slot.load(now))
+
+    async def acquire(self, exclude=()) -> ApiKeySlot:
+        """
+        Выбирает ключ, ожидая восстановления, если все ключи временно отключены
+
+        Args:
+            exclude: Ключи, которые не следует выбирать
+        """
+        deadline = time.monotonic() + KEY_POOL_CONFIG['max_wait']
+        while True:
+            slot = self._pick(exclude)
+            if slot is not None:
+                return slot
+            waiting = [s.disabled_until for s in self.slots if s not in exclude]
+            now = time.monotonic()
+            if not waiting or min(waiting) > deadline:
+                raise RuntimeError("Нет доступных API-ключей Gemini, попробуйте позже")
+            await asyncio.sleep(max(0.05, min(waiting) - now))
+
+    @contextlib.asynccontextmanager
+    async def lease(self, slot: ApiKeySlot = None, exclude=()):
+        """
+        Выдает ключ на время запроса и учитывает результат
+
+        Args:
+            slot: Конкретный ключ (например, тот, которым был загружен файл)
+            exclude: Ключи, которые не следует выбирать
+        """
+        if slot is None:
+            slot = await self.acquire(exclude)
+        slot.in_flight += 1
+        slot.requests += 1
+        slot._window.append(time.monotonic())
+        try:
+            yield slot
+        except Exception as e:
+            self._record_error(slot, e)
+            raise
+        finally:
+            slot.in_flight -= 1
+
+    def _record_error(self, slot: ApiKeySlot, error: Exception):
+        slot.errors += 1
+        slot.last_error = f"{type(error).__name__}: {str(error)[:200]}"
+        if isinstance(error, api_exceptions.TooManyRequests):
+            slot.quota_errors += 1
+            slot.disable(KEY_POOL_CONFIG['quota_cooldown'], "превышена квота")
+        elif isinstance(error, (api_exceptions.Unauthenticated, api_exceptions.PermissionDenied)) \
+                or 'api key not valid' in str(error).lower():
+            slot.auth_errors += 1
+            slot.disable(KEY_POOL_CONFIG['auth_cooldown'], "ошибка авторизации")
+
+    def stats(self) -> list:
+        """Статистика использования по каждому ключу"""
+        return [slot.stats() for slot in self.slots]
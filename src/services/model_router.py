@@ -0,0 +1,145 @@
+import os
+import re
+import time
+import logging
+from collections import Counter, defaultdict, deque
+from src.config.config import MODEL_ROUTER_CONFIG, MODEL_CONFIG, FAST_PATH_CONFIG
+from src.services.code_condenser import CodeCondenser
+from src.services.fast_path import FastPathMatcher, normalize
+
+logger = logging.getLogger(__name__)
+
+# Строки, характерные для исходного кода: ключевые слова в начале, скобки и ; в конце, операторы
+_CODE_LINE = re.compile(
+    r'^\s*(def |class |import |from \S+ import |function |const |let |var |return\b|#include|public |private |if\s*\(|for\s*\()'
+    r'|[{};]\s*$|=>|==|!=|\)\s*:$'
+)
+_FENCE = '```'
+
+
+class ModelRouter:
+    """
+    Выбирает модель и параметры генерации по содержимому запроса
+
+    Запрос относится к маршруту по модальности, размеру и виду ввода: короткая реплика
+    вроде «спасибо» не должна получать ту же модель и тот же бюджет ответа, что и разбор
+    большого фрагмента кода. Профили маршрутов задаются в MODEL_ROUTER_CONFIG; решения
+    и задержка по маршрутам накапливаются в статистике, чтобы профили можно было подстроить.
+    """
+
+    def __init__(self, config: dict = None):
+        self.config = config or MODEL_ROUTER_CONFIG
+        # Болтовней считается только реплика, целиком совпадающая с намерением приветствия или
+        # благодарности: отдельные слова вроде «день» или «до» встречаются и в обычных вопросах
+        chat_intents = [intent for intent in FAST_PATH_CONFIG['intents']
+                        if intent['name'] in self.config['chat_intents']]
+        self._chat_matcher = FastPathMatcher({**FAST_PATH_CONFIG, 'intents': chat_intents})
+        self.decisions = Counter()  # (маршрут, модель) -> число запросов
+        self.latencies = defaultdict(lambda: deque(maxlen=self.config['latency_history_size']))
+        self.errors = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.config['enabled']
+
+    def _looks_like_code(self, text: str) -> bool:
+        if _FENCE in text:
+            return True
+        lines = [line for line in text.splitlines() if line.strip()]
+        if len(lines) < 3:
+            return False
+        code_lines = sum(1 for line in lines if _CODE_LINE.search(line))
+        return code_lines / len(lines) >= self.config['code_min_share']
+
+    def _is_chat(self, text: str) -> bool:
+        words = normalize(text).split()
+        if not 0 < len(words) <= self.config['chat_max_words']:
+            return False
+        intent, _ = self._chat_matcher.lookup(text)
+        return intent is not None
+
+    def classify(self, request_type: str, text: str = None, file_name: str = None) -> str:
+        """
+        Определяет маршрут запроса
+
+        Args:
+            request_type: Тип запроса (text, image, audio, file, inline)
+            text: Текст запроса пользователя или содержимое файла (без служебных инструкций)
+            file_name: Имя файла для запросов с документами
+
+        Returns:
+            str: Имя маршрута из MODEL_ROUTER_CONFIG['routes']
+        """
+        if request_type in ('image', 'audio', 'inline'):
+            return request_type
+        if request_type == 'file':
+            _, ext = os.path.splitext(file_name or '')
+            if ext.lower() in CodeCondenser.SUPPORTED_EXTENSIONS or (text and self._looks_like_code(text)):
+                return 'code_file'
+            return 'document'
+        text = text or ''
+        if self._looks_like_code(text):
+            return 'code'
+        if self._is_chat(text):
+            return 'chat'
+        if len(text) <= self.config['short_max_chars']:
+            return 'short'
+        return 'text'
+
+    def profile(self, route: str, default_model: str, default_output_tokens: int) -> dict:
+        """
+        Параметры генерации для маршрута
+
+        Args:
+            route: Имя маршрута
+            default_model: Модель, которую запросил сервис
+            default_output_tokens: Бюджет ответа для типа запроса
+
+        Returns:
+            dict: model, temperature, top_p, top_k, max_output_tokens
+        """
+        routes = self.config['routes']
+        profile = (routes.get(route) or {}) if self.enabled else {}
+        output_tokens = profile.get('output_tokens') or default_output_tokens
+        return {
+            'model': profile.get('model') or default_model,
+            'temperature': MODEL_CONFIG['temperature'] if profile.get('temperature') is None else profile['temperature'],
+            'top_p': profile.get('top_p') or MODEL_CONFIG['top_p'],
+            'top_k': profile.get('top_k') or MODEL_CONFIG['top_k'],
+            'max_output_tokens': min(output_tokens, MODEL_CONFIG['max_output_tokens']),
+        }
+
+    def record(self, route: str, model_name: str, started: float, failed: bool = False):
+        """
+        Учитывает выполненный запрос маршрута
+
+        Args:
+            route: Имя маршрута
+            model_name: Модель, которая фактически обработала запрос
+            started: Момент начала запроса (time.monotonic)
+            failed: Запрос завершился ошибкой
+        """
+        self.decisions[(route, model_name)] += 1
+        if failed:
+            self.errors[route] += 1
+        else:
+            self.latencies[route].append(time.monotonic() - started)
+        if sum(self.decisions.values()) % self.config['stats_log_interval'] == 0:
+            logger.info(f"Маршрутизация запросов к моделям: {self.summary()}")
+
+    def summary(self) -> dict:
+        """Число запросов по маршрутам и моделям и задержка по маршрутам"""
+        result = {}
+        for (route, model_name), count in self.decisions.items():
+            entry = result.setdefault(route, {'requests': 0, 'errors': self.errors[route], 'models': {}})
+            entry['requests'] += count
+            entry['models'][model_name] = count
+        for route, history in self.latencies.items():
+            values = sorted(history)
+            if values and route in result:
+                result[route]['latency'] = {
+                    'p50': round(values[len(values) // 2], 3),
+                    'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+                    'max': round(values[-1], 3),
+                }
+        return result
@@ -0,0 +1,147 @@
+import time
+from collections import deque
+from src.config.config import MODEL_CONFIG, PROMPT_BUDGET_CONFIG
+
+
+class TokenEstimator:
+    """
+    Быстрая локальная оценка количества токенов
+
+    ASCII-символы (латиница, код, цифры) и остальные символы (кириллица и т.п.)
+    кодируются токенизатором с разной плотностью. Число не-ASCII символов считается
+    по разнице длины строки и ее UTF-8 представления, без прохода в Python-цикле.
+    Общий масштаб подстраивается по фактическому prompt_token_count из ответов API.
+    """
+
+    def __init__(self):
+        self.ascii_chars_per_token = PROMPT_BUDGET_CONFIG['ascii_chars_per_token']
+        self.other_chars_per_token = PROMPT_BUDGET_CONFIG['other_chars_per_token']
+        self.scale = 1.0
+        self.samples = 0
+
+    def _raw_estimate(self, text: str) -> float:
+        chars = len(text)
+        # Для символов из диапазона U+0080..U+07FF (кириллица) разница составляет ровно 1 байт
+        other = min(chars, len(text.encode('utf-8', 'surrogatepass')) - chars)
+        return (chars - other) / self.ascii_chars_per_token + other / self.other_chars_per_token
+
+    def estimate(self, text: str) -> int:
+        """Возвращает оценку количества токенов в тексте"""
+        if not text:
+            return 0
+        return int(self._raw_estimate(text) * self.scale) + 1
+
+    def calibrate(self, text: str, actual_tokens: int):
+        """
+        Уточняет масштаб оценки по фактическому числу токенов от API
+
+        Args:
+            text: Текст запроса (только текстовые запросы, без изображений)
+            actual_tokens: prompt_token_count из usage_metadata ответа
+        """
+        raw = self._raw_estimate(text)
+        if raw < PROMPT_BUDGET_CONFIG['calibration_min_tokens'] or actual_tokens <= 0:
+            return
+        ratio = actual_tokens / raw
+        alpha = PROMPT_BUDGET_CONFIG['calibration_alpha']
+        self.scale = ratio if self.samples == 0 else (1 - alpha) * self.scale + alpha * ratio
+        self.samples += 1
+
+
+class PromptBudget:
+    """Вписывает содержимое запроса в бюджет входных токенов по типу запроса"""
+
+    def __init__(self, estimator: TokenEstimator = None):
+        self.estimator = estimator or TokenEstimator()
+
+    def input_tokens(self, request_type: str) -> int:
+        """Бюджет входных токенов для типа запроса"""
+        budgets = PROMPT_BUDGET_CONFIG['input_tokens']
+        return budgets.get(request_type, budgets['text'])
+
+    def output_tokens(self, request_type: str) -> int:
+        """Значение max_output_tokens для типа запроса (не больше общего ограничения модели)"""
+        budgets = PROMPT_BUDGET_CONFIG['output_tokens']
+        return min(budgets.get(request_type, budgets['text']), MODEL_CONFIG['max_output_tokens'])
+
+    def remaining(self, request_type: str, *fixed_parts: str) -> int:
+        """Сколько токенов остается после обязательных частей запроса (инструкций, подписей)"""
+        used = sum(self.estimator.estimate(part) for part in fixed_parts if part)
+        return max(0, self.input_tokens(request_type) - used)
+
+    def fit(self, text: str, max_tokens: int) -> tuple:
+        """
+        Обрезает текст так, чтобы он уложился в заданное количество токенов
+
+        Returns:
+            tuple: (текст, был ли он обрезан)
+        """
+        estimate = self.estimator.estimate(text)
+        if estimate <= max_tokens:
+            return text, False
+        if max_tokens <= 0:
+            return "", True
+
+        # Плотность токенов неравномерна, поэтому сужаем длину за несколько итераций
+        length = int(len(text) * max_tokens / estimate)
+        for _ in range(4):
+            estimate = self.estimator.estimate(text[:length])
+            if estimate <= max_tokens:
+                break
+            length = int(length * max_tokens / estimate)
+        trimmed = text[:length]
+
+        # Стараемся не резать посередине строки
+        boundary = trimmed.rfind('\n')
+        if boundary > length * 0.9:
+            trimmed = trimmed[:boundary + 1]
+        return trimmed, True
+
+
+class TokenUsageTracker:
+    """Учитывает фактический расход токенов по типам запросов для планирования мощности"""
+
+    def __init__(self, history_size: int = None):
+        self.totals = {}
+        self.recent = deque(maxlen=history_size or PROMPT_BUDGET_CONFIG['usage_history_size'])
+
+    def record(self, request_type: str, usage_metadata, estimated_prompt_tokens: int = None,
+               max_output_tokens: int = None, latency: float = None) -> dict:
+        """
+        Сохраняет использование токенов одного запроса
+
+        Returns:
+            dict: Запись об использовании
+        """
+        entry = {
+            'time': time.time(),
+            'type': request_type,
+            'prompt_tokens': getattr(usage_metadata, 'prompt_token_count', 0) or 0,
+            'output_tokens': getattr(usage_metadata, 'candidates_token_count', 0) or 0,
+            'total_tokens': getattr(usage_metadata, 'total_token_count', 0) or 0,
+            'estimated_prompt_tokens': estimated_prompt_tokens,
+            'max_output_tokens': max_output_tokens,
+            'latency': latency,
+        }
+        self.recent.append(entry)
+
+        totals = self.totals.setdefault(
+            request_type, {'requests': 0, 'prompt_tokens': 0, 'output_tokens': 0, 'total_tokens': 0}
+        )
+        totals['requests'] += 1
+        totals['prompt_tokens'] += entry['prompt_tokens']
+        totals['output_tokens'] += entry['output_tokens']
+        totals['total_tokens'] += entry['total_tokens']
+        return entry
+
+    def summary(self) -> dict:
+        """Сводка по типам запросов со средними значениями"""
+        result = {}
+        for request_type, totals in self.totals.items():
+            requests = totals['requests'] or 1
+            result[request_type] = {
+                **totals,
+                'avg_prompt_tokens': round(totals['prompt_tokens'] / requests, 1),
+                'avg_output_tokens': round(totals['output_tokens'] / requests, 1),
+            }
+        return result
@@ -0,0 +1,487 @@
+import os
+import io
+import json
+import time
+import zlib
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from src.config.config import SEMANTIC_CACHE_CONFIG
+from src.services.fast_path import normalize
+from src.utils.file_utils import write_file_atomic, file_lock, shard_path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+def is_available() -> bool:
+    """Доступен ли NumPy, на котором построен индекс"""
+    return np is not None
+
+
+def _normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+# ---------------------------------------------------------------------------
+# Эмбеддеры: embed(texts) -> массив (N, dim) единичных векторов
+# ---------------------------------------------------------------------------
+
+class HashingEmbedder:
+    """
+    Эмбеддинги без модели: слова и символьные триграммы хэшируются в вектор фиксированной длины
+
+    Ловит перестановки слов, опечатки и разные формы одного слова («борщ» и «борща»),
+    но не синонимы. Работает локально и мгновенно.
+    """
+
+    def __init__(self, dim: int = None):
+        self.dim = dim or SEMANTIC_CACHE_CONFIG['hashing_dim']
+        self.name = f"hashing-{self.dim}"
+
+    def _features(self, text: str) -> list:
+        words = normalize(text).split()
+        features = [f"w:{word}" for word in words]
+        for word in words:
+            padded = f" {word} "
+            features.extend(f"g:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+        return features
+
+    def embed_sync(self, texts: list):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = zlib.crc32(feature.encode('utf-8'))
+                # Знак из старшего бита уменьшает смещение от коллизий
+                vectors[row, digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        return _normalize_rows(vectors)
+
+    async def embed(self, texts: list):
+        return self.embed_sync(texts)
+
+
+class GeminiEmbedder:
+    """
+    Эмбеддинги через Gemini Embedding API
+
+    Одновременные запросы собираются в одну пачку за короткое окно,
+    поэтому под нагрузкой на много сообщений уходит один вызов API.
+    """
+
+    def __init__(self, key_pool, model_name: str = None):
+        self.key_pool = key_pool
+        self.name = model_name or SEMANTIC_CACHE_CONFIG['gemini_model']
+        self._pending = []  # (текст, future)
+        self._flush_handle = None
+
+    async def embed(self, texts: list):
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self._pending.append((text, future))
+            futures.append(future)
+        if len(self._pending) >= SEMANTIC_CACHE_CONFIG['max_batch']:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(SEMANTIC_CACHE_CONFIG['batch_window'], self._start_flush)
+        return _normalize_rows(np.array(await asyncio.gather(*futures), dtype=np.float32))
+
+    def _start_flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._flush(batch))
+
+    async def _flush(self, batch: list):
+        try:
+            async with self.key_pool.lease() as slot:
+                vectors = await slot.embed_content(self.name, [text for text, _ in batch], 'SEMANTIC_SIMILARITY')
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+
+class LocalEmbedder:
+    """Эмбеддинги локальной моделью sentence-transformers (вычисляются в отдельном потоке)"""
+
+    def __init__(self, model_name: str = None):
+        from sentence_transformers import SentenceTransformer
+        self.name = model_name or SEMANTIC_CACHE_CONFIG['local_model']
+        self._model = SentenceTransformer(self.name)
+
+    async def embed(self, texts: list):
+        vectors = await asyncio.to_thread(self._model.encode, texts, normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def create_embedder(key_pool, kind: str = None):
+    """
+    Создает эмбеддер по настройке SEMANTIC_CACHE_EMBEDDER
+
+    Без sentence-transformers локальный эмбеддер заменяется хэширующим.
+    """
+    kind = kind or SEMANTIC_CACHE_CONFIG['embedder']
+    if kind == 'local':
+        try:
+            return LocalEmbedder()
+        except ImportError:
+            logger.warning("sentence-transformers не установлен, используется хэширующий эмбеддер")
+            return HashingEmbedder()
+    if kind == 'hashing':
+        return HashingEmbedder()
+    return GeminiEmbedder(key_pool)
+
+
+# ---------------------------------------------------------------------------
+# Индекс и кэш
+# ---------------------------------------------------------------------------
+
+class VectorIndex:
+    """
+    Плотный индекс единичных векторов в одном массиве NumPy
+
+    Поиск — одно матричное умножение на пачку запросов, без перебора в Python.
+    Массив растет удвоением, удаление уплотняет его.
+    """
+
+    def __init__(self, dim: int = None):
+        self.dim = dim
+        self._vectors = None
+        self._created = np.zeros(0)
+        self._used = np.zeros(0)
+        self.payloads = []
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, vector, payload) -> int:
+        if self._vectors is None:
+            self.dim = len(vector)
+            self._vectors = np.zeros((64, self.dim), dtype=np.float32)
+            self._created = np.zeros(64)
+            self._used = np.zeros(64)
+        if self._size == len(self._vectors):
+            capacity = len(self._vectors) * 2
+            self._vectors = np.resize(self._vectors, (capacity, self.dim))
+            self._created = np.resize(self._created, capacity)
+            self._used = np.resize(self._used, capacity)
+        now = time.time()
+        self._vectors[self._size] = vector
+        self._created[self._size] = now
+        self._used[self._size] = now
+        self.payloads.append(payload)
+        self._size += 1
+        return self._size - 1
+
+    def search(self, queries, min_created: float = 0.0) -> tuple:
+        """
+        Находит ближайшую запись для каждого вектора пачки
+
+        Returns:
+            tuple: (индексы записей, косинусные сходства); -1, если подходящих записей нет
+        """
+        if not self._size:
+            return np.full(len(queries), -1), np.zeros(len(queries), dtype=np.float32)
+        scores = queries @ self._vectors[:self._size].T
+        # Устаревшие записи не участвуют в поиске
+        scores[:, self._created[:self._size] < min_created] = -1.0
+        best = scores.argmax(axis=1)
+        best_scores = scores[np.arange(len(queries)), best]
+        return np.where(best_scores > -1.0, best, -1), best_scores
+
+    def touch(self, item: int):
+        self._used[item] = time.time()
+
+    def keep(self, mask):
+        """Оставляет только записи, отмеченные в mask"""
+        positions = np.flatnonzero(mask)
+        self._vectors = self._vectors[positions] if len(positions) else None
+        self._created = self._created[positions]
+        self._used = self._used[positions]
+        self.payloads = [self.payloads[position] for position in positions]
+        self._size = len(positions)
+
+    def arrays(self) -> tuple:
+        """Копии заполненной части массивов (для сохранения вне цикла событий)"""
+        if not self._size:
+            return np.zeros((0, self.dim or 0), dtype=np.float32), np.zeros(0), np.zeros(0)
+        return (self._vectors[:self._size].copy(), self._created[:self._size].copy(),
+                self._used[:self._size].copy())
+
+    def restore(self, vectors, created, used, payloads: list):
+        self._size = len(payloads)
+        self.dim = vectors.shape[1] if self._size else None
+        self._vectors = vectors.astype(np.float32) if self._size else None
+        self._created = created.astype(np.float64)
+        self._used = used.astype(np.float64)
+        self.payloads = list(payloads)
+
+
+class SemanticCache:
+    """
+    Кэш ответов модели, который находит перефразированные запросы
+
+    Запрос переводится в эмбеддинг и сравнивается со всеми сохраненными одним
+    матричным умножением. Если сходство выше порога, возвращается сохраненный ответ.
+    Небольшая доля попаданий перепроверяется запросом к модели: если новый ответ
+    заметно отличается от сохраненного, попадание считается ложным и попадает в выборку.
+    """
+
+    def __init__(self, embedder, path: str = None, config: dict = None):
+        self.config = config or SEMANTIC_CACHE_CONFIG
+        self.embedder = embedder
+        # Записи у каждого шарда свои, отказы чатов — в общем файле
+        if path is None:
+            self.path = shard_path(self.config['path'])
+            self.opt_out_path = self.config['opt_out_path']
+        else:
+            self.path = path
+            self.opt_out_path = f"{os.path.splitext(path)[0]}.opt_out.json"
+        self.index = VectorIndex()
+        self._opted_out = set()
+        self._opt_out_changes = {}  # chat_id -> отказ, еще не записанный в общий файл
+        self._opt_out_lock = threading.Lock()
+        self._unsaved = 0
+        self._version = 0          # Номер последнего снимка
+        self._written_version = 0  # Номер снимка, уже записанного на диск
+        self._write_lock = threading.Lock()
+        self.stats = {'lookups': 0, 'hits': 0, 'stored': 0, 'opted_out': 0, 'skipped': 0,
+                      'embed_errors': 0, 'evicted': 0, 'verified': 0, 'false_positives': 0}
+        self.false_positive_samples = deque(maxlen=self.config['false_positive_samples'])
+
+    def __len__(self):
+        return len(self.index)
+
+    # Отказ чата от кэша -------------------------------------------------------
+
+    def set_opt_out(self, chat_id: int, opted_out: bool):
+        """Отключает или включает кэш для чата (его запросы не читаются из кэша и не сохраняются)"""
+        if opted_out:
+            self._opted_out.add(chat_id)
+        else:
+            self._opted_out.discard(chat_id)
+        self._opt_out_changes[chat_id] = opted_out
+
+    async def persist_opt_outs(self):
+        """Записывает изменения отказов в общий файл, не блокируя цикл событий"""
+        changes, self._opt_out_changes = self._opt_out_changes, {}
+        try:
+            await asyncio.to_thread(self.write_opt_outs, changes)
+        except Exception:
+            # Не потеряем изменения: они будут записаны при следующем сохранении
+            self._opt_out_changes = {**changes, **self._opt_out_changes}
+            raise
+
+    def write_opt_outs(self, changes: dict):
+        """
+        Применяет изменения отказов к общему файлу
+
+        Файл читается и перезаписывается под блокировкой, поэтому изменения других
+        шардов не теряются: каждый шард меняет только отказы своих чатов.
+        """
+        if not changes or not self.opt_out_path:
+            return
+        with self._opt_out_lock, file_lock(f"{self.opt_out_path}.lock"):
+            opted_out = self._read_opt_outs()
+            for chat_id, value in changes.items():
+                if value:
+                    opted_out.add(chat_id)
+                else:
+                    opted_out.discard(chat_id)
+            write_file_atomic(self.opt_out_path, json.dumps(sorted(opted_out)).encode('utf-8'))
+
+    def _read_opt_outs(self) -> set:
+        if not self.opt_out_path or not os.path.exists(self.opt_out_path):
+            return set()
+        with open(self.opt_out_path, encoding='utf-8') as opt_out_file:
+            return set(json.load(opt_out_file))
+
+    def is_opted_out(self, chat_id: int) -> bool:
+        return chat_id in self._opted_out
+
+    def eligible(self, text: str, chat_id: int = None) -> bool:
+        """Можно ли использовать кэш для запроса"""
+        if chat_id is not None and chat_id in self._opted_out:
+            self.stats['opted_out'] += 1
+            return False
+        if not self.config['min_length'] <= len(text) <= self.config['max_length']:
+            self.stats['skipped'] += 1
+            return False
+        return True
+
+    # Поиск и сохранение -------------------------------------------------------
+
+    async def lookup(self, text: str) -> tuple:
+        """
+        Ищет ответ на близкий по смыслу запрос
+
+        Args:
+            text: Текст запроса
+
+        Returns:
+            tuple: (попадание или None, эмбеддинг запроса для последующего store);
+                   попадание — dict с prompt, answer и score
+        """
+        self.stats['lookups'] += 1
+        try:
+            vector = (await self.embedder.embed([text]))[0]
+        except Exception as e:
+            self.stats['embed_errors'] += 1
+            logger.warning(f"Не удалось вычислить эмбеддинг запроса: {str(e)}")
+            return None, None
+
+        indices, scores = self.index.search(vector[None, :], time.time() - self.config['ttl'])
+        item, score = int(indices[0]), float(scores[0])
+        if item < 0 or score < self.config['threshold']:
+            return None, vector
+
+        self.index.touch(item)
+        self.stats['hits'] += 1
+        prompt, answer = self.index.payloads[item]
+        logger.info(f"Семантический кэш: найден похожий запрос (сходство {score:.3f})")
+        return {'prompt': prompt, 'answer': answer, 'score': score}, vector
+
+    def store(self, text: str, vector, answer: str):
+        """Сохраняет ответ модели на запрос"""
+        if vector is None or not answer:
+            return
+        self.index.add(vector, (text, answer))
+        self.stats['stored'] += 1
+        self._unsaved += 1
+        if len(self.index) > self.config['max_entries']:
+            self._evict()
+
+    def _evict(self):
+        """Удаляет устаревшие и давно не использованные записи, оставляя 90% лимита"""
+        size = len(self.index)
+        _, created, used = self.index.arrays()
+        mask = created >= time.time() - self.config['ttl']
+        keep = int(self.config['max_entries'] * 0.9)
+        if mask.sum() > keep:
+            threshold = np.sort(used[mask])[-keep]
+            mask &= used >= threshold
+        self.index.keep(mask)
+        self.stats['evicted'] += size - len(self.index)
+
+    # Проверка ложных попаданий --------------------------------------------------
+
+    def should_verify(self) -> bool:
+        return random.random() < self.config['verify_rate']
+
+    async def record_verification(self, text: str, hit: dict, fresh_answer: str):
+        """
+        Сравнивает ответ из кэша с новым ответом модели на тот же запрос
+
+        Args:
+            text: Запрос, на который был выдан ответ из кэша
+            hit: Попадание из lookup
+            fresh_answer: Ответ модели, полученный для проверки
+        """
+        vectors = await self.embedder.embed([hit['answer'], fresh_answer])
+        similarity = float(vectors[0] @ vectors[1])
+        self.stats['verified'] += 1
+        if similarity < self.config['answer_similarity']:
+            self.stats['false_positives'] += 1
+            self.false_positive_samples.append({
+                'prompt': text,
+                'cached_prompt': hit['prompt'],
+                'prompt_score': round(hit['score'], 4),
+                'answer_similarity': round(similarity, 4),
+            })
+            logger.warning(f"Семантический кэш: вероятно ложное попадание (сходство ответов {similarity:.3f})")
+
+    def summary(self) -> dict:
+        """Доля попаданий и оценка доли ложных попаданий по выборке"""
+        lookups, verified = self.stats['lookups'], self.stats['verified']
+        return {
+            **self.stats,
+            'entries': len(self.index),
+            'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+            'false_positive_rate': self.stats['false_positives'] / verified if verified else None,
+            'false_positive_samples': list(self.false_positive_samples)[-5:],
+        }
+
+    # Сохранение на диск -------------------------------------------------------
+
+    @property
+    def unsaved(self) -> int:
+        """Количество изменений после последнего сохранения (включая незаписанные отказы чатов)"""
+        return self._unsaved + len(self._opt_out_changes)
+
+    @property
+    def needs_save(self) -> bool:
+        return self._unsaved >= self.config['save_every']
+
+    def snapshot(self) -> dict:
+        """Копия состояния для сохранения; вызывается в цикле событий"""
+        self._unsaved = 0
+        self._version += 1
+        vectors, created, used = self.index.arrays()
+        return {
+            'version': self._version,
+            'embedder': self.embedder.name,
+            'vectors': vectors,
+            'created': created,
+            'used': used,
+            'payloads': list(self.index.payloads),
+        }
+
+    def write(self, snapshot: dict):
+        """Записывает снимок на диск атомарно (можно вызывать из отдельного потока)"""
+        if not self.path:
+            return
+        meta = json.dumps({'embedder': snapshot['embedder'], 'payloads': snapshot['payloads']}, ensure_ascii=False)
+        buffer = io.BytesIO()
+        # Тексты хранятся как JSON в байтовом массиве, чтобы загрузка не требовала pickle
+        np.savez(buffer, vectors=snapshot['vectors'], created=snapshot['created'], used=snapshot['used'],
+                 meta=np.frombuffer(meta.encode('utf-8'), dtype=np.uint8))
+        with self._write_lock:
+            # Более новый снимок мог быть записан раньше этого
+            if snapshot['version'] <= self._written_version:
+                return
+            write_file_atomic(self.path, buffer.getvalue())
+            self._written_version = snapshot['version']
+        logger.info(f"Семантический кэш сохранен: {len(snapshot['payloads'])} записей")
+
+    def save(self):
+        changes, self._opt_out_changes = self._opt_out_changes, {}
+        self.write_opt_outs(changes)
+        self.write(self.snapshot())
+
+    def load(self):
+        """Загружает отказы чатов и записи кэша; записи другого эмбеддера не используются"""
+        self._opted_out = self._read_opt_outs()
+        if not self.path or not os.path.exists(self.path):
+            return
+        with np.load(self.path) as data:
+            meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+            # Файлы прежних версий хранили отказы вместе с записями
+            legacy = set(meta.get('opted_out', [])) - self._opted_out
+            if legacy:
+                self._opted_out |= legacy
+                self._opt_out_changes.update({chat_id: True for chat_id in legacy})
+            if meta.get('embedder') != self.embedder.name:
+                logger.warning(f"Семантический кэш построен эмбеддером {meta.get('embedder')}, "
+                               f"записи сброшены (текущий: {self.embedder.name})")
+                return
+            payloads = [tuple(payload) for payload in meta['payloads']]
+            self.index.restore(data['vectors'], data['created'], data['used'], payloads)
+        self._unsaved = 0
+        logger.info(f"Семантический кэш загружен: {len(self.index)} записей")
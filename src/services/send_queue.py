@@ -0,0 +1,308 @@
+import time
+import asyncio
+import logging
+from collections import Counter, deque
+from aiogram.exceptions import TelegramRetryAfter
+from src.config.config import SEND_QUEUE_CONFIG
+from src.services.degradation import degradation
+from src.utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class Priority:
+    """Приоритеты исходящих запросов: меньше — раньше"""
+    FINAL = 0       # Ответы и итоговые правки сообщений
+    PROGRESS = 1    # Постепенный вывод ответа
+    ANIMATION = 2   # Индикатор загрузки
+    ACTION = 3      # Статус «печатает»
+
+    NAMES = ('final', 'progress', 'animation', 'action')
+
+
+class _Request:
+    __slots__ = ('chat_id', 'call', 'priority', 'key', 'future', 'enqueued', 'attempts')
+
+    def __init__(self, chat_id: int, call, priority: int, key, future):
+        self.chat_id = chat_id
+        self.call = call
+        self.priority = priority
+        self.key = key
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+
+
+class SendQueue:
+    """
+    Общая очередь исходящих запросов к Bot API
+
+    Запросы всех обработчиков проходят через token bucket на весь бот и на каждый чат
+    (для групп лимит строже), поэтому флуд-контроль не срабатывает. Готовые ответы
+    отправляются раньше промежуточных правок и анимации; несколько ожидающих правок
+    одного сообщения сливаются в последнюю, статусы «печатает» не повторяются.
+    Запросы одного чата выполняются по одному, чтобы правки не обгоняли друг друга.
+    """
+
+    def __init__(self, config: dict = None):
+        self.config = config or SEND_QUEUE_CONFIG
+        self._global = TokenBucket(self.config['global_rate'], self.config['global_burst'])
+        self._buckets = {}        # chat_id -> (TokenBucket, момент последнего использования)
+        self._blocked = {}        # chat_id -> до какого момента чат под флуд-контролем
+        self._busy = set()        # Чаты, у которых запрос уже выполняется
+        self._pending_keys = {}   # ключ слияния -> ожидающий запрос
+        self._actions = {}        # (chat_id, action) -> момент отправки статуса
+        self._queues = [deque() for _ in Priority.NAMES]
+        self._in_flight = 0
+        self._worker = None
+        self._loop = None
+        self._wake = None
+        self._last_log = time.monotonic()
+        self._last_prune = time.monotonic()
+        self.delays = [deque(maxlen=self.config['delay_history_size']) for _ in Priority.NAMES]
+        self.stats = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.config['enabled']
+
+    def split_global_limit(self, parts: int):
+        """Делит общий лимит бота между несколькими процессами, у каждого из которых своя очередь"""
+        if parts > 1:
+            self._global = TokenBucket(self.config['global_rate'] / parts,
+                                       max(1.0, self.config['global_burst'] / parts))
+
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self._queues)
+
+    # Постановка в очередь -----------------------------------------------------
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Новый цикл событий (например, повторный asyncio.run): прежние запросы к нему не относятся
+            self._loop = loop
+            self._wake = asyncio.Event()
+            self._queues = [deque() for _ in Priority.NAMES]
+            self._pending_keys.clear()
+            self._busy.clear()
+            self._in_flight = 0
+            self._worker = None
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, chat_id: int, call, priority: int = Priority.FINAL, key=None):
+        """
+        Выполняет запрос к Bot API в порядке очереди
+
+        Args:
+            chat_id: Чат, к которому относится запрос (по нему выбирается лимит)
+            call: Функция без аргументов, возвращающая корутину запроса
+            priority: Приоритет (Priority)
+            key: Ключ сообщения для слияния правок: ожидающая правка того же приоритета
+                 заменяется новой, правка с более высоким приоритетом отменяет менее важные
+
+        Returns:
+            Результат запроса (None, если правка вытеснена более важной)
+        """
+        if not self.enabled:
+            return await call()
+        self._ensure_worker()
+
+        if key is not None:
+            pending = self._pending_keys.get(key)
+            if pending is not None and not pending.future.done():
+                if pending.priority == priority and priority != Priority.FINAL:
+                    # Ожидающая правка еще не отправлена: достаточно отправить последний текст
+                    pending.call = call
+                    self.stats['coalesced'] += 1
+                    return await asyncio.shield(pending.future)
+                if pending.priority > priority:
+                    self._drop(pending)
+                elif pending.priority < priority:
+                    # Например, кадр анимации после начала вывода ответа затер бы ответ
+                    self.stats['superseded'] += 1
+                    return None
+
+        request = _Request(chat_id, call, priority, key, self._loop.create_future())
+        self._queues[priority].append(request)
+        if key is not None:
+            self._pending_keys[key] = request
+        self._wake.set()
+        return await request.future
+
+    def submit_nowait(self, chat_id: int, call, priority: int, key=None):
+        """Ставит запрос в очередь без ожидания результата (ошибки только записываются в лог)"""
+        task = asyncio.create_task(self.submit(chat_id, call, priority, key))
+        task.add_done_callback(self._log_failure)
+
+    def chat_action(self, bot, chat_id: int, action: str = 'typing'):
+        """
+        Отправляет статус чата без ожидания
+
+        Повтор того же статуса, пока предыдущий еще отображается или ждет отправки, пропускается.
+        """
+        call = lambda: bot.send_chat_action(chat_id=chat_id, action=action)
+        if not self.enabled:
+            self.submit_nowait(chat_id, call, Priority.ACTION)
+            return
+        now = time.monotonic()
+        sent = self._actions.get((chat_id, action))
+        if sent is not None and now - sent < self.config['chat_action_ttl']:
+            self.stats['actions_suppressed'] += 1
+            return
+        self._actions[(chat_id, action)] = now
+        self.submit_nowait(chat_id, call, Priority.ACTION)
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Не удалось выполнить запрос из очереди отправки: {str(task.exception())}")
+
+    def _drop(self, request: _Request):
+        """Убирает из очереди правку, которую вытеснил итоговый ответ"""
+        try:
+            self._queues[request.priority].remove(request)
+        except ValueError:
+            return
+        if self._pending_keys.get(request.key) is request:
+            del self._pending_keys[request.key]
+        if not request.future.done():
+            request.future.set_result(None)
+        self.stats['superseded'] += 1
+
+    # Выдача запросов ----------------------------------------------------------
+
+    def _bucket(self, chat_id: int, now: float) -> TokenBucket:
+        entry = self._buckets.get(chat_id)
+        if entry is None:
+            # Отрицательные идентификаторы — группы и каналы
+            if chat_id is not None and chat_id < 0:
+                bucket = TokenBucket(self.config['group_rate'], self.config['group_burst'])
+            else:
+                bucket = TokenBucket(self.config['private_rate'], self.config['private_burst'])
+        else:
+            bucket = entry[0]
+        self._buckets[chat_id] = (bucket, now)
+        return bucket
+
+    def _next_request(self) -> tuple:
+        """
+        Выбирает следующий запрос, который можно отправить, не нарушая лимитов
+
+        Returns:
+            tuple: (запрос или None, сколько ждать до следующей проверки или None)
+        """
+        if self._in_flight >= self.config['max_in_flight']:
+            return None, None
+        global_delay = self._global.delay_until_available()
+        if global_delay > 0:
+            return None, global_delay
+
+        now = time.monotonic()
+        wait = None
+        for queue in self._queues:
+            index = 0
+            while index < len(queue) and index < self.config['scan_limit']:
+                request = queue[index]
+                if request.future.done():
+                    # Вызывающий перестал ждать (например, анимация остановлена)
+                    del queue[index]
+                    if self._pending_keys.get(request.key) is request:
+                        del self._pending_keys[request.key]
+                    continue
+                index += 1
+                if request.chat_id in self._busy:
+                    continue
+                delay = max(0.0, self._blocked.get(request.chat_id, 0.0) - now)
+                if delay == 0:
+                    delay = self._bucket(request.chat_id, now).delay_until_available()
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                del queue[index - 1]
+                self._bucket(request.chat_id, now).try_acquire()
+                self._global.try_acquire()
+                return request, None
+        return None, wait
+
+    async def _run(self):
+        while True:
+            request, wait = self._next_request()
+            if request is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                self._maintain()
+                continue
+            if self._pending_keys.get(request.key) is request:
+                del self._pending_keys[request.key]
+            self.delays[request.priority].append(time.monotonic() - request.enqueued)
+            self._in_flight += 1
+            self._busy.add(request.chat_id)
+            self._loop.create_task(self._execute(request))
+
+    async def _execute(self, request: _Request):
+        try:
+            result = await request.call()
+        except TelegramRetryAfter as e:
+            self.stats['flood_waits'] += 1
+            self._blocked[request.chat_id] = time.monotonic() + e.retry_after
+            request.attempts += 1
+            if request.attempts <= self.config['max_flood_retries'] and not request.future.done():
+                degradation.record_flood(e.retry_after)
+                logger.warning(f"Флуд-контроль в чате {request.chat_id}, повтор через {e.retry_after} с")
+                self._queues[request.priority].appendleft(request)
+            elif not request.future.done():
+                # Исчерпав повторы, ошибку получает вызывающий (он и учитывает ее в деградации)
+                request.future.set_exception(e)
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            self.stats['sent'] += 1
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            self._in_flight -= 1
+            self._busy.discard(request.chat_id)
+            self._wake.set()
+
+    def _maintain(self):
+        """Удаляет лимиты простаивающих чатов и периодически пишет сводку"""
+        now = time.monotonic()
+        if now - self._last_prune >= self.config['bucket_idle_ttl']:
+            self._last_prune = now
+            idle = now - self.config['bucket_idle_ttl']
+            self._buckets = {chat_id: entry for chat_id, entry in self._buckets.items() if entry[1] >= idle}
+            self._blocked = {chat_id: until for chat_id, until in self._blocked.items() if until > now}
+            self._actions = {key: sent for key, sent in self._actions.items()
+                             if now - sent < self.config['chat_action_ttl']}
+        if now - self._last_log >= self.config['stats_log_interval']:
+            self._last_log = now
+            logger.info(f"Очередь отправки: {self.summary()}")
+
+    def summary(self) -> dict:
+        """Глубина очереди и задержка ожидания по приоритетам"""
+        delays = {}
+        for name, history in zip(Priority.NAMES, self.delays):
+            values = sorted(history)
+            if values:
+                delays[name] = {
+                    'p50': round(values[len(values) // 2], 3),
+                    'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+                    'max': round(values[-1], 3),
+                }
+        return {
+            'depth': self.depth(),
+            'in_flight': self._in_flight,
+            'chats': len(self._buckets),
+            **self.stats,
+            'queue_delay': delays,
+        }
+
+
+# Общая очередь процесса: лимиты Telegram действуют на бота целиком
+send_queue = SendQueue()
@@ -0,0 +1,201 @@
+import time
+import zlib
+import queue
+import asyncio
+import logging
+import multiprocessing
+from src.config.config import WORKER_CONFIG
+from src.services.shard_worker import run_worker, update_chat_id
+from src.utils.bot_api import create_bot
+
+logger = logging.getLogger(__name__)
+
+
+class ShardSupervisor:
+    """
+    Принимает обновления в одном процессе и распределяет их по процессам-воркерам
+
+    Шард выбирается по хэшу chat_id, поэтому все обновления одного чата попадают
+    в один воркер и обрабатываются по порядку. Упавшие воркеры перезапускаются,
+    их очередь при этом сохраняется.
+
+    Сам супервизор не создает обработчиков и сервисов: ему нужен только бот для
+    long polling, а список типов обновлений он получает от воркеров в heartbeat.
+    """
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or WORKER_CONFIG['workers']
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [self._context.Queue(maxsize=WORKER_CONFIG['queue_size']) for _ in range(self.workers)]
+        self._status = self._context.Queue()
+        self._processes = [None] * self.workers
+        self._started_at = [0.0] * self.workers
+        self._restart_at = [0.0] * self.workers
+        self._restart_delay = [WORKER_CONFIG['restart_delay']] * self.workers
+        self._restarts = [0] * self.workers
+        self._heartbeats = {}
+        self._allowed_updates = None
+        self._dispatched = [0] * self.workers
+
+    def shard_for(self, update: dict) -> int:
+        """Номер воркера для обновления (стабильный между перезапусками)"""
+        chat_id = update_chat_id(update)
+        if chat_id is None:
+            return 0
+        return zlib.crc32(str(chat_id).encode()) % self.workers
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=run_worker,
+            args=(index, self._queues[index], self._status, WORKER_CONFIG['heartbeat_interval'], self.workers),
+            name=f"bot-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info(f"Запущен воркер {index} (pid {process.pid})")
+
+    async def dispatch(self, update: dict):
+        """Передает обновление воркеру его шарда"""
+        index = self.shard_for(update)
+        try:
+            self._queues[index].put_nowait(update)
+        except queue.Full:
+            # Воркер не успевает: ждем места, не блокируя цикл событий
+            logger.warning(f"Очередь воркера {index} переполнена, ожидаем")
+            await asyncio.get_running_loop().run_in_executor(None, self._queues[index].put, update)
+        self._dispatched[index] += 1
+
+    def _check_workers(self):
+        """Перезапускает упавших воркеров с экспоненциальной задержкой"""
+        now = time.monotonic()
+        for index, process in enumerate(self._processes):
+            if process is None or process.is_alive():
+                continue
+            if not self._restart_at[index]:
+                lived = now - self._started_at[index]
+                if lived > WORKER_CONFIG['stable_after']:
+                    self._restart_delay[index] = WORKER_CONFIG['restart_delay']
+                logger.error(f"Воркер {index} завершился с кодом {process.exitcode}, "
+                             f"перезапуск через {self._restart_delay[index]} с")
+                self._restart_at[index] = now + self._restart_delay[index]
+            elif now >= self._restart_at[index]:
+                self._restart_at[index] = 0.0
+                self._restarts[index] += 1
+                self._restart_delay[index] = min(self._restart_delay[index] * 2, WORKER_CONFIG['max_restart_delay'])
+                self._start_worker(index)
+
+    def _drain_status(self):
+        while True:
+            try:
+                heartbeat = self._status.get_nowait()
+            except queue.Empty:
+                return
+            self._heartbeats[heartbeat['worker']] = heartbeat
+            if heartbeat.get('allowed_updates') is not None:
+                self._allowed_updates = heartbeat['allowed_updates']
+
+    def health(self) -> dict:
+        """Сводное состояние всех воркеров"""
+        now = time.time()
+        workers = []
+        for index, process in enumerate(self._processes):
+            heartbeat = self._heartbeats.get(index, {})
+            age = now - heartbeat['time'] if heartbeat else None
+            workers.append({
+                'worker': index,
+                'pid': process.pid if process else None,
+                'alive': bool(process and process.is_alive()),
+                'restarts': self._restarts[index],
+                'dispatched': self._dispatched[index],
+                'processed': heartbeat.get('processed', 0),
+                'failed': heartbeat.get('failed', 0),
+                'active_chats': heartbeat.get('active_chats', 0),
+                'mailbox_depth': heartbeat.get('mailbox_depth', 0),
+                'send_queue_depth': heartbeat.get('send_queue_depth', 0),
+                'heartbeat_age': round(age, 1) if age is not None else None,
+            })
+        stale_after = WORKER_CONFIG['heartbeat_interval'] * 3
+        healthy = sum(
+            1 for worker in workers
+            if worker['alive'] and worker['heartbeat_age'] is not None and worker['heartbeat_age'] < stale_after
+        )
+        return {
+            'workers': workers,
+            'healthy': healthy,
+            'total': self.workers,
+            'processed': sum(worker['processed'] for worker in workers),
+            'failed': sum(worker['failed'] for worker in workers),
+        }
+
+    async def _monitor(self):
+        last_report = time.monotonic()
+        while True:
+            await asyncio.sleep(1.0)
+            self._drain_status()
+            self._check_workers()
+            if time.monotonic() - last_report >= WORKER_CONFIG['health_log_interval']:
+                last_report = time.monotonic()
+                health = self.health()
+                logger.info(f"Воркеры: {health['healthy']}/{health['total']} в норме, "
+                            f"обработано {health['processed']}, ошибок {health['failed']}")
+
+    async def _poll(self, bot, allowed_updates):
+        """Единая точка приема обновлений (long polling)"""
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset,
+                    timeout=WORKER_CONFIG['polling_timeout'],
+                    allowed_updates=allowed_updates,
+                )
+            except Exception as e:
+                logger.error(f"Ошибка получения обновлений: {str(e)}")
+                await asyncio.sleep(1.0)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                await self.dispatch(update.model_dump(mode='json', exclude_none=True, by_alias=True))
+
+    async def _wait_allowed_updates(self) -> list:
+        """Ждет от воркеров список типов обновлений, на которые подписан диспетчер"""
+        deadline = time.monotonic() + WORKER_CONFIG['startup_timeout']
+        while self._allowed_updates is None and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._allowed_updates is None:
+            logger.warning("Воркеры не сообщили типы обновлений, запрашиваем обновления всех типов")
+        return self._allowed_updates
+
+    async def run(self):
+        """Запускает воркеров и прием обновлений до остановки"""
+        bot = create_bot()
+        for index in range(self.workers):
+            self._start_worker(index)
+        monitor = asyncio.create_task(self._monitor())
+        logger.info(f"Бот запущен в режиме {self.workers} воркеров")
+        try:
+            # Список типов обновлений берем у того же диспетчера, что работает в воркерах
+            allowed_updates = await self._wait_allowed_updates()
+            await bot.delete_webhook(drop_pending_updates=False)
+            await self._poll(bot, allowed_updates)
+        finally:
+            monitor.cancel()
+            await bot.session.close()
+            self.stop()
+
+    def stop(self):
+        """Останавливает воркеров, давая им обработать принятые обновления"""
+        for worker_queue in self._queues:
+            try:
+                worker_queue.put_nowait(None)
+            except queue.Full:
+                pass
+        deadline = time.monotonic() + WORKER_CONFIG['shutdown_timeout']
+        for process in self._processes:
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
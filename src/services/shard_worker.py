@@ -0,0 +1,138 @@
+import os
+import time
+import queue
+import asyncio
+import logging
+from src.services.traffic_recorder import traffic_recorder
+from src.services.send_queue import send_queue
+from src.utils.loop_watchdog import LoopWatchdog
+
+logger = logging.getLogger(__name__)
+
+
+def update_chat_id(update: dict):
+    """
+    Извлекает идентификатор чата (или пользователя) из сырого обновления Telegram
+
+    Returns:
+        int: ID чата или None, если обновление не привязано к чату
+    """
+    for key, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat.get('id')
+        sender = value.get('from')
+        if sender:
+            return sender.get('id')
+    return None
+
+
+class ShardWorker:
+    """
+    Обрабатывает обновления своего шарда в отдельном процессе
+
+    Порядок обновлений внутри чата обеспечивает ChatActorMiddleware диспетчера, поэтому
+    воркер просто запускает каждое обновление отдельной задачей. Если акторы выключены,
+    воркер сам выстраивает задачи одного чата в цепочку.
+    """
+
+    def __init__(self, index: int, updates, status, heartbeat_interval: float, workers: int = 1):
+        self.index = index
+        self.workers = workers
+        self._updates = updates
+        self._status = status
+        self._heartbeat_interval = heartbeat_interval
+        self._tasks = set()
+        self._tails = {}  # chat_id -> последняя задача чата (когда акторы выключены)
+        self._chat_actors = None
+        self._allowed_updates = None
+        self.stats = {'processed': 0, 'failed': 0}
+
+    async def _handle(self, bot, dp, update: dict, previous: asyncio.Task = None):
+        if previous is not None:
+            # Ждем завершения предыдущего обновления этого чата, его ошибки нас не касаются
+            await asyncio.wait([previous])
+        try:
+            await dp.feed_raw_update(bot, update)
+            self.stats['processed'] += 1
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.error(f"Воркер {self.index}: ошибка обработки обновления {update.get('update_id')}: {str(e)}")
+
+    def _schedule(self, bot, dp, update: dict):
+        if self._chat_actors is not None and self._chat_actors.config['enabled']:
+            task = asyncio.create_task(self._handle(bot, dp, update))
+        else:
+            chat_id = update_chat_id(update)
+            task = asyncio.create_task(self._handle(bot, dp, update, self._tails.get(chat_id)))
+            self._tails[chat_id] = task
+
+            def forget(finished: asyncio.Task):
+                if self._tails.get(chat_id) is finished:
+                    del self._tails[chat_id]
+            task.add_done_callback(forget)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _heartbeat(self):
+        while True:
+            self._status.put({
+                'worker': self.index,
+                'pid': os.getpid(),
+                'time': time.time(),
+                'processed': self.stats['processed'],
+                'failed': self.stats['failed'],
+                'active_chats': len(self._chat_actors.actors) + len(self._tails) if self._chat_actors else 0,
+                'mailbox_depth': self._chat_actors.summary()['mailbox_depth'] if self._chat_actors else 0,
+                'send_queue_depth': send_queue.depth(),
+                # Типы обновлений, на которые подписан диспетчер: по ним супервизор запрашивает обновления
+                'allowed_updates': self._allowed_updates,
+            })
+            await asyncio.sleep(self._heartbeat_interval)
+
+    async def run(self):
+        # Бот и диспетчер создаются при импорте, поэтому импортируем уже внутри процесса воркера
+        from src.main import bot, dp, chat_actors
+        self._chat_actors = chat_actors
+        self._allowed_updates = dp.resolve_used_update_types()
+        # Общий лимит Telegram на бота делится между процессами-воркерами
+        send_queue.split_global_limit(self.workers)
+
+        loop = asyncio.get_running_loop()
+        heartbeat = asyncio.create_task(self._heartbeat())
+        watchdog = LoopWatchdog()
+        watchdog.start()
+        logger.info(f"Воркер {self.index} запущен (pid {os.getpid()})")
+        try:
+            while True:
+                try:
+                    update = self._updates.get_nowait()
+                except queue.Empty:
+                    # Блокирующее ожидание выносим в поток, чтобы не останавливать обработку
+                    update = await loop.run_in_executor(None, self._updates.get)
+                if update is None:
+                    break
+                self._schedule(bot, dp, update)
+
+            # Дожидаемся обработки уже принятых обновлений
+            pending = list(self._tasks)
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            heartbeat.cancel()
+            watchdog.stop()
+            traffic_recorder.close()
+            await bot.session.close()
+            logger.info(f"Воркер {self.index} остановлен")
+
+
+def run_worker(index: int, updates, status, heartbeat_interval: float, workers: int = 1):
+    """Точка входа процесса воркера"""
+    # Номер шарда задает отдельные файлы индексов и кэшей (см. shard_path)
+    os.environ['BOT_SHARD'] = str(index)
+    try:
+        asyncio.run(ShardWorker(index, updates, status, heartbeat_interval, workers).run())
+    except KeyboardInterrupt:
+        pass
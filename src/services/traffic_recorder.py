@@ -0,0 +1,189 @@
+import os
+import gzip
+import hmac
+import json
+import time
+import hashlib
+import logging
+import multiprocessing
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from src.config.config import TRAFFIC_RECORD_CONFIG
+from src.services.fast_path import FastPathMatcher
+
+logger = logging.getLogger(__name__)
+
+# Поля с идентификаторами людей и чатов заменяются стабильными псевдонимами
+_ID_FIELDS = ('id', 'user_id', 'chat_id', 'sender_chat_id')
+_STRING_ID_FIELDS = ('file_id', 'file_unique_id', 'inline_message_id', 'chat_instance', 'media_group_id',
+                     'custom_emoji_id')
+_TEXT_FIELDS = ('text', 'caption', 'query')
+# Координаты (location, venue, live location) заменяются нулями
+_COORDINATE_FIELDS = ('latitude', 'longitude')
+# Строки, которые сохраняются как есть: служебные значения без личных данных.
+# Любая другая строка (имена, адреса, вопросы опросов, ссылки, описания) маскируется
+_KEPT_STRING_FIELDS = ('type', 'mime_type', 'language_code', 'language', 'emoji', 'status')
+
+
+def mask_text(text: str) -> str:
+    """
+    Маскирует текст, сохраняя его форму: длину, алфавит, регистр, цифры и пунктуацию
+
+    Длина и алфавит влияют на оценку токенов и разбиение ответа на части,
+    поэтому воспроизведение остается реалистичным без исходного содержимого.
+    """
+    masked = []
+    for char in text:
+        if char.isalpha():
+            letter = 'ж' if 'Ѐ' <= char <= 'ӿ' else 'x'
+            masked.append(letter.upper() if char.isupper() else letter)
+        elif char.isdigit():
+            masked.append('0')
+        else:
+            masked.append(char)
+    return ''.join(masked)
+
+
+class TrafficRecorder:
+    """
+    Записывает входящие обновления и параметры ответов Gemini в сжатый JSONL
+
+    Записи двух видов:
+        {"t": время, "k": "u", "u": обновление} — обновление Telegram после анонимизации
+        {"t": время, "k": "g", "type": ..., "lat": ..., "chars": ..., "pt": ..., "ot": ...} — запрос к модели
+    """
+
+    def __init__(self, path: str = None, config: dict = None):
+        self.config = config or TRAFFIC_RECORD_CONFIG
+        path = path or self.config['path']
+        if path and multiprocessing.parent_process() is not None:
+            # Воркеры многопроцессного режима пишут каждый в свой файл
+            base, ext = (path[:-len('.jsonl.gz')], '.jsonl.gz') if path.endswith('.jsonl.gz') else os.path.splitext(path)
+            path = f"{base}-{os.getpid()}{ext}"
+        self.path = path
+        self._salt = (self.config['salt'] or os.urandom(16).hex()).encode()
+        self._file = None
+        self._pending = 0
+        # Приветствия и частые вопросы не содержат личных данных, а от них зависит быстрый путь
+        self._fast_path = FastPathMatcher()
+        self.stats = {'updates': 0, 'generations': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _pseudonym(self, value) -> int:
+        digest = hmac.new(self._salt, str(value).encode(), hashlib.sha256).digest()
+        pseudonym = int.from_bytes(digest[:6], 'big')
+        return -pseudonym if isinstance(value, int) and value < 0 else pseudonym
+
+    def _file_pseudonym(self, value: str) -> str:
+        return hmac.new(self._salt, value.encode(), hashlib.sha256).hexdigest()[:24]
+
+    def anonymize(self, value, key: str = None):
+        """
+        Рекурсивно заменяет персональные данные в обновлении
+
+        Строки сохраняются только для служебных полей из списка разрешенных,
+        поэтому новые поля Telegram по умолчанию маскируются.
+        """
+        if isinstance(value, dict):
+            return {item_key: self.anonymize(item, item_key) for item_key, item in value.items()}
+        if isinstance(value, list):
+            return [self.anonymize(item, key) for item in value]
+        if key in _ID_FIELDS and isinstance(value, int):
+            return self._pseudonym(value)
+        if key in _COORDINATE_FIELDS and isinstance(value, (int, float)):
+            return 0.0
+        if not isinstance(value, str):
+            return value
+        if key in _ID_FIELDS or key in _STRING_ID_FIELDS:
+            return self._file_pseudonym(value)
+        if key == 'file_name':
+            return 'file' + os.path.splitext(value)[1]
+        if key in _TEXT_FIELDS:
+            if value in self.config['keep_texts'] or self._fast_path.lookup(value)[0] is not None:
+                return value
+            if value.startswith('/'):
+                # Команду сохраняем, аргументы маскируем
+                command, _, rest = value.partition(' ')
+                return f"{command} {mask_text(rest)}" if rest else command
+            return mask_text(value)
+        if key in _KEPT_STRING_FIELDS:
+            return value
+        return mask_text(value)
+
+    def _write(self, record: dict):
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Режим дозаписи создает новый gzip-поток в том же файле, gzip.open читает их подряд
+            self._file = gzip.open(self.path, 'at', encoding='utf-8')
+            logger.info(f"Запись трафика в {self.path}")
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self._pending += 1
+        if self._pending >= self.config['flush_every']:
+            self._file.flush()
+            self._pending = 0
+
+    def record_update(self, update: dict):
+        self.stats['updates'] += 1
+        self._write({'t': round(time.time(), 3), 'k': 'u', 'u': self.anonymize(update)})
+
+    def record_generation(self, request_type: str, latency: float, response_chars: int,
+                          prompt_tokens: int = None, output_tokens: int = None):
+        self.stats['generations'] += 1
+        self._write({
+            't': round(time.time(), 3), 'k': 'g', 'type': request_type, 'lat': round(latency, 3),
+            'chars': response_chars, 'pt': prompt_tokens, 'ot': output_tokens,
+        })
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class TrafficRecorderMiddleware(BaseMiddleware):
+    """Внешний middleware обновлений: записывает каждое обновление до обработки"""
+
+    def __init__(self, recorder: TrafficRecorder):
+        self.recorder = recorder
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(event, Update):
+            try:
+                self.recorder.record_update(event.model_dump(mode='json', exclude_none=True, by_alias=True))
+            except Exception as e:
+                logger.error(f"Не удалось записать обновление: {str(e)}")
+        return await handler(event, data)
+
+
+def load_records(paths) -> list:
+    """Читает записи из одного или нескольких файлов (например, от разных воркеров) в порядке времени"""
+    records = []
+    for path in paths:
+        with gzip.open(path, 'rt', encoding='utf-8') as source:
+            try:
+                for line in source:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Последняя строка могла быть оборвана при аварийном завершении
+                        continue
+            except EOFError:
+                # Процесс завершился, не закрыв файл: берем все, что успело записаться
+                logger.warning(f"Файл трафика {path} обрывается, прочитано записей: {len(records)}")
+    records.sort(key=lambda record: record['t'])
+    return records
+
+
+# Общий регистратор процесса (выключен, если не задан TRAFFIC_RECORD_PATH)
+traffic_recorder = TrafficRecorder()
@@ -0,0 +1,297 @@
+import time
+import asyncio
+import logging
+import datetime
+from collections import Counter, defaultdict, deque
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage, EditMessageText, GetFile, AnswerInlineQuery
+from aiogram.types import Chat, File, Message
+from src.services.degradation import degradation
+from src.services.shard_worker import update_chat_id
+
+logger = logging.getLogger(__name__)
+
+# Ответы с этими фрагментами считаются сообщениями об ошибке
+_ERROR_MARKERS = ('произошла ошибка', 'не удалось проанализировать')
+
+# Токен для локального бота воспроизведения (запросы в Telegram не отправляются)
+REPLAY_TOKEN = '123456:replay'
+
+
+def _percentiles(values: list) -> dict:
+    values = sorted(values)
+    if not values:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+
+    def percentile(share: float) -> float:
+        return round(values[min(len(values) - 1, int(share * len(values)))], 4)
+
+    return {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99), 'max': round(values[-1], 4)}
+
+
+class FakeTelegramSession(BaseSession):
+    """
+    Локальная замена HTTP-сессии Bot API
+
+    Отвечает на методы правдоподобными объектами, отдает файлы записанного размера
+    и замеряет, когда пользователь увидел первый ответ на свое обновление.
+    """
+
+    def __init__(self, latency: float = 0.0, file_sizes: dict = None):
+        super().__init__()
+        self.latency = latency
+        self.file_sizes = file_sizes or {}
+        self.calls = Counter()
+        self.error_replies = 0
+        self.first_response_latencies = []
+        self._waiting = defaultdict(deque)  # chat_id -> моменты поступления обновлений без ответа
+        self._message_id = 0
+
+    def expect_response(self, chat_id, received_at: float):
+        if chat_id is not None:
+            self._waiting[chat_id].append(received_at)
+
+    def _on_output(self, chat_id, text: str):
+        waiting = self._waiting.get(chat_id)
+        if waiting:
+            self.first_response_latencies.append(time.monotonic() - waiting.popleft())
+        if text and any(marker in text.lower() for marker in _ERROR_MARKERS):
+            self.error_replies += 1
+
+    def _message(self, bot: Bot, chat_id, text: str, message_id: int = None) -> Message:
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        message = Message(
+            message_id=message_id,
+            date=datetime.datetime.now(),
+            chat=Chat(id=chat_id, type='private'),
+            text=text,
+        )
+        return message.as_(bot)
+
+    async def make_request(self, bot: Bot, method, timeout: int = None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, SendMessage):
+            self._on_output(method.chat_id, method.text)
+            return self._message(bot, method.chat_id, method.text)
+        if isinstance(method, EditMessageText):
+            self._on_output(method.chat_id, method.text)
+            return self._message(bot, method.chat_id, method.text, method.message_id)
+        if isinstance(method, AnswerInlineQuery):
+            self._on_output(('inline', method.inline_query_id), None)
+            return True
+        if isinstance(method, GetFile):
+            size = self.file_sizes.get(method.file_id, 1024)
+            return File(file_id=method.file_id, file_unique_id=method.file_id,
+                        file_size=size, file_path=f"replay/{method.file_id}").as_(bot)
+        return True
+
+    async def stream_content(self, url: str, headers: dict = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True):
+        remaining = self.file_sizes.get(url.rsplit('/', 1)[-1], 1024)
+        while remaining > 0:
+            size = min(chunk_size, remaining)
+            remaining -= size
+            yield bytes(size)
+
+    async def close(self):
+        pass
+
+
+class FakeGeminiService:
+    """
+    Замена GeminiService с записанными задержками и размерами ответов
+
+    Для каждого типа запроса записанные наблюдения перебираются по кругу,
+    поэтому распределение задержек совпадает с реальным.
+    """
+
+    _SENTENCE = 'Это предложение ответа модели. '
+
+    def __init__(self, generations: list, speed: float = 1.0):
+        self.speed = speed
+        self.samples = defaultdict(list)
+        for record in generations:
+            self.samples[record['type']].append((record['lat'], record.get('chars') or 0))
+        self._cursors = Counter()
+        self.calls = Counter()
+        # Кэш ответов при воспроизведении не используется (/cache отвечает, что он отключен)
+        self.semantic_cache = None
+
+    async def _respond(self, request_type: str) -> str:
+        samples = self.samples.get(request_type) or self.samples.get('text') or [(1.0, 500)]
+        latency, chars = samples[self._cursors[request_type] % len(samples)]
+        self._cursors[request_type] += 1
+        self.calls[request_type] += 1
+        # Учитываем запрос в контроллере деградации так же, как настоящий сервис
+        with degradation.generation():
+            await asyncio.sleep(latency / self.speed if self.speed > 0 else 0)
+        text = self._SENTENCE * (chars // len(self._SENTENCE) + 1)
+        return text[:max(1, chars)]
+
+    async def generate_response(self, text: str, chat_id: int = None) -> str:
+        return await self._respond('text')
+
+    async def analyze_image(self, image_data: bytes, prompt: str = None) -> str:
+        return await self._respond('image')
+
+    async def analyze_file(self, file_data: bytes, file_name: str, kind: str = None) -> str:
+        return await self._respond('file')
+
+    async def analyze_audio(self, audio_data: bytes, mime_type: str, prompt: str) -> str:
+        return await self._respond('audio')
+
+    async def generate_inline_answer(self, text: str) -> str:
+        return await self._respond('inline')
+
+    def flush(self):
+        pass
+
+    def get_stats(self) -> dict:
+        return {'calls': dict(self.calls)}
+
+
+def _file_sizes(updates: list) -> dict:
+    """Собирает размеры файлов из обновлений, чтобы отдавать данные того же объема"""
+    sizes = {}
+
+    def walk(value):
+        if isinstance(value, dict):
+            if 'file_id' in value and 'file_size' in value:
+                sizes[value['file_id']] = value['file_size']
+            for item in value.values():
+                walk(item)
+        elif isinstance(value, list):
+            for item in value:
+                walk(item)
+
+    for update in updates:
+        walk(update)
+    return sizes
+
+
+class TrafficReplayer:
+    """
+    Воспроизводит записанный трафик через настоящие Dispatcher и MessageHandler
+
+    Обновления подаются с записанными интервалами, деленными на speed (0 — без пауз),
+    задержки Gemini масштабируются так же. Паузы самих обработчиков не масштабируются:
+    они часть проверяемого кода.
+    """
+
+    def __init__(self, records: list, speed: float = 1.0, telegram_latency: float = 0.0):
+        self.updates = [record for record in records if record['k'] == 'u']
+        self.generations = [record for record in records if record['k'] == 'g']
+        self.speed = speed
+        self.telegram_latency = telegram_latency
+        self._handling_latencies = []
+        self._exceptions = 0
+
+    async def _handle(self, bot: Bot, dp, session: FakeTelegramSession, update: dict):
+        received_at = time.monotonic()
+        # Ответ на inline-запрос приходит не в чат, а по идентификатору запроса
+        inline_query = update.get('inline_query')
+        response_key = ('inline', inline_query['id']) if inline_query else update_chat_id(update)
+        session.expect_response(response_key, received_at)
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            self._exceptions += 1
+            logger.error(f"Ошибка обработки обновления {update.get('update_id')}: {str(e)}")
+        self._handling_latencies.append(time.monotonic() - received_at)
+
+    async def run(self) -> dict:
+        """
+        Прогоняет записанные обновления
+
+        Returns:
+            dict: Отчет о прогоне (см. compare_reports)
+        """
+        # Диспетчер с зарегистрированными обработчиками создается при импорте
+        from src.main import dp, message_handler, inline_handler
+
+        session = FakeTelegramSession(self.telegram_latency, _file_sizes(r['u'] for r in self.updates))
+        bot = Bot(token=REPLAY_TOKEN, session=session)
+        gemini = FakeGeminiService(self.generations, self.speed)
+        message_handler.gemini_service = gemini
+        inline_handler.gemini_service = gemini
+
+        if not self.updates:
+            raise ValueError("В записи нет обновлений для воспроизведения")
+        logger.info(f"Воспроизведение {len(self.updates)} обновлений, скорость {self.speed or 'максимальная'}")
+
+        first_time = self.updates[0]['t']
+        started = time.monotonic()
+        tasks = []
+        for record in self.updates:
+            if self.speed > 0:
+                delay = (record['t'] - first_time) / self.speed - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self._handle(bot, dp, session, record['u'])))
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+
+        return {
+            'updates': len(self.updates),
+            'speed': self.speed,
+            'elapsed': round(elapsed, 3),
+            'throughput': round(len(self.updates) / elapsed, 2) if elapsed > 0 else 0.0,
+            'handling_latency': _percentiles(self._handling_latencies),
+            'first_response_latency': _percentiles(session.first_response_latencies),
+            'unanswered': len(self.updates) - len(session.first_response_latencies),
+            'telegram_calls': dict(session.calls),
+            'gemini_calls': dict(gemini.calls),
+            'error_replies': session.error_replies,
+            'exceptions': self._exceptions,
+            'degradation': degradation.summary(),
+        }
+
+
+# Метрики сравнения: (путь в отчете, подпись); для всех меньшее значение лучше
+_COMPARED_METRICS = (
+    (('handling_latency', 'p50'), 'Обработка p50, с'),
+    (('handling_latency', 'p95'), 'Обработка p95, с'),
+    (('handling_latency', 'p99'), 'Обработка p99, с'),
+    (('first_response_latency', 'p50'), 'Первый ответ p50, с'),
+    (('first_response_latency', 'p95'), 'Первый ответ p95, с'),
+    (('telegram_calls', None), 'Вызовов Bot API'),
+    (('unanswered',), 'Без ответа'),
+    (('error_replies',), 'Ответов с ошибкой'),
+    (('exceptions',), 'Исключений'),
+    (('degradation', 'max_loop_lag'), 'Макс. задержка цикла, с'),
+)
+
+
+def _metric(report: dict, path: tuple) -> float:
+    value = report.get(path[0], 0)
+    if len(path) > 1:
+        value = sum(value.values()) if path[1] is None else value.get(path[1], 0)
+    return float(value or 0)
+
+
+def compare_reports(baseline: dict, candidate: dict, threshold: float = 0.1) -> dict:
+    """
+    Сравнивает два прогона и отмечает ухудшения
+
+    Args:
+        baseline: Отчет эталонного прогона
+        candidate: Отчет проверяемого прогона
+        threshold: Допустимый относительный рост метрики
+
+    Returns:
+        dict: rows (метрика, было, стало, изменение, ухудшение) и regressions
+    """
+    rows = []
+    for path, title in _COMPARED_METRICS:
+        before, after = _metric(baseline, path), _metric(candidate, path)
+        change = (after - before) / before if before else (0.0 if after == before else float('inf'))
+        # Абсолютный допуск не дает шуму около нуля считаться ухудшением
+        regression = after > before * (1 + threshold) and after - before > 0.005
+        rows.append({'metric': title, 'baseline': before, 'candidate': after,
+                     'change': change, 'regression': regression})
+    return {'rows': rows, 'regressions': [row['metric'] for row in rows if row['regression']]}
@@ -0,0 +1,135 @@
+import io
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+import google.generativeai as genai
+from src.config.config import UPLOAD_CONFIG
+from src.utils.file_utils import sniff_mime_type
+
+logger = logging.getLogger(__name__)
+
+
+class UploadManager:
+    """
+    Загружает медиа в Gemini File API из памяти и переиспользует уже загруженные файлы
+
+    Индекс хранит соответствие хэша содержимого и удаленного файла с учетом
+    срока его жизни на сервере, поэтому повторное изображение не загружается заново.
+    Файлы доступны только проекту загрузившего их ключа, поэтому индекс ведется по ключам.
+    """
+
+    def __init__(self):
+        self._index = OrderedDict()  # (ключ, sha256) -> (файл, момент истечения по time.time())
+        self._pending = {}  # (ключ, sha256) -> Future загрузки, которая уже выполняется
+        self.stats = {'uploads': 0, 'reused': 0, 'expired': 0}
+
+    @staticmethod
+    def content_hash(data: bytes, slot=None) -> tuple:
+        return (slot.key_id if slot is not None else None), hashlib.sha256(data).hexdigest()
+
+    def _lookup(self, digest: str):
+        """Возвращает действующий файл из индекса или None"""
+        entry = self._index.get(digest)
+        if entry is None:
+            return None
+        remote_file, expires_at = entry
+        if time.time() >= expires_at - UPLOAD_CONFIG['expiry_margin']:
+            # Файл скоро удалится на сервере, загрузим заново
+            del self._index[digest]
+            self.stats['expired'] += 1
+            return None
+        self._index.move_to_end(digest)
+        return remote_file
+
+    def _remember(self, digest: str, remote_file):
+        expiration = getattr(remote_file, 'expiration_time', None)
+        expires_at = expiration.timestamp() if expiration is not None else 0
+        if expires_at <= time.time():
+            # Сервер не сообщил срок жизни, используем значение по умолчанию
+            expires_at = time.time() + UPLOAD_CONFIG['default_ttl']
+        self._index[digest] = (remote_file, expires_at)
+        self._index.move_to_end(digest)
+        while len(self._index) > UPLOAD_CONFIG['max_entries']:
+            self._index.popitem(last=False)
+
+    def invalidate(self, data: bytes, slot=None):
+        """Удаляет файл из индекса (например, если сервер перестал его находить)"""
+        self._index.pop(self.content_hash(data, slot), None)
+
+    async def get_or_upload(self, data: bytes, mime_type: str = None, slot=None):
+        """
+        Возвращает ссылку на файл в Gemini, загружая его только при необходимости
+
+        Args:
+            data: Содержимое файла
+            mime_type: MIME-тип (по умолчанию определяется по содержимому)
+            slot: API-ключ из пула, от имени которого загружается файл
+
+        Returns:
+            File: Объект файла для передачи в generate_content
+        """
+        digest = self.content_hash(data, slot)
+        while True:
+            remote_file = self._lookup(digest)
+            if remote_file is not None:
+                self.stats['reused'] += 1
+                logger.info(f"Используем ранее загруженный файл {remote_file.name}")
+                return remote_file
+
+            # Одинаковые файлы, пришедшие одновременно, загружаются один раз
+            pending = self._pending.get(digest)
+            if pending is None:
+                break
+            try:
+                result = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                # Отменили задачу, которая выполняла загрузку, а не нас: первый из ожидающих начнет ее заново
+                logger.info("Загрузка файла отменена вызвавшим ее запросом, повторяем для ожидающих")
+                continue
+            self.stats['reused'] += 1
+            return result
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[digest] = future
+        try:
+            remote_file = await self._upload(data, mime_type or sniff_mime_type(data, 'application/octet-stream'), slot)
+            self._remember(digest, remote_file)
+            future.set_result(remote_file)
+            return remote_file
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано вызывающему, ожидающие получат его через future
+            future.exception()
+            raise
+        finally:
+            del self._pending[digest]
+
+    async def _upload(self, data: bytes, mime_type: str, slot=None):
+        """Загружает файл из буфера в отдельном потоке и дожидается его готовности"""
+        upload_file = slot.upload_file if slot is not None else genai.upload_file
+        get_file = slot.get_file if slot is not None else genai.get_file
+
+        started = time.monotonic()
+        remote_file = await asyncio.to_thread(upload_file, io.BytesIO(data), mime_type=mime_type)
+        self.stats['uploads'] += 1
+
+        # Крупные медиа обрабатываются сервером некоторое время
+        deadline = started + UPLOAD_CONFIG['processing_timeout']
+        while remote_file.state.name == 'PROCESSING':
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Файл {remote_file.name} не обработан сервером вовремя")
+            await asyncio.sleep(UPLOAD_CONFIG['processing_poll_interval'])
+            remote_file = await asyncio.to_thread(get_file, remote_file.name)
+        if remote_file.state.name == 'FAILED':
+            raise ValueError(f"Сервер не смог обработать файл {remote_file.name}")
+
+        logger.info(f"Файл загружен: {remote_file.name} ({len(data)} байт, {mime_type}) "
+                    f"за {time.monotonic() - started:.2f} с")
+        return remote_file
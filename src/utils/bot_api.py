@@ -0,0 +1,147 @@
+import time
+import asyncio
+import logging
+from contextlib import aclosing
+from pathlib import Path
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer, SimpleFilesPathWrapper
+from src.config.config import TELEGRAM_API_CONFIG, TELEGRAM_TOKEN
+from src.utils.file_utils import read_file_mmap, read_file_head
+
+logger = logging.getLogger(__name__)
+
+
+def create_bot_session(config: dict = None) -> AiohttpSession:
+    """
+    Создает HTTP-сессию бота с настраиваемым сервером Bot API и пулом соединений
+
+    Если задан TELEGRAM_API_URL, запросы идут на собственный сервер telegram-bot-api.
+    В режиме --local сервер отдает абсолютные пути к файлам, а бот читает их с общего диска.
+    """
+    config = config or TELEGRAM_API_CONFIG
+    kwargs = {'limit': config['connection_limit'], 'timeout': config['request_timeout']}
+    if config['base_url']:
+        wrap_local_file = None
+        if config['server_files_dir'] and config['local_files_dir']:
+            # Каталог сервера смонтирован у бота по другому пути (например, в другом контейнере)
+            wrap_local_file = SimpleFilesPathWrapper(
+                Path(config['server_files_dir']), Path(config['local_files_dir'])
+            )
+        api_kwargs = {'is_local': config['is_local']}
+        if wrap_local_file is not None:
+            api_kwargs['wrap_local_file'] = wrap_local_file
+        kwargs['api'] = TelegramAPIServer.from_base(config['base_url'], **api_kwargs)
+        logger.info(f"Используется сервер Bot API {config['base_url']} (локальный режим: {config['is_local']})")
+    return AiohttpSession(**kwargs)
+
+
+def create_bot() -> Bot:
+    """Создает бота с сессией из конфигурации и разметкой MarkdownV2 по умолчанию"""
+    return Bot(
+        token=TELEGRAM_TOKEN,
+        session=create_bot_session(),  # Сервер Bot API и размер пула соединений берутся из конфигурации
+        default=DefaultBotProperties(parse_mode="MarkdownV2"),
+    )
+
+
+async def download_file_data(bot: Bot, file_id: str) -> bytes:
+    """
+    Получает содержимое файла из Telegram
+
+    С локальным сервером Bot API файл читается напрямую с диска через mmap,
+    иначе скачивается по HTTP (ограничение стандартного API — 20 МБ).
+
+    Args:
+        bot: Экземпляр бота
+        file_id: Идентификатор файла
+
+    Returns:
+        bytes: Содержимое файла
+    """
+    started = time.monotonic()
+    file = await bot.get_file(file_id)
+    api = bot.session.api
+    if api.is_local:
+        # Локальный сервер отдает путь на своем диске; при другом пути монтирования он пересчитывается
+        path = api.wrap_local_file.to_local(file.file_path)
+        data = await asyncio.to_thread(read_file_mmap, str(path))
+        logger.info(f"Файл прочитан с диска сервера Bot API: {len(data)} байт за {time.monotonic() - started:.3f} с")
+        return data
+
+    buffer = await bot.download_file(file.file_path)
+    data = buffer.read()
+    logger.info(f"Файл скачан по HTTP: {len(data)} байт за {time.monotonic() - started:.3f} с")
+    return data
+
+
+async def iter_file_chunks(bot: Bot, file_id: str, chunk_size: int = 65536):
+    """
+    Отдает содержимое файла из Telegram частями по мере скачивания
+
+    Позволяет обрабатывать файл (например, перекодировать) параллельно с загрузкой,
+    не дожидаясь конца скачивания.
+
+    Args:
+        bot: Экземпляр бота
+        file_id: Идентификатор файла
+        chunk_size: Размер части в байтах
+
+    Yields:
+        bytes: Очередная часть файла
+    """
+    file = await bot.get_file(file_id)
+    api = bot.session.api
+    if api.is_local:
+        path = api.wrap_local_file.to_local(file.file_path)
+        data = memoryview(await asyncio.to_thread(read_file_mmap, str(path)))
+        for offset in range(0, len(data), chunk_size):
+            yield bytes(data[offset:offset + chunk_size])
+        return
+
+    async for chunk in bot.session.stream_content(
+        url=api.file_url(bot.token, file.file_path),
+        timeout=TELEGRAM_API_CONFIG['request_timeout'],
+        chunk_size=chunk_size,
+        raise_for_status=True,
+    ):
+        yield chunk
+
+
+async def download_file_head(bot: Bot, file_id: str, size: int) -> bytes:
+    """
+    Получает только начало файла из Telegram
+
+    С локальным сервером Bot API читаются первые байты с диска, иначе выполняется
+    запрос с заголовком Range; если сервер его игнорирует, соединение закрывается
+    после первой части ответа.
+
+    Args:
+        bot: Экземпляр бота
+        file_id: Идентификатор файла
+        size: Сколько байт нужно
+
+    Returns:
+        bytes: Первые size байт файла (меньше, если файл короче)
+    """
+    file = await bot.get_file(file_id)
+    api = bot.session.api
+    if api.is_local:
+        path = api.wrap_local_file.to_local(file.file_path)
+        return await asyncio.to_thread(read_file_head, str(path), size)
+
+    head = b''
+    stream = bot.session.stream_content(
+        url=api.file_url(bot.token, file.file_path),
+        headers={'Range': f'bytes=0-{size - 1}'},
+        timeout=TELEGRAM_API_CONFIG['request_timeout'],
+        chunk_size=size,
+        raise_for_status=True,
+    )
+    async with aclosing(stream):
+        async for chunk in stream:
+            head += chunk
+            if len(head) >= size:
+                break
+    return head[:size]
@@ -0,0 +1,165 @@
+import os
+import mmap
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: блокировка между процессами недоступна
+    fcntl = None
+
+# Сигнатуры (magic bytes) распространенных форматов
+_MAGIC_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+    (b'%PDF-', 'application/pdf'),
+    (b'OggS', 'audio/ogg'),
+    (b'ID3', 'audio/mpeg'),
+    (b'fLaC', 'audio/flac'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'MZ', 'application/x-msdownload'),
+    (b'\x7fELF', 'application/x-executable'),
+)
+
+
+def sniff_mime_type(data: bytes, default: str = None) -> str:
+    """
+    Определяет MIME-тип по первым байтам содержимого
+
+    Args:
+        data: Содержимое файла или его начало (достаточно 16 байт)
+        default: Значение, если формат не распознан
+
+    Returns:
+        str: MIME-тип или default
+    """
+    head = bytes(data[:16])
+    for signature, mime_type in _MAGIC_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'audio/wav'
+    return default
+
+
+def decode_text(data: bytes) -> tuple:
+    """
+    Декодирует байты как текст, перебирая распространенные кодировки
+
+    Returns:
+        tuple: (текст, кодировка)
+    """
+    for encoding in ('utf-8', 'cp1251'):
+        try:
+            return data.decode(encoding), encoding
+        except UnicodeDecodeError:
+            continue
+    # latin-1 декодирует любые байты
+    return data.decode('latin-1'), 'latin-1'
+
+
+def looks_binary(data: bytes) -> bool:
+    """Похоже ли содержимое на бинарные данные (есть нулевые байты в начале)"""
+    return b'\x00' in data[:1024]
+
+
+def read_file_mmap(path: str) -> bytes:
+    """
+    Читает файл через отображение в память
+
+    Используется для файлов, которые локальный сервер Bot API уже сохранил на общий диск:
+    страницы берутся прямо из кэша ОС, без HTTP-загрузки и промежуточных буферов.
+
+    Args:
+        path: Путь к файлу
+
+    Returns:
+        bytes: Содержимое файла
+    """
+    with open(path, 'rb') as source:
+        size = os.fstat(source.fileno()).st_size
+        if size == 0:
+            # Пустой файл нельзя отобразить в память
+            return b''
+        with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            return mapped[:]
+
+
+def read_file_head(path: str, size: int) -> bytes:
+    """Читает первые size байт файла (для определения формата без чтения целиком)"""
+    with open(path, 'rb') as source:
+        return source.read(size)
+
+
+def write_file_atomic(path: str, data: bytes):
+    """
+    Атомарно заменяет файл новым содержимым
+
+    Данные пишутся в уникальный временный файл в том же каталоге и переименовываются
+    поверх целевого, поэтому одновременные сохранения не портят друг другу файл,
+    а читатель всегда видит целиком записанную версию.
+
+    Args:
+        path: Путь к файлу
+        data: Новое содержимое
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def shard_path(path: str) -> str:
+    """
+    Путь к файлу состояния текущего процесса
+
+    В многопроцессном режиме воркер получает номер шарда в BOT_SHARD, и каждый шард
+    хранит свои индексы и кэши в отдельном файле (data/cache.npz -> data/cache.shard1.npz).
+    Номер шарда стабилен между перезапусками, поэтому воркер загружает то, что сохранил
+    его предшественник, а воркеры не перезаписывают файлы друг друга.
+    """
+    shard = os.getenv('BOT_SHARD')
+    if not path or shard is None:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.shard{shard}{ext}"
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Блокировка между процессами на время чтения-изменения-записи общего файла
+
+    Args:
+        path: Путь к файлу блокировки (создается при необходимости)
+    """
+    if fcntl is None:
+        yield
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,120 @@
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from src.config.config import LOGGING_CONFIG
+from src.utils.rate_limit import TokenBucket
+
+# Стандартные атрибуты LogRecord; все остальные попадают в JSON как дополнительные поля
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись как одну JSON-строку со всеми дополнительными полями"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                payload[key] = value
+        if record.exc_info:
+            payload['exception'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Прореживает частые события по полю event (передается через extra)
+
+    sampling задает долю записей, которые сохраняются, rate_limits — максимум
+    записей события в секунду. Предупреждения и ошибки не прореживаются.
+    """
+
+    def __init__(self, sampling: dict = None, rate_limits: dict = None):
+        super().__init__()
+        self.sampling = sampling or {}
+        self.buckets = {event: TokenBucket(rate) for event, rate in (rate_limits or {}).items()}
+        self.dropped = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, 'event', None)
+        if event is None or record.levelno >= logging.WARNING:
+            return True
+        rate = self.sampling.get(event)
+        keep = rate is None or random.random() < rate
+        bucket = self.buckets.get(event)
+        if keep and bucket is not None:
+            keep = bucket.try_acquire()
+        if not keep:
+            self.dropped[event] = self.dropped.get(event, 0) + 1
+        return keep
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Передает записи в фоновый поток без форматирования в вызывающем коде
+
+    Очередь работает внутри процесса, поэтому запись не нужно готовить к pickle:
+    сообщение собирается из msg и args уже в потоке QueueListener. При
+    переполнении очереди запись отбрасывается, а не блокирует обработку запросов.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(config: dict = None):
+    """
+    Настраивает асинхронное логирование через QueueHandler/QueueListener
+
+    Args:
+        config: Настройки (по умолчанию LOGGING_CONFIG)
+
+    Returns:
+        QueueListener: Запущенный обработчик очереди
+    """
+    global _listener
+    config = config or LOGGING_CONFIG
+    if _listener is not None:
+        return _listener
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if config.get('json'):
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(config['format']))
+
+    log_queue = queue.Queue(maxsize=config.get('queue_size', 0))
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(config.get('sampling'), config.get('rate_limits')))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(config['level'])
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter
+from src.config.config import LOOP_WATCHDOG_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Кадры из кода проекта (а не библиотек) точнее указывают на виновника блокировки
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _is_project_frame(filename: str) -> bool:
+    return filename.startswith(_PROJECT_ROOT) and 'site-packages' not in filename \
+        and not filename.endswith('loop_watchdog.py')
+
+
+class LoopWatchdog:
+    """
+    Обнаруживает блокировки цикла событий и указывает на блокирующий код
+
+    Цикл событий каждые interval секунд ставит отметку (callback через call_later,
+    без отдельной задачи). Фоновый поток проверяет свежесть отметки и, если цикл не
+    отвечает дольше threshold, снимает стек потока цикла через sys._current_frames.
+    Пока блокировка длится, стек снимается на каждой проверке; в отчет попадает
+    функция проекта, чаще всего встречавшаяся в снимках, и длительность блокировки.
+    В спокойном состоянии стоимость — одна отметка и одно пробуждение потока на интервал.
+    """
+
+    def __init__(self, config: dict = None):
+        self.config = config or LOOP_WATCHDOG_CONFIG
+        self._loop = None
+        self._loop_thread_id = None
+        self._handle = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._last_beat = time.monotonic()
+        self.stats = {'stalls': 0, 'max_stall': 0.0, 'total_stall': 0.0}
+        self.offenders = Counter()  # функция -> суммарное время блокировки
+
+    def start(self):
+        """Запускает сторожа для текущего цикла событий"""
+        if not self.config['enabled'] or self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat()
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+        logger.info(f"Сторож цикла событий запущен (порог {self.config['threshold']} с)")
+
+    def stop(self):
+        self._stopped.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def _beat(self):
+        self._last_beat = time.monotonic()
+        self._handle = self._loop.call_later(self.config['interval'], self._beat)
+
+    def _sample(self) -> tuple:
+        """
+        Снимает стек потока цикла событий
+
+        Returns:
+            tuple: (функция-виновник в виде 'файл:строка функция', кадры стека)
+        """
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None, []
+        stack = traceback.extract_stack(frame)
+        culprit = next((entry for entry in reversed(stack) if _is_project_frame(entry.filename)), stack[-1])
+        location = f"{os.path.relpath(culprit.filename, _PROJECT_ROOT)}:{culprit.lineno} {culprit.name}"
+        return location, stack
+
+    def _watch(self):
+        interval = self.config['interval']
+        threshold = self.config['threshold']
+        check_every = min(interval, threshold) / 2
+        samples = Counter()
+        first_stack = None
+        stall_started = None
+        reported_early = False
+
+        while not self._stopped.wait(check_every):
+            beat = self._last_beat
+            lag = time.monotonic() - beat - interval
+            if lag > threshold:
+                if stall_started is None:
+                    stall_started = beat + interval
+                    samples.clear()
+                    reported_early = False
+                location, stack = self._sample()
+                if location:
+                    samples[location] += 1
+                    if first_stack is None:
+                        first_stack = stack
+                if not reported_early and lag > self.config['report_after']:
+                    reported_early = True
+                    logger.error(f"Цикл событий заблокирован уже {lag:.2f} с, сейчас выполняется: {location}\n"
+                                 f"{self._format_stack(stack)}")
+            elif stall_started is not None:
+                # Отметка снова свежая — блокировка закончилась, сообщаем итог
+                duration = beat - stall_started
+                self._report(duration, samples, first_stack)
+                stall_started = None
+                first_stack = None
+
+    def _format_stack(self, stack) -> str:
+        return ''.join(traceback.format_list(stack[-self.config['stack_depth']:])).rstrip()
+
+    def _report(self, duration: float, samples: Counter, stack):
+        self.stats['stalls'] += 1
+        self.stats['total_stall'] += duration
+        self.stats['max_stall'] = max(self.stats['max_stall'], duration)
+        if not samples:
+            logger.warning(f"Цикл событий был заблокирован на {duration:.2f} с (стек снять не удалось)")
+            return
+        culprit, hits = samples.most_common(1)[0]
+        self.offenders[culprit] += duration
+        logger.warning(f"Цикл событий был заблокирован на {duration:.2f} с: {culprit} "
+                       f"({hits} из {sum(samples.values())} снимков)\n{self._format_stack(stack or [])}")
+
+    def summary(self) -> dict:
+        return {
+            **{key: round(value, 3) if isinstance(value, float) else value for key, value in self.stats.items()},
+            'top_offenders': [(location, round(seconds, 3)) for location, seconds in self.offenders.most_common(5)],
+        }
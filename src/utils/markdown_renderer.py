@@ -0,0 +1,290 @@
+import re
+
+# Символы, которые MarkdownV2 требует экранировать вне сущностей
+_MARKDOWN_V2_SPECIAL = '_*[]()~`>#+-=|{}.!\\'
+
+# Начало строки: заголовок, цитата, элемент списка, разделитель, ограничитель блока кода
+_HEADING = re.compile(r'(#{1,6})\s+(.*)')
+_QUOTE = re.compile(r'>\s?(.*)')
+_BULLET = re.compile(r'(\s*)[*+-]\s+(.*)')
+_RULE = re.compile(r'\s*([-*_])(\s*\1){2,}\s*$')
+_FENCE = re.compile(r'\s*```\s*([\w#+.-]*)\s*$')
+
+# Внутри строки: ссылки и позиции, требующие разбора (все остальное — обычный текст)
+_LINK = re.compile(r'\[([^\]\n]*)\]\(((?:[^()\s]|\([^()\s]*\))+)\)')
+_INLINE_SPECIAL = re.compile(r'[\\`*_~\[]')
+_SAFE_URL = re.compile(r'(https?://|tg://|mailto:)', re.IGNORECASE)
+
+_ESCAPABLE = set('\\`*_{}[]()#+-.!~>|=')
+
+
+class _Dialect:
+    """Экранирование и разметка сущностей для одного режима parse_mode"""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        if mode == 'HTML':
+            self.text_table = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+            self.code_table = self.text_table
+            self.url_table = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'})
+            self.tags = {'bold': ('<b>', '</b>'), 'italic': ('<i>', '</i>'), 'strike': ('<s>', '</s>')}
+        else:
+            self.text_table = str.maketrans({char: '\\' + char for char in _MARKDOWN_V2_SPECIAL})
+            self.code_table = str.maketrans({'`': '\\`', '\\': '\\\\'})
+            self.url_table = str.maketrans({')': '\\)', '\\': '\\\\'})
+            self.tags = {'bold': ('*', '*'), 'italic': ('_', '_'), 'strike': ('~', '~')}
+
+    def text(self, value: str) -> str:
+        return value.translate(self.text_table)
+
+    def code(self, value: str) -> str:
+        if self.mode == 'HTML':
+            return f"<code>{value.translate(self.code_table)}</code>"
+        return f"`{value.translate(self.code_table)}`"
+
+    def link(self, label: str, url: str) -> str:
+        if self.mode == 'HTML':
+            return f'<a href="{url.translate(self.url_table)}">{self.text(label)}</a>'
+        return f"[{self.text(label)}]({url.translate(self.url_table)})"
+
+    def pre_open(self, language: str) -> str:
+        if self.mode == 'HTML':
+            return f'<pre><code class="language-{language}">' if language else '<pre>'
+        return f"```{language}\n"
+
+    def pre_close(self, language: str) -> str:
+        if self.mode == 'HTML':
+            return '</code></pre>' if language else '</pre>'
+        return "```"
+
+    def quote_line(self) -> str:
+        return '' if self.mode == 'HTML' else '>'
+
+
+class MarkdownRenderer:
+    """
+    Преобразует markdown модели в разметку Telegram (MarkdownV2 или HTML) за один проход
+
+    Текст можно подавать частями по мере генерации: text() в любой момент возвращает
+    корректную разметку для уже полученного префикса, незакрытые выделения, код и цитаты
+    закрываются автоматически. Завершенные строки разбираются один раз, при каждом
+    вызове заново обрабатывается только последняя, еще не законченная строка.
+    """
+
+    def __init__(self, mode: str = 'MarkdownV2'):
+        self.dialect = _Dialect(mode)
+        self._done = []        # Разметка завершенных строк
+        self._pending = ''     # Незавершенная последняя строка
+        self._code = None      # Язык открытого блока кода ('' — без языка), None — вне блока
+        self._code_empty = True
+        self._quote = False    # Открыта ли цитата (нужно только для HTML)
+
+    def feed(self, chunk: str):
+        """Добавляет очередную часть текста"""
+        lines = (self._pending + chunk).split('\n')
+        self._pending = lines.pop()
+        for line in lines:
+            rendered = self._line(line)
+            if rendered is not None:
+                self._done.append(rendered + '\n')
+
+    def text(self) -> str:
+        """Разметка всего полученного текста с закрытыми сущностями"""
+        parts = self._done[:]
+        state = (self._code, self._code_empty, self._quote)
+        if self._pending:
+            parts.append(self._line(self._pending) or '')
+        if self._code is not None and not self._code_empty:
+            tail = ''.join(parts)
+            parts = [tail if tail.endswith('\n') else tail + '\n', self.dialect.pre_close(self._code)]
+        elif self._quote:
+            parts.append('</blockquote>')
+        # Состояние незавершенной строки не фиксируется: следующая часть может ее изменить
+        self._code, self._code_empty, self._quote = state
+        return ''.join(parts)
+
+    # Строки -----------------------------------------------------------------
+
+    def _line(self, line: str):
+        """Разметка одной строки без перевода строки (None, если строка ничего не выводит)"""
+        dialect = self.dialect
+        fence = _FENCE.match(line)
+
+        if self._code is not None:
+            if fence and not fence.group(1):
+                language, was_empty = self._code, self._code_empty
+                self._code = None
+                # Пустой блок кода не выводится совсем
+                return None if was_empty else dialect.pre_close(language)
+            prefix = ''
+            if self._code_empty:
+                prefix = dialect.pre_open(self._code)
+                self._code_empty = False
+            return prefix + line.translate(dialect.code_table)
+
+        prefix = ''
+        if self._quote and not line.startswith('>'):
+            prefix = '</blockquote>'
+            self._quote = False
+
+        if fence:
+            # Открывающий тег выводится вместе с первой строкой кода
+            self._code = fence.group(1)
+            self._code_empty = True
+            return prefix or None
+
+        if _RULE.match(line):
+            return prefix + '————————'
+
+        heading = _HEADING.match(line)
+        if heading:
+            # Выделение внутри заголовка не нужно: заголовок целиком полужирный
+            content = heading.group(2).replace('**', '').replace('__', '')
+            return prefix + self._inline(content, outer='bold')
+
+        quote = _QUOTE.match(line)
+        if quote:
+            if dialect.mode == 'HTML' and not self._quote:
+                prefix += '<blockquote>'
+                self._quote = True
+            return prefix + dialect.quote_line() + self._inline(quote.group(1))
+
+        bullet = _BULLET.match(line)
+        if bullet:
+            return prefix + bullet.group(1) + '• ' + self._inline(bullet.group(2))
+
+        return prefix + self._inline(line)
+
+    # Выделение внутри строки ------------------------------------------------
+
+    def _inline(self, line: str, outer: str = None) -> str:
+        """Разбирает выделение, код и ссылки в одной строке; сущности не переходят на следующую строку"""
+        dialect = self.dialect
+        out = []
+        stack = []  # (вид сущности, позиция открывающего тега в out, исходный маркер)
+
+        def open_entity(kind: str, marker: str = None):
+            tag = dialect.tags[kind][0]
+            if tag == '_' and out and out[-1] == '_':
+                # Два подряд идущих _ Telegram читает как подчеркивание: разделяем их символом \r,
+                # который он игнорирует
+                tag = '\r_'
+            stack.append((kind, len(out), marker))
+            out.append(tag)
+
+        def close_top():
+            kind, position, marker = stack.pop()
+            if position == len(out) - 1:
+                # Пустая сущность недопустима, убираем открывающий тег
+                out.pop()
+            else:
+                out.append(dialect.tags[kind][1])
+            return kind, marker
+
+        def close_entity(kind: str):
+            # Вложенность должна быть правильной: закрываем верхние, затем открываем их снова
+            reopen = []
+            while stack[-1][0] != kind:
+                reopen.append(close_top())
+            close_top()
+            for other, marker in reversed(reopen):
+                open_entity(other, marker)
+
+        if outer:
+            open_entity(outer)
+
+        length = len(line)
+        position = 0
+        while position < length:
+            match = _INLINE_SPECIAL.search(line, position)
+            if match is None:
+                out.append(dialect.text(line[position:]))
+                break
+            index = match.start()
+            if index > position:
+                out.append(dialect.text(line[position:index]))
+            char = line[index]
+
+            if char == '\\' and index + 1 < length and line[index + 1] in _ESCAPABLE:
+                out.append(dialect.text(line[index + 1]))
+                position = index + 2
+                continue
+
+            if char == '`':
+                end = line.find('`', index + 1)
+                if end == -1:
+                    # Код еще не закрыт (текст приходит частями)
+                    end = length
+                if end > index + 1:
+                    out.append(dialect.code(line[index + 1:end]))
+                position = end + 1
+                continue
+
+            if char == '[':
+                link = _LINK.match(line, index)
+                if link and _SAFE_URL.match(link.group(2)):
+                    out.append(dialect.link(link.group(1) or link.group(2), link.group(2)))
+                    position = link.end()
+                    continue
+                out.append(dialect.text(char))
+                position = index + 1
+                continue
+
+            if char == '\\':
+                out.append(dialect.text(char))
+                position = index + 1
+                continue
+
+            # Серия маркеров выделения: *, **, _, __, ~~
+            run = 1
+            while index + run < length and line[index + run] == char and run < 2:
+                run += 1
+            if char == '~':
+                kind = 'strike' if run == 2 else None
+            elif run == 2:
+                kind = 'bold'
+            else:
+                kind = 'italic'
+
+            before = line[index - 1] if index > 0 else ' '
+            after = line[index + run] if index + run < length else ' '
+            can_open = not after.isspace()
+            can_close = not before.isspace()
+            if char == '_':
+                # Подчеркивание внутри слова (snake_case, a_(b)) не открывает и не закрывает выделение
+                can_open = can_open and not before.isalnum()
+                can_close = can_close and not after.isalnum()
+
+            if kind is not None and kind != outer and any(item[0] == kind for item in stack) and can_close:
+                close_entity(kind)
+            elif kind is not None and kind != outer and can_open and not any(item[0] == kind for item in stack):
+                open_entity(kind, line[index:index + run])
+            else:
+                out.append(dialect.text(line[index:index + run]))
+            position = index + run
+
+        while stack:
+            kind, position, marker = stack[-1]
+            if marker is None:
+                close_top()
+            else:
+                # Маркер без пары до конца строки — обычный текст
+                stack.pop()
+                out[position] = dialect.text(marker)
+        return ''.join(out)
+
+
+def render_markdown(text: str, mode: str = 'MarkdownV2') -> str:
+    """
+    Преобразует markdown ответа модели в разметку Telegram
+
+    Args:
+        text: Текст в markdown (может быть незаконченным префиксом ответа)
+        mode: MarkdownV2 или HTML
+
+    Returns:
+        str: Текст, который Telegram разберет без ошибок
+    """
+    renderer = MarkdownRenderer(mode)
+    renderer.feed(text)
+    return renderer.text()
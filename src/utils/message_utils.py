@@ -1,18 +1,145 @@
+import re
 import asyncio
 import logging
 from aiogram import types
-from aiogram.exceptions import TelegramRetryAfter
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
+from src.services.degradation import degradation
+from src.services.send_queue import send_queue, Priority
+from src.utils.markdown_renderer import render_markdown
 
 logger = logging.getLogger(__name__)
 
-async def send_message_with_retry(message: types.Message, text: str, retry_count: int = 3, reply_markup = None) -> types.Message:
+# Предельная длина текста сообщения в Telegram (после экранирования разметки)
+MESSAGE_LIMIT = 4096
+
+_FENCE_LINE = re.compile(r'^\s*```\s*([\w#+.-]*)\s*$', re.MULTILINE)
+
+
+def render_within_limit(text: str, limit: int = MESSAGE_LIMIT) -> tuple:
+    """
+    Преобразует начало текста в MarkdownV2 так, чтобы результат уместился в лимит сообщения
+
+    Экранирование удлиняет текст, поэтому при превышении лимита обрезается исходный
+    текст (а не разметка, чтобы не разорвать экранирование) пропорционально превышению.
+
+    Returns:
+        tuple: (использованная часть исходного текста, разметка)
+    """
+    rendered = render_markdown(text)
+    while len(rendered) > limit and text:
+        text = text[:min(len(text) - 1, len(text) * limit // len(rendered))]
+        rendered = render_markdown(text)
+    return text, rendered
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    """
+    Делит исходный текст на части, каждая из которых после разметки укладывается в лимит
+
+    Части режутся по переводу строки или пробелу, если они недалеко от предела;
+    блок кода, разрезанный между частями, открывается заново в следующей части.
+
+    Returns:
+        list: Пары (исходный текст части, разметка части)
+    """
+    parts = []
+    while True:
+        head, rendered = render_within_limit(text, limit)
+        if len(head) == len(text):
+            parts.append((head, rendered))
+            return parts
+        rest = text[len(head):]
+        cut = head.rfind('\n')
+        if cut <= len(head) // 2:
+            cut = head.rfind(' ')
+        if cut > len(head) // 2:
+            # Разделитель (перевод строки или пробел) не попадает ни в одну из частей
+            head, rest = head[:cut], text[cut + 1:]
+            rendered = render_markdown(head)
+        parts.append((head, rendered))
+        if not rest.strip():
+            return parts
+        fences = _FENCE_LINE.findall(head)
+        if len(fences) % 2:
+            rest = f"```{fences[-1]}\n{rest}"
+        text = rest
+
+
+def _is_parse_error(error: Exception) -> bool:
+    return isinstance(error, TelegramBadRequest) and "can't parse entities" in str(error).lower()
+
+
+def _edit_key(message: types.Message) -> tuple:
+    """Ключ, по которому очередь сливает правки одного сообщения"""
+    return ('edit', message.chat.id, message.message_id)
+
+
+def send_chat_action(message: types.Message, action: str = "typing"):
+    """Показывает статус чата (например, «печатает»), не дожидаясь отправки"""
+    send_queue.chat_action(message.bot, message.chat.id, action)
+
+
+def schedule_message_update(message: types.Message, text: str, priority: int = Priority.PROGRESS):
+    """
+    Ставит промежуточную правку сообщения в очередь без ожидания
+
+    Если предыдущая правка того же сообщения еще ждет отправки, она заменяется новой,
+    поэтому под нагрузкой пользователь видит последний текст, а лишние запросы не отправляются.
+    """
+    if not message:
+        return
+    # Промежуточный текст длиннее лимита показываем обрезанным: итоговый ответ будет разбит на части
+    _, rendered = render_within_limit(text)
+    send_queue.submit_nowait(
+        message.chat.id,
+        lambda: message.edit_text(rendered, parse_mode=ParseMode.MARKDOWN_V2),
+        priority,
+        _edit_key(message),
+    )
+
+async def send_message_with_retry(message: types.Message, text: str, retry_count: int = 3, reply_markup = None,
+                                  priority: int = Priority.FINAL) -> types.Message:
     """
     Отправляет сообщение с повторными попытками при ошибке флуд-контроля
+
+    Markdown ответа модели преобразуется в MarkdownV2; если Telegram все же не разобрал
+    разметку, сообщение отправляется обычным текстом без повторных попыток.
+    Запрос проходит через общую очередь отправки с указанным приоритетом.
     """
+    parts = split_message(text)
+    if len(parts) > 1:
+        logger.info(f"Ответ длиннее лимита сообщения, отправляем частями: {len(parts)}")
+    sent = None
+    for index, (part, rendered) in enumerate(parts):
+        # Клавиатура прикрепляется к последней части
+        markup = reply_markup if index == len(parts) - 1 else None
+        sent = await _send_part(message, part, rendered, retry_count, markup, priority)
+    return sent
+
+
+async def _send_part(message: types.Message, text: str, rendered: str, retry_count: int, reply_markup,
+                     priority: int) -> types.Message:
+    """Отправляет одну часть ответа, уже уложенную в лимит сообщения"""
+    chat_id = message.chat.id
     for attempt in range(retry_count):
         try:
-            return await message.answer(text, reply_markup=reply_markup)
+            return await send_queue.submit(
+                chat_id,
+                lambda: message.answer(rendered, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=reply_markup),
+                priority,
+            )
+        except TelegramBadRequest as e:
+            if not _is_parse_error(e):
+                logger.error(f"Ошибка при отправке сообщения: {str(e)}")
+                raise
+            logger.warning(f"Telegram не разобрал разметку, отправляем обычный текст: {str(e)}")
+            return await send_queue.submit(
+                chat_id, lambda: message.answer(text[:MESSAGE_LIMIT], parse_mode=None, reply_markup=reply_markup),
+                priority
+            )
         except TelegramRetryAfter as e:
+            degradation.record_flood(e.retry_after)
             if attempt < retry_count - 1:
                 wait_time = e.retry_after
                 logger.warning(f"Флуд-контроль, ожидание {wait_time} секунд...")
@@ -25,7 +152,8 @@ async def send_message_with_retry(message: types.Message, text: str, retry_count
             raise
     raise Exception("Не удалось отправить сообщение")
 
-async def update_message_with_retry(message: types.Message, text: str, retry_count: int = 3, reply_markup = None) -> bool:
+async def update_message_with_retry(message: types.Message, text: str, retry_count: int = 3, reply_markup = None,
+                                    priority: int = Priority.FINAL) -> bool:
     """
     Обновляет существующее сообщение с повторными попытками при ошибке флуд-контроля
     
@@ -34,6 +162,7 @@ async def update_message_with_retry(message: types.Message, text: str, retry_cou
         text: Новый текст
         retry_count: Количество попыток обновления
         reply_markup: Разметка клавиатуры
+        priority: Приоритет в очереди отправки (итоговая правка вытесняет ожидающие промежуточные)
         
     Returns:
         bool: True если обновление успешно, False в противном случае
@@ -41,12 +170,36 @@ async def update_message_with_retry(message: types.Message, text: str, retry_cou
     if not message:
         logger.error("Попытка обновить пустое сообщение")
         return False
-        
+
+    # Не уместившийся в сообщение остаток ответа отправляется следующими сообщениями
+    parts = split_message(text)
+    part, rendered = parts[0]
+    markup = reply_markup if len(parts) == 1 else None
+    if not await _edit_part(message, part, rendered, retry_count, markup, priority):
+        return False
+    for index, (part, rendered) in enumerate(parts[1:], start=2):
+        markup = reply_markup if index == len(parts) else None
+        try:
+            await _send_part(message, part, rendered, retry_count, markup, priority)
+        except Exception as e:
+            logger.error(f"Не удалось отправить продолжение ответа: {str(e)}")
+            return False
+    return True
+
+
+async def _edit_part(message: types.Message, text: str, rendered: str, retry_count: int, reply_markup,
+                     priority: int) -> bool:
+    """Правит сообщение одной частью ответа, уже уложенной в лимит сообщения"""
     for attempt in range(retry_count):
         try:
-            await message.edit_text(text, reply_markup=reply_markup)
+            if rendered is None:
+                call = lambda: message.edit_text(text[:MESSAGE_LIMIT], parse_mode=None, reply_markup=reply_markup)
+            else:
+                call = lambda: message.edit_text(rendered, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=reply_markup)
+            await send_queue.submit(message.chat.id, call, priority, _edit_key(message))
             return True
         except TelegramRetryAfter as e:
+            degradation.record_flood(e.retry_after)
             if attempt < retry_count - 1:
                 wait_time = e.retry_after
                 logger.warning(f"Флуд-контроль, ожидание {wait_time} секунд...")
@@ -55,6 +208,11 @@ async def update_message_with_retry(message: types.Message, text: str, retry_cou
                 logger.error(f"Не удалось обновить сообщение после {retry_count} попыток из-за флуд-контроля")
                 return False
         except Exception as e:
+            if rendered is not None and _is_parse_error(e):
+                # Следующая попытка — обычным текстом, без разметки
+                logger.warning(f"Telegram не разобрал разметку, обновляем обычным текстом: {str(e)}")
+                rendered = None
+                continue
             logger.error(f"Ошибка при обновлении сообщения: {str(e)}")
             if "message is not modified" in str(e).lower():
                 # Если сообщение не изменилось, считаем это успехом
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Асинхронный ограничитель частоты по алгоритму token bucket
+
+    Args:
+        rate: Скорость пополнения (токенов в секунду)
+        capacity: Максимальное количество накопленных токенов
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("Скорость пополнения должна быть положительной")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        """Пополняет бакет токенами, накопленными с последнего обращения"""
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """
+        Пытается забрать токены без ожидания
+
+        Returns:
+            bool: True если токены получены
+        """
+        self._refill(time.monotonic())
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def delay_until_available(self, tokens: float = 1.0) -> float:
+        """
+        Возвращает время ожидания (в секундах) до появления нужного количества токенов
+        """
+        self._refill(time.monotonic())
+        missing = tokens - self._tokens
+        return 0.0 if missing <= 0 else missing / self.rate
+
+    async def acquire(self, tokens: float = 1.0):
+        """Ожидает, пока в бакете появятся токены, и забирает их"""
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep(self.delay_until_available(tokens))
@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+import asyncio
+
+import pytest
+
+# Добавляем корень проекта в путь
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.config.config import EXTRACTION_CONFIG
+from src.services import document_extractor
+from src.services.document_extractor import DocumentExtractor, ExtractionError
+
+
+def _sleepy_extract(data: bytes, file_name: str, char_budget: int, time_limit: float) -> dict:
+    """Вместо разбора ждет столько секунд, сколько записано в данных (выполняется в процессе пула)"""
+    time.sleep(float(data))
+    return {'text': file_name, 'truncated': False, 'parts': 1, 'kind': 'pdf'}
+
+
+def test_hanging_document_does_not_fail_concurrent_one(monkeypatch):
+    monkeypatch.setitem(EXTRACTION_CONFIG, 'time_limit', 2.0)
+    monkeypatch.setitem(EXTRACTION_CONFIG, 'kill_grace', 0.5)
+    monkeypatch.setattr(document_extractor, 'extract_document', _sleepy_extract)
+    extractor = DocumentExtractor()
+
+    async def healthy():
+        # Задание еще выполняется, когда зависшее превышает лимит и пул перезапускается
+        await asyncio.sleep(1.5)
+        return await extractor.extract(b'1.5', 'healthy.pdf', 100)
+
+    async def scenario():
+        return await asyncio.gather(
+            extractor.extract(b'60', 'hanging.pdf', 100),
+            healthy(),
+            return_exceptions=True,
+        )
+
+    try:
+        hanging, result = asyncio.run(scenario())
+    finally:
+        extractor.shutdown()
+    assert isinstance(hanging, ExtractionError)
+    assert result['text'] == 'healthy.pdf'
@@ -0,0 +1,197 @@
+import os
+import sys
+import time
+import random
+from html.parser import HTMLParser
+
+import pytest
+
+# Добавляем корень проекта в путь
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.utils.markdown_renderer import render_markdown, MarkdownRenderer
+
+_SPECIAL = set('_*[]()~`>#+-=|{}.!\\')
+
+SAMPLE = """## Рецепт борща (на 4 порции)
+
+Вот **простой рецепт**. Вам понадобится:
+
+* Свекла — 2 шт.
+* Капуста: *половина* кочана
+  - морковь_и_лук (по 1 шт.)
+1. Сварите бульон (1.5 часа)!
+2. Добавьте `соль` и перец = по вкусу.
+
+> Совет: ~~не~~ *перевари**те*** свеклу, _а_*потом* *тушите*_дольше_.
+
+```python
+def borsch(x_1, y):
+    return x_1 * y  # `комментарий` \\ слеш
+```
+
+Подробнее: [ссылка](https://example.com/a_(b)) и [плохая](/rel). Формула 2 * 3 = 6, a_b_c, __жирный__, snake_case_name.
+---
+Итог: 100% {готово} | #хэштег +1 -1 <b>не тег</b> & т.д.
+"""
+
+# Текст примерно на 1 МБ для проверки пропускной способности
+_BIG = SAMPLE * (1_000_000 // len(SAMPLE))
+# Минимальная допустимая скорость (МБ/с) с большим запасом для медленных машин
+_MIN_THROUGHPUT = 0.5
+
+
+def validate_markdown_v2(text: str):
+    """Проверяет, что Telegram разберет текст в режиме MarkdownV2 без ошибок"""
+    position, length, stack, line_start = 0, len(text), [], True
+    while position < length:
+        char = text[position]
+        if text.startswith('```', position):
+            end = text.find('```', position + 3)
+            assert end != -1, ('незакрытый блок кода', text[position:position + 40])
+            body, index = text[position + 3:end], 0
+            while index < len(body):
+                if body[index] == '\\':
+                    assert index + 1 < len(body) and body[index + 1] in '`\\', ('экранирование в блоке кода', body[index:index + 5])
+                    index += 2
+                    continue
+                index += 1
+            position = end + 3
+            continue
+        if char == '\\':
+            assert position + 1 < length and text[position + 1] in _SPECIAL, ('лишнее экранирование', text[position:position + 5])
+            position += 2
+            line_start = False
+            continue
+        if char == '`':
+            end = position + 1
+            while True:
+                assert end < length, 'незакрытый код'
+                if text[end] == '\\':
+                    end += 2
+                    continue
+                if text[end] == '`':
+                    break
+                end += 1
+            assert end > position + 1, 'пустой код'
+            position = end + 1
+            continue
+        if char in '*_~':
+            # Рендерер не выводит подчеркивание, а __ Telegram читает именно как его
+            assert not text.startswith('__', position), ('подчеркивание', text[max(0, position - 20):position + 20])
+            if stack and stack[-1] == char:
+                stack.pop()
+            else:
+                assert char not in stack, ('пересечение сущностей', text[max(0, position - 20):position + 20])
+                stack.append(char)
+            position += 1
+            continue
+        if char == '[':
+            index = text.index('](', position) + 2
+            while text[index] != ')':
+                if text[index] == '\\':
+                    assert text[index + 1] in ')\\'
+                    index += 2
+                    continue
+                index += 1
+            position = index + 1
+            continue
+        if char == '>':
+            assert line_start, ('> не в начале строки', text[max(0, position - 10):position + 10])
+            position += 1
+            line_start = False
+            continue
+        assert char not in _SPECIAL, ('неэкранированный символ', char, text[max(0, position - 20):position + 20])
+        line_start = char == '\n'
+        position += 1
+    assert not stack, ('незакрытая сущность', stack, text[-60:])
+
+
+class _TagChecker(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.stack = []
+
+    def handle_starttag(self, tag, attrs):
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        assert self.stack and self.stack[-1] == tag, (tag, self.stack)
+        self.stack.pop()
+
+
+def validate_html(text: str):
+    """Проверяет вложенность тегов в режиме HTML"""
+    checker = _TagChecker()
+    checker.feed(text)
+    checker.close()
+    assert not checker.stack, checker.stack
+
+
+_VALIDATORS = {'MarkdownV2': validate_markdown_v2, 'HTML': validate_html}
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('_a_*b*', '_a_\r_b_'),
+    ('*a*_b_', '_a_\r_b_'),
+    ('*a*_b', '_a_\\_b'),
+    ('**a**_b_', '*a*_b_'),
+])
+def test_adjacent_italic(text, expected):
+    assert render_markdown(text) == expected
+    validate_markdown_v2(render_markdown(text))
+
+
+@pytest.mark.parametrize('mode', _VALIDATORS)
+def test_every_prefix_is_valid(mode):
+    validate = _VALIDATORS[mode]
+    for cut in range(len(SAMPLE) + 1):
+        validate(render_markdown(SAMPLE[:cut], mode))
+
+
+@pytest.mark.parametrize('mode', _VALIDATORS)
+def test_streaming_matches_full_render(mode):
+    validate = _VALIDATORS[mode]
+    renderer = MarkdownRenderer(mode)
+    for start in range(0, len(SAMPLE), 7):
+        renderer.feed(SAMPLE[start:start + 7])
+        validate(renderer.text())
+    assert renderer.text() == render_markdown(SAMPLE, mode)
+
+
+@pytest.mark.parametrize('mode', _VALIDATORS)
+def test_random_text_is_valid(mode):
+    validate = _VALIDATORS[mode]
+    alphabet = list('ab _*~`[]()#>-.!\n\\') + ['**', '```', '```py\n', '[x](https://e.com)', '\n* ', '\n# ']
+    rnd = random.Random(1)
+    for _ in range(3000):
+        text = ''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 40)))
+        output = render_markdown(text, mode)
+        try:
+            validate(output)
+        except AssertionError as e:
+            raise AssertionError((text, output)) from e
+
+
+@pytest.mark.parametrize('mode', _VALIDATORS)
+def test_render_throughput(mode):
+    started = time.perf_counter()
+    output = render_markdown(_BIG, mode)
+    elapsed = time.perf_counter() - started
+    _VALIDATORS[mode](output)
+    assert len(_BIG) / 1e6 / elapsed >= _MIN_THROUGHPUT
+
+
+@pytest.mark.parametrize('chunk_size', [64, 4096])
+def test_streaming_throughput(chunk_size):
+    started = time.perf_counter()
+    renderer = MarkdownRenderer()
+    for start in range(0, len(_BIG), chunk_size):
+        renderer.feed(_BIG[start:start + chunk_size])
+        # Промежуточный текст запрашивается так же часто, как при редактировании сообщения
+        if start % 4096 == 0:
+            renderer.text()
+    output = renderer.text()
+    elapsed = time.perf_counter() - started
+    assert output == render_markdown(_BIG)
+    assert len(_BIG) / 1e6 / elapsed >= _MIN_THROUGHPUT
@@ -0,0 +1,75 @@
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+# Добавляем корень проекта в путь
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.utils.message_utils import MESSAGE_LIMIT, split_message, send_message_with_retry, update_message_with_retry
+from test_markdown_renderer import validate_markdown_v2
+
+# Точки, дефисы и скобки при экранировании удваиваются: текст короче лимита, разметка — длиннее
+ESCAPE_HEAVY = ('Версия 1.2.3-rc.4 (см. п. 5.6).\n' * 120).strip()
+CODE_HEAVY = "Пример:\n```python\n" + "x = a.b(c) - d.e  # f.g\n" * 300 + "```\nГотово."
+
+
+class FakeMessage:
+    """Сообщение, которое записывает отправленные и отредактированные тексты"""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(id=1)
+        self.message_id = 1
+        self.answers = []
+        self.edits = []
+
+    async def answer(self, text, parse_mode=None, reply_markup=None):
+        assert len(text) <= MESSAGE_LIMIT
+        self.answers.append((text, reply_markup))
+        return self
+
+    async def edit_text(self, text, parse_mode=None, reply_markup=None):
+        assert len(text) <= MESSAGE_LIMIT
+        self.edits.append((text, reply_markup))
+        return self
+
+
+@pytest.mark.parametrize('text', [ESCAPE_HEAVY, CODE_HEAVY], ids=['escapes', 'code'])
+def test_split_message_fits_limit(text):
+    parts = split_message(text)
+    assert len(parts) > 1
+    for _, rendered in parts:
+        assert len(rendered) <= MESSAGE_LIMIT
+        validate_markdown_v2(rendered)
+
+
+def test_split_message_keeps_text():
+    assert len(ESCAPE_HEAVY) < MESSAGE_LIMIT
+    # Разрезы проходят по переводам строк, исходный текст не теряется
+    assert '\n'.join(source for source, _ in split_message(ESCAPE_HEAVY)) == ESCAPE_HEAVY
+
+
+def test_code_block_reopened_in_next_part():
+    parts = split_message(CODE_HEAVY)
+    assert parts[1][0].startswith('```python\n')
+
+
+def test_short_text_is_single_part():
+    assert split_message('Привет.') == [('Привет.', 'Привет\\.')]
+
+
+def test_send_long_answer_in_parts():
+    message = FakeMessage()
+    asyncio.run(send_message_with_retry(message, ESCAPE_HEAVY, reply_markup='keyboard'))
+    assert len(message.answers) > 1
+    # Клавиатура только у последней части
+    assert [markup for _, markup in message.answers] == [None] * (len(message.answers) - 1) + ['keyboard']
+
+
+def test_update_long_answer_sends_rest():
+    message = FakeMessage()
+    assert asyncio.run(update_message_with_retry(message, ESCAPE_HEAVY, reply_markup='keyboard'))
+    assert message.edits == [(message.edits[0][0], None)]
+    assert message.answers and message.answers[-1][1] == 'keyboard'
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# Добавляем корень проекта в путь
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.services.model_router import ModelRouter
+
+
+@pytest.fixture
+def router():
+    return ModelRouter()
+
+
+@pytest.mark.parametrize('text', ['Привет!', 'спасибо большое', 'Спасибо!!', 'до свидания', 'добрый день', 'thank you'])
+def test_small_talk_is_chat(router, text):
+    assert router.classify('text', text) == 'chat'
+
+
+@pytest.mark.parametrize('text', [
+    'Какой сегодня день недели?',
+    'привет, напиши функцию сортировки на python',
+    'большое ли солнце?',
+    'до скольки работает почта',
+])
+def test_question_with_chat_words_is_not_chat(router, text):
+    assert router.classify('text', text) == 'short'
+
+
+def test_code_route(router):
+    code = "def f(x):\n    return x\n\nclass A:\n    pass\n"
+    assert router.classify('text', code) == 'code'
+    assert router.classify('file', code, 'notes.txt') == 'code_file'
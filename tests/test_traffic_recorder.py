@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+
+# Добавляем корень проекта в путь
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.services.traffic_recorder import TrafficRecorder
+
+CHAT = {'id': 123456789, 'type': 'private', 'first_name': 'Иван', 'username': 'ivan_petrov'}
+
+
+def _message(**fields) -> dict:
+    return {'update_id': 1, 'message': {'message_id': 10, 'date': 1700000000, 'chat': CHAT, 'from': CHAT, **fields}}
+
+
+def _recorder() -> TrafficRecorder:
+    return TrafficRecorder(path='', config={'path': None, 'salt': 'test', 'flush_every': 100, 'keep_texts': []})
+
+
+def test_location_and_venue_are_masked():
+    location = {'latitude': 55.751244, 'longitude': 37.618423, 'horizontal_accuracy': 15.0}
+    update = _message(venue={
+        'location': location,
+        'title': 'Кафе «Пушкинъ»',
+        'address': 'Тверской бульвар, 26А',
+        'foursquare_id': '4b5bc8a4f964a520b71229e3',
+    })
+    anonymized = _recorder().anonymize(update)
+    venue = anonymized['message']['venue']
+    assert venue['location']['latitude'] == 0.0 and venue['location']['longitude'] == 0.0
+    dump = json.dumps(anonymized, ensure_ascii=False)
+    for secret in ('55.75', '37.61', 'Пушкинъ', 'Тверской', '4b5bc8a4'):
+        assert secret not in dump
+
+    live = _recorder().anonymize(_message(location=location))
+    assert live['message']['location']['latitude'] == 0.0
+
+
+def test_poll_forward_and_links_are_masked():
+    update = _message(
+        text='Смотри сайт',
+        entities=[{'type': 'text_link', 'offset': 0, 'length': 7, 'url': 'https://example.com/ivan'}],
+        forward_origin={'type': 'hidden_user', 'date': 1700000000, 'sender_user_name': 'Мария Иванова'},
+        poll={'id': '5012', 'question': 'Где встретимся?', 'type': 'regular',
+              'options': [{'text': 'У метро Арбатская', 'voter_count': 1}]},
+    )
+    anonymized = _recorder().anonymize(update)
+    message = anonymized['message']
+    dump = json.dumps(anonymized, ensure_ascii=False)
+    for secret in ('example', 'ivan', 'Мария', 'встретимся', 'Арбатская', 'Иван'):
+        assert secret not in dump
+    # Служебные поля и форма текста сохраняются для воспроизведения
+    assert message['entities'][0]['type'] == 'text_link'
+    assert message['poll']['type'] == 'regular'
+    assert message['chat']['type'] == 'private'
+    assert len(message['text']) == len('Смотри сайт')
+    assert message['chat']['id'] != CHAT['id']
+    assert message['chat']['id'] == message['from']['id']
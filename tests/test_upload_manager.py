@@ -0,0 +1,73 @@
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+# Добавляем корень проекта в путь
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.services.upload_manager import UploadManager
+
+
+class FakeUploads(UploadManager):
+    """Менеджер, который вместо File API «загружает» файл за заданное время"""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+        self.calls = 0
+
+    async def _upload(self, data: bytes, mime_type: str, slot=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(name=f"files/{self.calls}", expiration_time=None)
+
+
+def test_concurrent_uploads_are_coalesced():
+    manager = FakeUploads(0.05)
+
+    async def scenario():
+        return await asyncio.gather(*(manager.get_or_upload(b'image') for _ in range(3)))
+
+    results = asyncio.run(scenario())
+    assert manager.calls == 1
+    assert {result.name for result in results} == {'files/1'}
+
+
+def test_waiters_survive_cancelled_uploader():
+    manager = FakeUploads(0.1)
+
+    async def scenario():
+        uploader = asyncio.create_task(manager.get_or_upload(b'image'))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.create_task(manager.get_or_upload(b'image')) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        # Запрос, начавший загрузку, отменен (например, его вытеснил более новый)
+        uploader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await uploader
+        return await asyncio.gather(*waiters)
+
+    results = asyncio.run(scenario())
+    # Загрузку повторил один из ожидавших, второй получил ее результат
+    assert manager.calls == 2
+    assert {result.name for result in results} == {'files/2'}
+
+
+def test_cancelled_waiter_does_not_affect_upload():
+    manager = FakeUploads(0.05)
+
+    async def scenario():
+        uploader = asyncio.create_task(manager.get_or_upload(b'image'))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(manager.get_or_upload(b'image'))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await uploader
+
+    assert asyncio.run(scenario()).name == 'files/1'
+    assert manager.calls == 1